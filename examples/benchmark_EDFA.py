@@ -0,0 +1,102 @@
+# %% [markdown]
+# # Benchmark of the EDFA algorithms of edfaSM
+
+# %%
+import os.path as path
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.constants import c
+
+from optic.core import parameters
+from optic.amplification import edfaSM
+
+# %% [markdown]
+# ## Parameters
+
+# %%
+def edfaParam(algo, **kwargs):
+    param_edfa = parameters()
+    # Gain control
+    param_edfa.type     = "none"
+    # Pump configuration
+    param_edfa.forPump  = {'pump_signal': np.array([ 50e-3]), 'pump_lambda': np.array([980e-9])}
+    param_edfa.bckPump  = {'pump_signal': np.array([000e-3]), 'pump_lambda': np.array([980e-9])}
+    # EDF parameters
+    param_edfa.file     = path.join(path.abspath(path.join("../")), 'optic', 'ampParams', 'giles_MP980.dat')
+    param_edfa.fileunit = 'nm'
+    # Algorithm
+    param_edfa.algo     = algo
+    param_edfa.gmtc     = 'Bessel'
+    param_edfa.tol      = 0.05
+    param_edfa.tolCtrl  = 0.5
+    for key, value in kwargs.items():
+        setattr(param_edfa, key, value)
+    return param_edfa
+
+# %%
+# WDM comb: 8 CW channels, 500 GHz spacing around 1545 nm
+Nch  = 8
+Fc   = c/1545e-9
+Fs   = 7.68e12
+N    = 2**14
+Pch_dBm  = -20
+freqGrid = (np.arange(Nch) - (Nch - 1) / 2) * 500e9
+
+t = np.arange(N)
+sigTxWDM = np.zeros((N, 1), dtype="complex")
+for f in freqGrid:
+    sigTxWDM[:, 0] += np.sqrt(10**(Pch_dBm/10 - 3)) * np.exp(1j * 2 * np.pi * (f / Fs) * t)
+
+# %%
+def channelGain(Ein, Eout):
+    freq = Fs * np.fft.fftfreq(N)
+    ind = np.searchsorted(freq[np.argsort(freq)], freqGrid)
+    ind = np.argsort(freq)[ind]
+    Pin  = np.abs(np.fft.fft(Ein[:, 0])[ind])**2
+    Pout = np.abs(np.fft.fft(Eout[:, 0])[ind])**2
+    return 10 * np.log10(Pout / Pin)
+
+# %% [markdown]
+# ## Benchmark
+#
+# Each model is run without the solution cache, so that every call solves the
+# amplifier from scratch, and with the cache, as in a Monte Carlo loop where
+# only the noise realization changes.
+
+# %%
+algos = ["Giles_spectrum", "Saleh", "Jopson", "Inhomogeneous"]
+runs = 10
+
+gains = {}
+for algo in algos:
+    edfaSM(sigTxWDM, Fs, Fc, edfaParam(algo))  # compile and load the fiber data
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        Eout, PumpF, PumpB, noisef = edfaSM(sigTxWDM, Fs, Fc, edfaParam(algo, cache=False))
+    timeSolve = (time.perf_counter() - start) / runs
+
+    param_edfa = edfaParam(algo)
+    start = time.perf_counter()
+    for _ in range(runs):
+        Eout, PumpF, PumpB, noisef = edfaSM(sigTxWDM, Fs, Fc, param_edfa)
+    timeCache = (time.perf_counter() - start) / runs
+
+    gains[algo] = channelGain(sigTxWDM, Eout)
+    print('%-15s solve: %7.2f ms - cached: %7.2f ms - residual pump: %5.2f mW'
+          %(algo, 1e3*timeSolve, 1e3*timeCache, 1e3*PumpF[1]))
+
+# %%
+print('Gain difference to Giles_spectrum [dB]')
+for algo in algos[1:]:
+    print('%-15s' %(algo), np.round(gains[algo] - gains["Giles_spectrum"], 3))
+
+# %%
+plt.figure(figsize=(10, 3))
+for algo in algos:
+    plt.plot(1e9 * c / (Fc + freqGrid), gains[algo], 'o-', label=algo)
+plt.xlabel('Wavelength [nm]')
+plt.ylabel('Gain [dB]')
+plt.legend()
+plt.grid(True)
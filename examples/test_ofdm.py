@@ -109,3 +109,41 @@ plt.xticks(fontsize = 14)
 plt.yticks(fontsize = 14)
 plt.grid()
 
+
+# ## Streaming receiver: ideal channel with sparse pilots
+
+# In[9]:
+
+
+from optic.ofdm import ofdmRxStream, schmidlCoxPreamble
+from optic.core import parameters
+
+# Frames of the default FFT window backoff (G//4) and of backoff = 0 must
+# be demodulated without error, in one chunk and in several chunks, with
+# pilots sparser than the phase ramp of the backoff allows to unwrap.
+Nfft, G = 64, 16
+pilot   = 1 + 1j
+nFrames = 5
+rng     = np.random.default_rng(2)
+
+for hermitSym, pilotCarriers, backoffs in [
+    (False, np.arange(0, 64, 10), [G//4, 0]),
+    (True, np.array([0, 10, 20, 30]), [G//4]),
+]:
+    N = Nfft//2 - 1 if hermitSym else Nfft
+    symbTx = np.exp(1j*np.pi/4*(2*rng.integers(0, 4, nFrames*(N - len(pilotCarriers))) + 1))
+
+    preamble, _ = schmidlCoxPreamble(Nfft, G, hermitSym)
+    sigRx = np.concatenate((np.zeros(37), preamble,
+                            modulateOFDM(Nfft, G, pilot, pilotCarriers, symbTx, hermitSym)))
+
+    for backoff in backoffs:
+        paramRx = parameters()
+        paramRx.backoff = backoff
+        for chunks in [[sigRx], np.array_split(sigRx, 7)]:
+            frames = list(ofdmRxStream(chunks, Nfft, G, pilot, pilotCarriers, hermitSym, paramRx))
+            assert len(frames) == nFrames, 'the last frame was not demodulated'
+            err = np.max(np.abs(np.concatenate(frames) - symbTx))
+            assert err < 1e-9, f'hermitSym = {hermitSym}, backoff = {backoff}: error {err}'
+        print(f'hermitSym = {hermitSym}, backoff = {backoff}: max. error = {err:.2e}')
+
@@ -1,13 +1,11 @@
 import os
 
 import numpy as np
-import numpy.matlib as npmat
 import matplotlib.pyplot as plt
 import matplotlib.mlab as mlab
 
-from scipy import interpolate
 from numpy.fft import fft, ifft, fftfreq
-from scipy.integrate import solve_ivp
+from scipy.integrate import solve_ivp, trapezoid
 
 import pandas as pd
 from scipy.signal import find_peaks
@@ -19,8 +17,13 @@ from scipy.constants import c, Planck
 from scipy.special import jv, kv
 
 from simple_pid import PID
+from numba import njit
 import logging as logg
 import copy
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import get_context
 
 from optic.core import parameters
 
@@ -126,10 +129,8 @@ def gilesSpectrum(z, P, properties):
         Increment of the amplified optical signal.
 
     """
-    n2_norm = getN2Pop(P, properties)
-    xi_k   = n2_norm * properties.const3 - properties.const4
-    tauASE = n2_norm * properties.const5
-    return properties.uk * (P * xi_k + properties.ASE * tauASE)
+    rhs, _, args = gilesKernels(properties)
+    return rhs(P, *args, np.empty_like(P))
 
 def gilesSpatial(z, P, properties, param_edf):
     """
@@ -150,11 +151,8 @@ def gilesSpatial(z, P, properties, param_edf):
         Increment of the amplified optical signal.
 
     """
-    n2_norm = getN2Pop(P, properties)
-    intOL = getOverlapInt(n2_norm, properties, param_edf)
-    xi_k = intOL * (properties.absCoef + properties.gainCoef) / properties.gamma - (properties.absCoef + properties.lossS)
-    tauASE = intOL * (properties.gainCoef / properties.gamma) * Planck * properties.freq * properties.noiseBand
-    return properties.uk * (P * xi_k + properties.ASE * tauASE)
+    rhs, _, args = gilesKernels(properties, param_edf)
+    return rhs(P, *args, np.empty_like(P))
 
 def getN2Pop(P, properties):
     """
@@ -199,8 +197,323 @@ def getOverlapInt(n2_norm, properties, param_edf):
         Overlap integral between the field envelope and the doping profile.
 
     """     
-    dopPrf = npmat.repmat(2 * np.pi * param_edf.r * n2_norm, np.shape(properties.i_k)[1], 1) * param_edf.dr
-    return np.trapz(np.transpose(properties.i_k) * dopPrf)
+    dopPrf = 2 * np.pi * param_edf.r * n2_norm * param_edf.dr
+    return trapezoid(np.transpose(properties.i_k) * dopPrf)
+
+
+@njit(cache=True)
+def gilesSpectrumKernel(P, uk, ASE, const1, const2, const3, const4, const5, dP):
+    """
+    Compiled right-hand side of the spectral Giles model.
+
+    Parameters
+    ----------
+    P : np.array
+        Signal power (signal + pump + ASE).
+    uk : np.array
+        Propagation direction of each component (+1, -1 or 0).
+    ASE : np.array
+        Indicator of the ASE components.
+    const1, const2, const3, const4, const5 : np.array
+        Constants of the rate and propagation equations (see updtCnst).
+    dP : np.array
+        Output buffer.
+
+    Returns
+    -------
+    dP : np.array
+        Increment of the optical powers.
+
+    """
+    T1 = 0.0
+    T2 = 1.0
+    for k in range(P.size):
+        T1 += P[k] * const1[k]
+        T2 += P[k] * const2[k]
+    n2 = T1 / T2
+    for k in range(P.size):
+        dP[k] = uk[k] * (P[k] * (n2 * const3[k] - const4[k]) + ASE[k] * n2 * const5[k])
+    return dP
+
+
+@njit(cache=True)
+def gilesSpectrumJacKernel(P, uk, ASE, const1, const2, const3, const4, const5, J):
+    """
+    Analytic Jacobian of gilesSpectrumKernel.
+
+    The Jacobian is the sum of a diagonal and a rank-one term, since all
+    components share the same metastable population.
+
+    Parameters
+    ----------
+    P, uk, ASE, const1, const2, const3, const4, const5 : np.array
+        See gilesSpectrumKernel.
+    J : np.array
+        Output buffer, shape (P.size, P.size).
+
+    Returns
+    -------
+    J : np.array
+        Jacobian matrix dF/dP.
+
+    """
+    T1 = 0.0
+    T2 = 1.0
+    for k in range(P.size):
+        T1 += P[k] * const1[k]
+        T2 += P[k] * const2[k]
+    n2 = T1 / T2
+    dn2 = (const1 - n2 * const2) / T2
+    for k in range(P.size):
+        s = uk[k] * (P[k] * const3[k] + ASE[k] * const5[k])
+        for j in range(P.size):
+            J[k, j] = s * dn2[j]
+        J[k, k] += uk[k] * (n2 * const3[k] - const4[k])
+    return J
+
+
+@njit(cache=True)
+def gilesSpatialKernel(P, uk, ASE, i_k, W, a1, a2, const3, const4, const5, dP):
+    """
+    Compiled right-hand side of the spatial Giles model.
+
+    Parameters
+    ----------
+    P : np.array
+        Signal power (signal + pump + ASE).
+    uk : np.array
+        Propagation direction of each component (+1, -1 or 0).
+    ASE : np.array
+        Indicator of the ASE components.
+    i_k : np.array
+        Normalized field intensity, shape (Nr, P.size).
+    W : np.array
+        Radial quadrature weights of the overlap integral.
+    a1, a2 : np.array
+        Absorption and absorption + emission rate constants (see spatialCnst).
+    const3, const4, const5 : np.array
+        Gain, loss and ASE constants (see spatialCnst).
+    dP : np.array
+        Output buffer.
+
+    Returns
+    -------
+    dP : np.array
+        Increment of the optical powers.
+
+    """
+    Nr, K = i_k.shape
+    intOL = np.zeros(K)
+    for r in range(Nr):
+        T1 = 0.0
+        T2 = 1.0
+        for k in range(K):
+            T1 += i_k[r, k] * P[k] * a1[k]
+            T2 += i_k[r, k] * P[k] * a2[k]
+        wn2 = W[r] * T1 / T2
+        for k in range(K):
+            intOL[k] += i_k[r, k] * wn2
+    for k in range(K):
+        dP[k] = uk[k] * (
+            P[k] * (intOL[k] * const3[k] - const4[k]) + ASE[k] * intOL[k] * const5[k]
+        )
+    return dP
+
+
+@njit(cache=True)
+def gilesSpatialJacKernel(P, uk, ASE, i_k, W, a1, a2, const3, const4, const5, J):
+    """
+    Analytic Jacobian of gilesSpatialKernel.
+
+    Parameters
+    ----------
+    P, uk, ASE, i_k, W, a1, a2, const3, const4, const5 : np.array
+        See gilesSpatialKernel.
+    J : np.array
+        Output buffer, shape (P.size, P.size).
+
+    Returns
+    -------
+    J : np.array
+        Jacobian matrix dF/dP.
+
+    """
+    Nr, K = i_k.shape
+    A = np.empty((Nr, K))
+    B = np.empty((Nr, K))
+    intOL = np.zeros(K)
+    for r in range(Nr):
+        T1 = 0.0
+        T2 = 1.0
+        for k in range(K):
+            T1 += i_k[r, k] * P[k] * a1[k]
+            T2 += i_k[r, k] * P[k] * a2[k]
+        n2 = T1 / T2
+        for k in range(K):
+            A[r, k] = W[r] * i_k[r, k]
+            B[r, k] = i_k[r, k] * (a1[k] - n2 * a2[k]) / T2
+            intOL[k] += A[r, k] * n2
+    J[:, :] = A.T @ B
+    for k in range(K):
+        s = uk[k] * (P[k] * const3[k] + ASE[k] * const5[k])
+        for j in range(K):
+            J[k, j] *= s
+        J[k, k] += uk[k] * (intOL[k] * const3[k] - const4[k])
+    return J
+
+
+def gilesKernels(properties, param_edf=None):
+    """
+    Select the compiled rate-equation kernels of the EDFA algorithm.
+
+    Parameters
+    ----------
+    properties : object with constants and edfa parameters.
+    param_edf  : object with edf parameters (Giles_spatial only).
+
+    Returns
+    -------
+    rhs : function
+        Compiled right-hand side, rhs(P, *args, dP).
+    jac : function
+        Compiled Jacobian, jac(P, *args, J).
+    args : tuple
+        Constant arguments of the kernels.
+
+    """
+    if properties.algo == "Giles_spatial":
+        if not hasattr(properties, "W"):
+            properties = spatialCnst(properties, param_edf)
+        args = (
+            properties.uk,
+            properties.ASE,
+            properties.i_k,
+            properties.W,
+            properties.a1,
+            properties.a2,
+            properties.const3,
+            properties.const4,
+            properties.const5,
+        )
+        return gilesSpatialKernel, gilesSpatialJacKernel, args
+
+    args = (
+        properties.uk,
+        properties.ASE,
+        properties.const1,
+        properties.const2,
+        properties.const3,
+        properties.const4,
+        properties.const5,
+    )
+    return gilesSpectrumKernel, gilesSpectrumJacKernel, args
+
+
+def rk4Solve(rhs, zSpan, P0, nSteps, args=()):
+    """
+    Fixed-step fourth-order Runge-Kutta integration of the EDFA equations.
+
+    All stage buffers are allocated once, which makes the solver suited to
+    Monte Carlo loops with a predictable cost per call.
+
+    Parameters
+    ----------
+    rhs : function
+        Compiled right-hand side, rhs(P, *args, dP).
+    zSpan : np.array
+        Integration interval [z0, z1].
+    P0 : np.array
+        Initial condition at z0.
+    nSteps : int
+        Number of integration steps.
+    args : tuple, optional
+        Constant arguments of rhs.
+
+    Returns
+    -------
+    sol : dict
+        Positions "t" and power profiles "y", shape (P0.size, nSteps + 1).
+
+    """
+    z = np.linspace(zSpan[0], zSpan[-1], nSteps + 1)
+    h = z[1] - z[0]
+    y = np.empty((nSteps + 1, P0.size))
+    y[0] = P0
+    k1, k2, k3, k4, tmp = (np.empty(P0.size) for _ in range(5))
+
+    for ind in range(nSteps):
+        P = y[ind]
+        rhs(P, *args, k1)
+        np.multiply(k1, h / 2, out=tmp)
+        tmp += P
+        rhs(tmp, *args, k2)
+        np.multiply(k2, h / 2, out=tmp)
+        tmp += P
+        rhs(tmp, *args, k3)
+        np.multiply(k3, h, out=tmp)
+        tmp += P
+        rhs(tmp, *args, k4)
+        # y[n+1] = y[n] + h/6 (k1 + 2 k2 + 2 k3 + k4)
+        k2 += k3
+        k2 *= 2
+        k2 += k1
+        k2 += k4
+        np.multiply(k2, h / 6, out=y[ind + 1])
+        y[ind + 1] += P
+
+    return {"t": z, "y": y.T}
+
+
+def edfaODE(zSpan, pInit, param_edfa, param_edf=None):
+    """
+    Integrate the EDFA rate and propagation equations over zSpan.
+
+    Parameters
+    ----------
+    zSpan : np.array
+        Integration interval [z0, z1].
+    pInit : np.array
+        Optical powers at z0.
+    param_edfa : object with constants and edfa parameters.
+        param_edfa.method selects the solver: any solve_ivp method, or "RK4"
+        for fixed-step integration with param_edfa.rkSteps steps. The
+        analytic Jacobian is passed to the implicit methods (Radau, BDF,
+        LSODA), whose absolute tolerance is scaled down to the smallest
+        input power. Powers are clipped at 0 after the integration.
+    param_edf : object with edf parameters (Giles_spatial only).
+
+    Returns
+    -------
+    sol : dict
+        Positions "t" and power profiles "y".
+
+    """
+    rhs, jac, args = gilesKernels(param_edfa, param_edf)
+
+    if param_edfa.method == "RK4":
+        return rk4Solve(rhs, zSpan, pInit, param_edfa.rkSteps, args)
+
+    # solve_ivp keeps references to the returned derivatives
+    options = {}
+    atol = param_edfa.atol
+    if param_edfa.method in ("Radau", "BDF", "LSODA"):
+        options["jac"] = lambda z, P: jac(P, *args, np.empty((P.size, P.size)))
+        # the implicit steps let components far below atol go negative
+        Pmin = np.min(pInit[pInit > 0], initial=atol)
+        atol = min(atol, param_edfa.rtol * Pmin)
+
+    sol = solve_ivp(
+        lambda z, P: rhs(P, *args, np.empty_like(P)),
+        zSpan,
+        pInit,
+        method=param_edfa.method,
+        rtol=param_edfa.rtol,
+        atol=atol,
+        **options,
+    )
+    np.maximum(sol.y, 0, out=sol.y)
+
+    return sol
 
 def get_mode_radius(model, radius, V, v, u):
     if model == "Bessel":
@@ -228,9 +541,102 @@ def updtCnst(param):
     param.const5 = param.gainCoef * Planck * param.freq * param.noiseBand
     return param
 
+def spatialCnst(param, param_edf):
+    """
+    Update the constants used by the spatial Giles kernels.
+
+    Parameters
+    ----------
+    param : object with constants and edfa parameters.
+    param_edf : object with edf parameters.
+
+    Returns
+    -------
+    param : object with constants and edfa parameters.
+
+    """
+    # trapezoidal weights of the radial overlap integral
+    W = 2 * np.pi * param_edf.r * param_edf.dr
+    W[[0, -1]] /= 2
+    param.W = W
+    param.i_k = np.ascontiguousarray(param.i_k)
+    param.a1 = (param.tal / Planck) * param.absCross / param.freq
+    param.a2 = (param.tal / Planck) * (param.absCross + param.emiCross) / param.freq
+    param.const3 = (param.absCoef + param.gainCoef) / param.gamma
+    param.const4 = param.absCoef + param.lossS
+    param.const5 = (param.gainCoef / param.gamma) * Planck * param.freq * param.noiseBand
+    return param
+
+def interpFieldProfile(lbd, param_edf):
+    """
+    Interpolate the field intensity profile of the EDF at the wavelengths lbd.
+
+    Parameters
+    ----------
+    lbd : np.array
+        Wavelengths [m].
+    param_edf : object with edf parameters.
+
+    Returns
+    -------
+    i_k : np.array
+        Field intensity, shape (len(param_edf.r), len(lbd)).
+
+    """
+    pos = np.interp(lbd, param_edf.lbFl, np.arange(len(param_edf.lbFl)))
+    ind = np.minimum(pos.astype(np.int64), len(param_edf.lbFl) - 2)
+    w = pos - ind
+    return param_edf.i_k[:, ind] * (1 - w) + param_edf.i_k[:, ind + 1] * w
+
+def _edfKey(param_edfa):
+    """Fiber parameters that edfParams depends on."""
+    return (
+        param_edfa.file,
+        os.path.getmtime(param_edfa.file),
+        param_edfa.fileunit,
+        param_edfa.a,
+        param_edfa.b,
+        param_edfa.rho,
+        param_edfa.na,
+        param_edfa.gmtc,
+        param_edfa.algo,
+        param_edfa.longSteps,
+    )
+
 # Calculates gamma, field profile (ik), absorption and emission cross-section (or
 # absorption and gain coeficients)
 def edfParams(param_edfa):
+    """
+    Load the EDF parameters file and compute the fiber parameters.
+
+    The result is cached, so the file is only read once for each set of
+    fiber parameters. It must not be modified by the caller.
+
+    Parameters
+    ----------
+    param_edfa : parameter object (struct)
+        EDFA parameters (see edfaArgs).
+
+    Returns
+    -------
+    param_edf : parameter object (struct)
+        EDF parameters.
+
+    """
+    return _loadEdfParams(*_edfKey(param_edfa))
+
+@lru_cache(maxsize=8)
+def _loadEdfParams(file, mtime, fileunit, a, b, rho, na, gmtc, algo, longSteps):
+    param_edfa = parameters()
+    param_edfa.file = file
+    param_edfa.fileunit = fileunit
+    param_edfa.a = a
+    param_edfa.b = b
+    param_edfa.rho = rho
+    param_edfa.na = na
+    param_edfa.gmtc = gmtc
+    param_edfa.algo = algo
+    param_edfa.longSteps = longSteps
     # Create EDF struct
     param_edf = parameters()
     # Load Gile's file
@@ -259,25 +665,25 @@ def edfParams(param_edfa):
         gamma = (((v * param_edfa.b) / (param_edfa.a * V * jv(1, u))) ** 2) * (jv(0, u * param_edfa.b / param_edfa.a) ** 2 + jv(1, u * param_edfa.b / param_edfa.a) ** 2)
         if (param_edfa.algo == "Giles_spatial"):
             param_edf.gamma = gamma
-            ik = (
+            i_k = (
                 lambda r: 1
                 / np.pi
                 * (
                     v
                     / (param_edfa.a * V)
-                    * jv(0, u * param_edfa.r / param_edfa.a)
+                    * jv(0, u * r / param_edfa.a)
                     / jv(1, u)
                 )
                 ** 2
             )
-            param_edf.i_k = [i_k(x) for x in param_edfa.r]
+            param_edf.i_k = i_k(param_edf.r[:, np.newaxis])
     else:
         w_gauss = get_mode_radius(param_edfa.gmtc, param_edfa.a, V, v, u)
         gamma = 1 - np.exp(-2 * (param_edfa.b / w_gauss) ** 2)
         if param_edfa.algo == "Giles_spatial":
             param_edf.gamma = gamma
             i_k = lambda r: 2 / (np.pi * w_gauss ** 2) * np.exp(-2 * (r / w_gauss) ** 2)
-            param_edf.i_k = [i_k(x) for x in param_edf.r]
+            param_edf.i_k = i_k(param_edf.r[:, np.newaxis])
     # absorption and emission cross-section (or
     # absorption and gain coeficients) calculation
     if (np.sum(fileT[:,1]) > 1):
@@ -294,12 +700,89 @@ def edfParams(param_edfa):
         param_edf.absCross = fileT[:, 1]
         param_edf.emiCross = fileT[:, 2]
         # Doping profile is uniform with density RHO.
-        param_edf.absCoef = param_edfa.absCross * param_edfa.rho * gamma
-        param_edf.gainCoef = param_edfa.emiCross * param_edfa.rho * gamma
+        param_edf.absCoef = param_edf.absCross * param_edfa.rho * gamma
+        param_edf.gainCoef = param_edf.emiCross * param_edfa.rho * gamma
     return param_edf
 
 
 
+def spectralBins(freq, Psgl, Fc, binWidth=None, binCenters=None):
+    """
+    Aggregate the signal power spectrum into spectral slices.
+
+    Parameters
+    ----------
+    freq : np.array
+        Absolute frequency of each FFT bin [Hz].
+    Psgl : np.array
+        Signal power per FFT bin and polarization, shape (len(freq), Npol).
+    Fc : scalar
+        Central optical frequency [Hz]. Uniform slices are aligned to it.
+    binWidth : scalar, optional
+        Width of uniform spectral slices [Hz] (e.g. 12.5e9).
+    binCenters : np.array, optional
+        Center frequencies of the slices [Hz] (e.g. the WDM channel grid).
+        Each FFT bin is assigned to the nearest center. Has precedence
+        over binWidth.
+
+    Returns
+    -------
+    ind : np.array
+        Slice index of each FFT bin.
+    freqBin : np.array
+        Center frequency of each slice [Hz].
+    Pbin : np.array
+        Signal power per slice and polarization, shape (len(freqBin), Npol).
+
+    """
+    if binCenters is not None:
+        freqBin = np.sort(np.atleast_1d(binCenters)).astype(np.float64)
+        ind = np.searchsorted(0.5 * (freqBin[1:] + freqBin[:-1]), freq)
+    else:
+        ind = np.round((freq - Fc) / binWidth).astype(np.int64)
+        indMin = ind.min()
+        ind -= indMin
+        freqBin = Fc + (np.arange(ind.max() + 1) + indMin) * binWidth
+
+    Pbin = np.stack(
+        [np.bincount(ind, weights=P, minlength=len(freqBin)) for P in Psgl.T], axis=1
+    )
+    return ind, freqBin, Pbin
+
+
+def binGain(freq, freqBin, Pin, Pout):
+    """
+    Map the gain of each spectral slice back onto a frequency grid.
+
+    The gain in dB is linearly interpolated between the centers of the
+    slices that carry signal power at both the input and the output.
+
+    Parameters
+    ----------
+    freq : np.array
+        Frequencies where the gain is evaluated [Hz].
+    freqBin : np.array
+        Center frequency of each slice [Hz].
+    Pin : np.array
+        Input power per slice and polarization.
+    Pout : np.array
+        Output power per slice and polarization.
+
+    Returns
+    -------
+    G : np.array
+        Linear power gain, shape (len(freq), Npol).
+
+    """
+    G = np.ones((len(freq), Pin.shape[1]))
+    for indPol in range(Pin.shape[1]):
+        valid = (Pin[:, indPol] > 0) & (Pout[:, indPol] > 0)
+        if np.any(valid):
+            GdB = 10 * np.log10(Pout[valid, indPol] / Pin[valid, indPol])
+            G[:, indPol] = 10 ** (np.interp(freq, freqBin[valid], GdB) / 10)
+    return G
+
+
 def edfaArgs(param_edfa):
     # gain or power control parameters
     param_edfa.type = getattr(param_edfa, "type", "AGC")
@@ -337,12 +820,64 @@ def edfaArgs(param_edfa):
     param_edfa.longSteps = getattr(param_edfa, "longSteps", 100)
     param_edfa.tol = getattr(param_edfa, "tol", 2 / 100)
     param_edfa.tolCtrl = getattr(param_edfa, "tolCtrl", 0.5)  # dB
+    param_edfa.bvpSolver = getattr(param_edfa, "bvpSolver", "shooting")
+    param_edfa.control = getattr(
+        param_edfa,
+        "control",
+        "secant"
+        if param_edfa.bvpSolver == "collocation"
+        or param_edfa.algo in ("Saleh", "Jopson", "Inhomogeneous")
+        else "PID",
+    )
+    # implicit methods (Radau, BDF, LSODA) use a dense Jacobian and need a
+    # binned signal grid (binWidth or binCenters)
+    param_edfa.method = getattr(param_edfa, "method", "DOP853")
+    param_edfa.rtol = getattr(param_edfa, "rtol", 5e-4)
+    param_edfa.atol = getattr(param_edfa, "atol", 5e-7)
+    param_edfa.rkSteps = getattr(param_edfa, "rkSteps", 100)
+    # solution cache (see edfaModel)
+    param_edfa.cache = getattr(param_edfa, "cache", True)
+    param_edfa.cacheSize = getattr(param_edfa, "cacheSize", 16)
+    param_edfa.cacheTol = getattr(param_edfa, "cacheTol", 0)
+    # spectral binning of the signal (None: one state per FFT bin)
+    param_edfa.binWidth = getattr(param_edfa, "binWidth", None)  # Hz
+    param_edfa.binCenters = getattr(param_edfa, "binCenters", None)  # Hz
     # noise parameters
     param_edfa.noiseBand = getattr(param_edfa, "noiseBand", 125e9)
+    param_edfa.seed = getattr(param_edfa, "seed", None)
+    # inhomogeneous broadening parameters (see inhomogeneousSites)
+    param_edfa.sites = getattr(param_edfa, "sites", 16)
+    param_edfa.holeWidth = getattr(param_edfa, "holeWidth", 2e12)  # Hz
+    # gain dynamics parameters (see edfaDynamic)
+    param_edfa.blockSize = getattr(param_edfa, "blockSize", 1024)
 
     # Verify amplification type
     if param_edfa.type not in ("AGC", "APC", "none"):
         raise TypeError("edfaSM.type invalid argument - [AGC, APC, none].")
+    # Verify boundary-value solver and control
+    if param_edfa.bvpSolver not in ("shooting", "collocation"):
+        raise TypeError("edfaSM.bvpSolver invalid argument - [shooting, collocation].")
+    if param_edfa.bvpSolver == "collocation" and param_edfa.algo != "Giles_spectrum":
+        raise TypeError("edfaSM.bvpSolver collocation requires algo Giles_spectrum.")
+    if param_edfa.control not in ("PID", "secant"):
+        raise TypeError("edfaSM.control invalid argument - [PID, secant].")
+    # Verify ODE solver
+    if param_edfa.method not in ("RK45", "RK23", "DOP853", "Radau", "BDF", "LSODA", "RK4"):
+        raise TypeError(
+            "edfaSM.method invalid argument - [RK45, RK23, DOP853, Radau, BDF, LSODA, RK4]."
+        )
+    if (
+        param_edfa.method in ("Radau", "BDF", "LSODA")
+        and param_edfa.binWidth is None
+        and param_edfa.binCenters is None
+    ):
+        raise TypeError(
+            f"edfaSM.method {param_edfa.method} requires binWidth or binCenters."
+        )
+    if int(param_edfa.sites) < 1:
+        raise TypeError("edfaSM.sites must be a positive integer.")
+    if int(param_edfa.blockSize) < 1:
+        raise TypeError("edfaDynamic.blockSize must be a positive integer.")
     # Verify giles file
     if not (os.path.exists(param_edfa.file)):
         raise TypeError(f"{param_edfa.file} file doesn't exist.")
@@ -360,266 +895,1568 @@ def edfaArgs(param_edfa):
 
     return param_edfa
 
-def edfaSM(Ei, Fs, Fc, param_edfa):
-    ## Verify arguments
-    param_edfa = edfaArgs(param_edfa)
+def edfaModel(param_edfa):
+    """
+    Get the EDFA model attached to param_edfa, creating it on first use.
 
-    if (param_edfa.type == "AGC"):
-        power_in = power_meter(Ei)
-    
-    ## Get pump signal frequency points
-    freqPmpFor = c / param_edfa.forPump["pump_lambda"]
-    freqPmpBck = c / param_edfa.bckPump["pump_lambda"]
-    pumpPmpFor = param_edfa.forPump["pump_signal"]
-    pumpPmpBck = param_edfa.bckPump["pump_signal"]
-    if len(freqPmpFor) != len(pumpPmpFor):
-        raise TypeError(
-            "edfaSM.forPump invalid argument - number of signals (freq and pump) must be igual."
-        )
-    if len(freqPmpBck) != len(pumpPmpBck):
-        raise TypeError(
-            "edfaSM.bckPump invalid argument - number of signals (freq and pump) must be igual."
-        )
-    lenPmpFor = np.size(freqPmpFor)
-    lenPmpBck = np.size(freqPmpBck)
+    The model keeps the fiber data interpolated on the simulation frequency
+    grids and the converged steady-state solutions of previous calls, so
+    that repeated calls (e.g. one per span of a link) only solve for what
+    changed.
 
-    ## Load Giles file
-    # Get EDF cross-sections and coeficients parameters from giles parameters file.
-    # absCross, emiCross, absCoef, gainCoef = edfParams(param_edfa, lbFl, fileT)
-    param_edf = edfParams(param_edfa)
+    Parameters
+    ----------
+    param_edfa : parameter object (struct)
+        EDFA parameters (see edfaArgs).
 
-    ## Format input signal
-    # Create second pol, if not exists
-    lenFqSg, isy = np.shape(Ei)
-    if isy == 1:
-        Ei = np.concatenate((Ei, np.zeros(np.shape(Ei))), axis=1)
-        isy += 1
-    # Get signal in frequency domain
-    freqSgn = Fs * fftfreq(len(Ei)) + Fc
-    lenFqSg = len(freqSgn)
+    Returns
+    -------
+    model : parameter object (struct)
+        model.grids: rate-equation constants per frequency grid.
 
-    ## Create ASE signal components
-    # Get optical band and specify frequency points for ASE calculation
-    opticalBand = freqSgn.max() - freqSgn.min()
-    freqASE = np.arange(-opticalBand / 2, opticalBand / 2, param_edfa.noiseBand) + Fc
-    lenASE = np.size(freqASE)
+        model.solutions: cached steady-state solutions (most recent last).
 
-    ## Define the frequency vector used in simulation.
-    # SIGNALX + SIGNALY + FASEX + FASEY + FORPUMP
-    param_edfa.freq = np.concatenate([freqSgn, freqSgn, freqASE, freqASE, freqPmpFor])
-    param_edfa.ASE = np.concatenate(
-        [np.zeros(isy * lenFqSg), np.ones(isy * lenASE), np.zeros(lenPmpFor)]
-    )
-    param_edfa.uk = np.ones(np.size(param_edfa.freq))
-    param_edfa.absCoef = np.interp(c / param_edfa.freq, param_edf.lbFl, param_edf.absCoef)
-    param_edfa.gainCoef = np.interp(c / param_edfa.freq, param_edf.lbFl, param_edf.gainCoef)
-    # BCKPUMP + BASEX + BASEY
-    freqAdd = np.concatenate([freqPmpBck, freqASE, freqASE])
-    ASEAdd = np.concatenate([np.zeros(lenPmpBck), np.ones(isy * lenASE)])
-    ukAdd = np.concatenate([np.ones(lenPmpBck), np.ones(isy * lenASE)])
-    absCoefAdd = np.interp(c / freqAdd, param_edf.lbFl, param_edf.absCoef)
-    gainCoefAdd = np.interp(c / freqAdd, param_edf.lbFl, param_edf.gainCoef)
-
-    # Indexes of each signal class (signal, ase for, pump for, ase back, pump back)
-    idxPS = np.arange(0, isy * lenFqSg)
-    idxPAF = np.arange(idxPS[-1] + 1, idxPS[-1] + lenASE * isy + 1)
-    idxPPF = np.arange(idxPAF[-1] + 1, idxPAF[-1] + lenPmpFor + 1)
-    idxPPB = np.arange(idxPPF[-1] + 1, idxPPF[-1] + lenPmpBck + 1)
-    idxPAB = np.arange(idxPPB[-1] + 1, idxPPB[-1] + lenASE * isy + 1)
-
-    ## Create variables used in edo solution method
-    if param_edfa.algo == "Giles_spatial":
-        # SIGNALX + SIGNALY + FASEX + FASEY + FORPUMP
-        param_edfa.absCross = np.interp(c / param_edfa.freq, param_edf.lbFl, param_edf.absCross)
-        param_edfa.emiCross = np.interp(c / param_edfa.freq, param_edf.lbFl, param_edf.emiCross)
-        param_edfa.gamma = np.interp(c / param_edfa.freq, param_edf.lbFl, param_edf.gamma)
-        param_edfa.i_k = interpolate.interp2d(
-            param_edf.lbFl, param_edf.r, param_edf.i_k, kind="cubic"
-        )(c / param_edfa.freq, param_edf.r)
-        # BCKPUMP + BASEX + BASEY
-        absCrossAdd = np.interp(c / freqAdd, param_edf.lbFl, param_edf.absCross)
-        emiCrossAdd = np.interp(c / freqAdd, param_edf.lbFl, param_edf.emiCross)
-        gammaAdd = np.interp(c / freqAdd, param_edf.lbFl, param_edf.gamma)
-        i_kAdd = interpolate.interp2d(param_edf.lbFl, param_edf.r, param_edf.i_k, kind="cubic")(
-            c / freqAdd, param_edf.r
-        )
-        # Eval string
-        evalStr = "solve_ivp(gilesSpatial, zSpan, pInit, method='DOP853', rtol = 5e-4, atol = 5e-7, args=(param_edfa,param_edf))"
-    elif (param_edfa.algo == 'Giles_spectrum'):        
-        # Update some constants used in rate and propagation equations
-        param_edfa = updtCnst(param_edfa)
-        # Eval string
-        evalStr = "solve_ivp(gilesSpectrum, zSpan, pInit, method='DOP853', rtol = 5e-4, atol = 5e-7, args=(param_edfa,))"
-
-    # Signal power vector and EDF length vector
-    EiFt = fft(Ei, axis=0)
-    Psgl = np.reshape(np.abs(EiFt / lenFqSg) ** 2, (isy * lenFqSg), order="F")
-    zSpan = np.array([0, param_edfa.lngth])
-
-    # Init power conditions
-    # SIGNALX + SIGNALY + FASEX + FASEY + FORPUMP
-    pInit = np.concatenate([Psgl, np.zeros(isy * lenASE), pumpPmpFor])
-    # BCKPUMP + BASEX + BASEY
-    pInitAdd = np.concatenate([pumpPmpBck, np.zeros(isy * lenASE)])
-
-    # Solution: 0 -> L without BCKPUMP + BASEX + BASEY
-    sol = eval(evalStr)
-    Pout = sol["y"]
-    zSpan = np.flip(zSpan)
+    """
+    model = getattr(param_edfa, "model", None)
+    if model is None:
+        model = parameters()
+        model.grids = {}
+        model.solutions = deque(maxlen=param_edfa.cacheSize)
+        param_edfa.model = model
+    return model
 
-    # Update interpolated parameters
-    # SIGNALX + SIGNALY + FASEX + FASEY + FORPUMP
-    # BCKPUMP + BASEX + BASEY
-    pInit = np.concatenate([pInit, pInitAdd])
-    param_edfa.freq = np.concatenate([param_edfa.freq, freqAdd])
-    param_edfa.ASE = np.concatenate([param_edfa.ASE, ASEAdd])
-    param_edfa.uk = np.concatenate([param_edfa.uk, -ukAdd])
-    param_edfa.absCoef = np.concatenate([param_edfa.absCoef, absCoefAdd])
-    param_edfa.gainCoef = np.concatenate([param_edfa.gainCoef, gainCoefAdd])
-
-    if (param_edfa.algo == 'Giles_spatial'):
-        param_edfa.absCross = np.concatenate([param_edfa.absCross, absCrossAdd])
-        param_edfa.emiCross = np.concatenate([param_edfa.emiCross, emiCrossAdd])
-        param_edfa.gamma    = np.concatenate([param_edfa.gamma,       gammaAdd])
-        param_edfa.i_k      = np.concatenate([param_edfa.i_k,           i_kAdd], axis = 1)
-    elif (param_edfa.algo == 'Giles_spectrum'): 
-        # Update somes constants used in rate and propagation equations
-        param_edfa = updtCnst(param_edfa)
-
-    # update pInit signal with Pout SIGNAL + FASE + FORPUMP values
-    pInit[idxPS] = Pout[idxPS, -1]
-    pInit[idxPAF] = Pout[idxPAF, -1]
-    pInit[idxPPF] = Pout[idxPPF, -1]
 
-    # Variables used in loop
-    MaxTry = 15
-    tryCtrlLoop = 0
-    errorAutoCrtl = 1
+def inhomogeneousSites(freq, param_edfa, param_edf):
+    """
+    Partition the fiber coefficients among ion subpopulations.
 
-    while (np.abs(errorAutoCrtl) > param_edfa.tolCtrl) and (tryCtrlLoop < MaxTry):
-        tryLoop = 0
-        errorCvg = 1
-        ## main loop
-        while (np.mean(np.abs(errorCvg)) > param_edfa.tol) and (tryLoop < MaxTry):
-            # Solution: L -> 0
-            sol = eval(evalStr)
-            Pin = sol["y"]
-            zSpan = np.flip(zSpan)
-            pInit = copy.deepcopy(Pin[:, -1])
-
-            # Reset SIGNAL + FASE + FORPUMP values
-            pInit[idxPS] = Psgl
-            pInit[idxPAF] = np.zeros(lenASE * isy)
-            pInit[idxPPF] = pumpPmpFor
-
-            # Solution: 0 -> L
-            sol = eval(evalStr)
-            Pout = sol["y"]
-            zSpan = np.flip(zSpan)
-            pInit = copy.deepcopy(Pout[:, -1])
-
-            # Reset BASE + BCKPUMP values
-            pInit[idxPAB] = np.zeros(lenASE * isy)
-            pInit[idxPPB] = pumpPmpBck
-
-            # convergence criteria - pump signal power
-            if pumpPmpFor == 0:
-                errorCvg = 1 - Pout[idxPPB, -1] / pumpPmpBck
-            elif pumpPmpBck == 0:
-                errorCvg = 1 - Pin[idxPPF, -1] / pumpPmpFor
-            else:
-                errorCvg = 1 - (
-                    np.array([Pout[idxPPB, -1], Pin[idxPPF, -1]])
-                ) / np.array([pumpPmpBck, pumpPmpFor])
-            logg.info("EDFA SM: loop %2d" % (tryLoop + 1))
-            logg.info("Convergence: %5.3f%%.\n" % (100 * np.mean(errorCvg)))
-
-            # Update loop control variable
-            tryLoop = tryLoop + 1
-            if tryLoop == MaxTry:
-                logg.info(
-                    "Convergence fail: number of loops greater than max (%d)" % (MaxTry)
-                )
-        # Automatic gain or power control
-        if (param_edfa.type == "AGC") or (param_edfa.type == "APC"):
-            power_out = np.sum(
-                Pout[np.concatenate([idxPS, idxPAF]), -1]
-            )  # Output power - Signal + For. ASE
-            if param_edfa.type == "AGC":
-                errorAutoCrtl = 10 * np.log10(power_out / power_in)
-            else:  # APC
-                errorAutoCrtl = 10 * np.log10(1e3 * power_out)
-            # PID control - only in forward pumping
-            # TODO - and backward pumping? both?
-            pid = PID(
-                param_edfa.kp, param_edfa.ki, param_edfa.kd, setpoint=param_edfa.value, output_limits=(-pumpPmpFor/2, pumpPmpFor/2)
-            )
-            pumpPmpFor = pumpPmpFor + pid(errorAutoCrtl)
-            errorAutoCrtl = errorAutoCrtl - param_edfa.value
+    The inhomogeneously broadened ion ensemble is described by
+    param_edfa.sites subpopulations, with center frequencies uniformly
+    spread over the emission band of the fiber (gain coefficient above 10%
+    of its peak) and Lorentzian lines of width param_edfa.holeWidth. The
+    absorption and gain coefficients at each frequency are shared among
+    the subpopulations in proportion to their lines, so that they add up
+    to the measured coefficients.
 
-            if np.abs(errorAutoCrtl) > param_edfa.tolCtrl:
-                logg.info("EDFA SM: control loop %2d" % (tryCtrlLoop + 1))
-                logg.info("Convergence: %5.3f dB" % (errorAutoCrtl))
-                logg.info("Pump for.: %5.2f mW\n" % (1e3 * pumpPmpFor))
-            tryCtrlLoop = tryCtrlLoop + 1
-            if tryCtrlLoop == MaxTry:
-                logg.info(
-                    "Control fail: number of loops greater than max (%d)" % (MaxTry)
-                )
-        else:
-            errorAutoCrtl = 0
-    ## Update pump signal
-    PpumpB = Pout[idxPPB, [0, -1]]
-    PpumpF = Pout[idxPPF, [0, -1]]
+    Parameters
+    ----------
+    freq : np.array
+        Frequencies of the state components [Hz].
+    param_edfa : parameter object (struct)
+        EDFA parameters (see edfaArgs).
+    param_edf : parameter object (struct)
+        EDF parameters (see edfParams).
 
-    ## Update signal noise
-    # Adjust optical noise level
-    freqStep = Fs / lenFqSg
-    resolutionOffSet = param_edfa.noiseBand / freqStep
-    noiseB = Pout[idxPAB, 0] / resolutionOffSet
-    noiseF = Pout[idxPAF, -1] / resolutionOffSet
-    # Interpolates the optical noise values ​​and adds phase with normal distribution. It is necessary to divide
-    # by sqrt(2) the noise terms, because when adding the phase, the amplitude must be unitary.
-    f1_noiseb = interpolate.interp1d(
-        freqASE, noiseB[0:lenASE], kind="linear", fill_value="extrapolate"
-    )
-    f1_noisef = interpolate.interp1d(
-        freqASE, noiseF[0:lenASE], kind="linear", fill_value="extrapolate"
-    )
-    f2_noiseb = interpolate.interp1d(
-        freqASE, noiseB[lenASE:], kind="linear", fill_value="extrapolate"
-    )
-    f2_noisef = interpolate.interp1d(
-        freqASE, noiseF[lenASE:], kind="linear", fill_value="extrapolate"
-    )
-    # Create signal noise
-    noiseb = np.concatenate(
-        [
-            np.sqrt(f1_noiseb(freqSgn), dtype=np.complex),
-            np.sqrt(f2_noiseb(freqSgn), dtype=np.complex),
-        ]
+    Returns
+    -------
+    part : np.array
+        Share of each subpopulation in the coefficients, shape
+        (param_edfa.sites, len(freq)).
+
+    """
+    gainCoef = param_edf.gainCoef
+    band = c / param_edf.lbFl[gainCoef >= 0.1 * gainCoef.max()]
+    freqSite = np.linspace(band.min(), band.max(), int(param_edfa.sites))
+    line = 1 / (
+        1 + ((freq[np.newaxis, :] - freqSite[:, np.newaxis]) / (param_edfa.holeWidth / 2)) ** 2
     )
-    noisef = np.concatenate(
-        [
-            np.sqrt(f1_noisef(freqSgn), dtype=np.complex),
-            np.sqrt(f2_noisef(freqSgn), dtype=np.complex),
-        ]
+    return line / np.sum(line, axis=0)
+
+
+def edfaGrid(freqSgn, freqASE, freqPmpFor, freqPmpBck, param_edfa, param_edf, model=None):
+    """
+    Interpolate the fiber data on the simulation frequency grid.
+
+    The state vector is ordered as SIGNALX + SIGNALY + FASEX + FASEY +
+    FORPUMP + BCKPUMP + BASEX + BASEY.
+
+    Parameters
+    ----------
+    freqSgn : np.array
+        Signal frequencies (FFT bins or spectral slices) [Hz].
+    freqASE : np.array
+        ASE frequencies [Hz].
+    freqPmpFor : np.array
+        Forward pump frequencies [Hz].
+    freqPmpBck : np.array
+        Backward pump frequencies [Hz].
+    param_edfa : parameter object (struct)
+        EDFA parameters (see edfaArgs).
+    param_edf : parameter object (struct)
+        EDF parameters (see edfParams).
+    model : parameter object (struct), optional
+        EDFA model used to cache the interpolated data (see edfaModel).
+
+    Returns
+    -------
+    prop : parameter object (struct)
+        Copy of param_edfa with the constants of the rate and propagation
+        equations, the direction of each component (uk, and ukFor for a
+        forward-only pass) and the state indexes (idxPS, idxPAF, idxPPF,
+        idxPPB, idxPAB).
+
+    """
+    freq = np.concatenate(
+        [freqSgn, freqSgn, freqASE, freqASE, freqPmpFor, freqPmpBck, freqASE, freqASE]
     )
-    noiseF = (
-        noisef
-        * (np.random.randn(lenFqSg * isy) + 1j * np.random.randn(lenFqSg * isy))
-        / np.sqrt(2)
+    key = (
+        _edfKey(param_edfa),
+        param_edfa.tal,
+        param_edfa.lossS,
+        param_edfa.noiseBand,
+        param_edfa.sites,
+        param_edfa.holeWidth,
+        freq.size,
+        hash(freq.tobytes()),
     )
+    prop = copy.copy(param_edfa)
+
+    grid = model.grids.get(key) if model is not None else None
+    if grid is None:
+        lenSgn, lenASE = len(freqSgn), len(freqASE)
+        lenPmpFor, lenPmpBck = len(freqPmpFor), len(freqPmpBck)
+        lenFor = 2 * lenSgn + 2 * lenASE + lenPmpFor
+        lenBck = lenPmpBck + 2 * lenASE
+
+        grid = parameters()
+        grid.key = key
+        grid.freq = freq
+        grid.ASE = np.concatenate(
+            [
+                np.zeros(2 * lenSgn),
+                np.ones(2 * lenASE),
+                np.zeros(lenPmpFor + lenPmpBck),
+                np.ones(2 * lenASE),
+            ]
+        )
+        grid.uk = np.concatenate([np.ones(lenFor), -np.ones(lenBck)])
+        grid.ukFor = np.concatenate([np.ones(lenFor), np.zeros(lenBck)])
+        grid.absCoef = np.interp(c / freq, param_edf.lbFl, param_edf.absCoef)
+        grid.gainCoef = np.interp(c / freq, param_edf.lbFl, param_edf.gainCoef)
+
+        # Indexes of each signal class (signal, ase for, pump for, pump back, ase back)
+        grid.idxPS = np.arange(0, 2 * lenSgn)
+        grid.idxPAF = np.arange(2 * lenSgn, 2 * lenSgn + 2 * lenASE)
+        grid.idxPPF = np.arange(2 * lenSgn + 2 * lenASE, lenFor)
+        grid.idxPPB = np.arange(lenFor, lenFor + lenPmpBck)
+        grid.idxPAB = np.arange(lenFor + lenPmpBck, lenFor + lenBck)
+
+        vars(prop).update(vars(grid))
+        if param_edfa.algo == "Giles_spatial":
+            prop.absCross = np.interp(c / freq, param_edf.lbFl, param_edf.absCross)
+            prop.emiCross = np.interp(c / freq, param_edf.lbFl, param_edf.emiCross)
+            prop.gamma = np.interp(c / freq, param_edf.lbFl, param_edf.gamma)
+            prop.i_k = interpFieldProfile(c / freq, param_edf)
+            prop = spatialCnst(prop, param_edf)
+            fields = ("absCross", "emiCross", "gamma", "i_k", "W", "a1", "a2")
+        else:
+            prop = updtCnst(prop)
+            fields = ("const1", "const2")
+            if param_edfa.algo == "Inhomogeneous":
+                prop.sitePart = inhomogeneousSites(freq, param_edfa, param_edf)
+                fields += ("sitePart",)
+        for field in fields + ("const3", "const4", "const5"):
+            setattr(grid, field, getattr(prop, field))
+
+        if model is not None:
+            if len(model.grids) >= 8:
+                model.grids.pop(next(iter(model.grids)))
+            model.grids[key] = grid
+    else:
+        vars(prop).update(vars(grid))
 
-    ## Update amplified optical signal
-    # Update optical signal by adding noise
-    Eout = np.reshape(
-        np.sqrt(Pout[idxPS, -1], dtype=np.complex), (lenFqSg, isy), order="F"
-    )
-    Eout = Eout * np.exp(1j * np.angle(EiFt)) + np.reshape(
-        noiseF, (lenFqSg, isy), order="F"
+    return prop
+
+
+def edfaCtrlKey(param_edfa, pumpPmpFor, pumpPmpBck):
+    """
+    Signature of the amplifier settings that a cached solution depends on.
+
+    Parameters
+    ----------
+    param_edfa : parameter object (struct)
+        EDFA parameters (see edfaArgs).
+    pumpPmpFor : np.array
+        Nominal forward pump powers [W].
+    pumpPmpBck : np.array
+        Backward pump powers [W].
+
+    Returns
+    -------
+    key : tuple
+
+    """
+    return (
+        param_edfa.type,
+        param_edfa.value,
+        param_edfa.kp,
+        param_edfa.ki,
+        param_edfa.kd,
+        param_edfa.lngth,
+        param_edfa.tol,
+        param_edfa.tolCtrl,
+        param_edfa.bvpSolver,
+        param_edfa.control,
+        param_edfa.longSteps,
+        param_edfa.method,
+        param_edfa.rtol,
+        param_edfa.atol,
+        param_edfa.rkSteps,
+        tuple(np.atleast_1d(pumpPmpFor)),
+        tuple(np.atleast_1d(pumpPmpBck)),
     )
 
-    Eout = ifft(Eout * lenFqSg, axis=0)
 
-    return Eout, PpumpF, PpumpB, np.reshape(noisef, (lenFqSg, isy), order="F")
\ No newline at end of file
+def edfaLookup(model, key, Psgl):
+    """
+    Find the cached solution whose input spectrum is nearest to Psgl.
+
+    Parameters
+    ----------
+    model : parameter object (struct)
+        EDFA model (see edfaModel), or None.
+    key : tuple
+        Grid and settings signature of the solution.
+    Psgl : np.array
+        Input signal power per state.
+
+    Returns
+    -------
+    dist : scalar
+        Relative L1 distance between the input spectra (inf if not found).
+    sol : parameter object (struct)
+        Cached solution, or None.
+
+    """
+    dist, sol = np.inf, None
+    if model is None:
+        return dist, sol
+
+    PsglSum = np.sum(Psgl)
+    for cached in reversed(model.solutions):
+        if cached.key == key:
+            d = np.sum(np.abs(cached.Psgl - Psgl)) / PsglSum
+            if d < dist:
+                dist, sol = d, cached
+                if d == 0:
+                    break
+    return dist, sol
+
+
+def edfaShooting(Psgl, pumpPmpFor, pumpPmpBck, prop, param_edf, pGuess=None):
+    """
+    Solve the EDFA boundary-value problem by forward/backward shooting.
+
+    Parameters
+    ----------
+    Psgl : np.array
+        Input signal power per state [W].
+    pumpPmpFor : np.array
+        Forward pump powers [W].
+    pumpPmpBck : np.array
+        Backward pump powers [W].
+    prop : parameter object (struct)
+        Rate-equation constants and indexes (see edfaGrid).
+    param_edf : parameter object (struct)
+        EDF parameters (see edfParams).
+    pGuess : np.array, optional
+        Initial guess of the optical powers at z = L. By default the loop
+        starts from a forward-only solution without backward components.
+
+    Returns
+    -------
+    P0 : np.array
+        Optical powers at z = 0.
+    PL : np.array
+        Optical powers at z = L.
+
+    """
+    idxPS, idxPAF, idxPPF = prop.idxPS, prop.idxPAF, prop.idxPPF
+    idxPPB, idxPAB = prop.idxPPB, prop.idxPAB
+    zSpan = np.array([0, prop.lngth])
+
+    if pGuess is None:
+        # Solution: 0 -> L without BCKPUMP + BASEX + BASEY
+        pInit = np.zeros(prop.freq.size)
+        pInit[idxPS] = Psgl
+        pInit[idxPPF] = pumpPmpFor
+        propFor = copy.copy(prop)
+        propFor.uk = prop.ukFor
+        pInit = edfaODE(zSpan, pInit, propFor, param_edf)["y"][:, -1]
+    else:
+        pInit = np.array(pGuess, dtype=np.float64)
+    pInit[idxPAB] = 0
+    pInit[idxPPB] = pumpPmpBck
+    zSpan = np.flip(zSpan)
+
+    # Variables used in loop
+    MaxTry = 15
+    tryLoop = 0
+    errorCvg = 1
+    ## main loop
+    while (np.mean(np.abs(errorCvg)) > prop.tol) and (tryLoop < MaxTry):
+        # Solution: L -> 0
+        sol = edfaODE(zSpan, pInit, prop, param_edf)
+        Pin = sol["y"]
+        zSpan = np.flip(zSpan)
+        pInit = copy.deepcopy(Pin[:, -1])
+
+        # Reset SIGNAL + FASE + FORPUMP values
+        pInit[idxPS] = Psgl
+        pInit[idxPAF] = 0
+        pInit[idxPPF] = pumpPmpFor
+
+        # Solution: 0 -> L
+        sol = edfaODE(zSpan, pInit, prop, param_edf)
+        Pout = sol["y"]
+        zSpan = np.flip(zSpan)
+        pInit = copy.deepcopy(Pout[:, -1])
+
+        # Reset BASE + BCKPUMP values
+        pInit[idxPAB] = 0
+        pInit[idxPPB] = pumpPmpBck
+
+        # convergence criteria - pump signal power
+        if np.all(pumpPmpFor == 0):
+            errorCvg = 1 - Pout[idxPPB, -1] / pumpPmpBck
+        elif np.all(pumpPmpBck == 0):
+            errorCvg = 1 - Pin[idxPPF, -1] / pumpPmpFor
+        else:
+            errorCvg = 1 - (
+                np.array([Pout[idxPPB, -1], Pin[idxPPF, -1]])
+            ) / np.array([pumpPmpBck, pumpPmpFor])
+        logg.info("EDFA SM: loop %2d" % (tryLoop + 1))
+        logg.info("Convergence: %5.3f%%.\n" % (100 * np.mean(errorCvg)))
+
+        # Update loop control variable
+        tryLoop = tryLoop + 1
+        if tryLoop == MaxTry:
+            logg.info(
+                "Convergence fail: number of loops greater than max (%d)" % (MaxTry)
+            )
+
+    return Pout[:, 0], Pout[:, -1]
+
+
+@njit(cache=True)
+def relaxSweep(n2bar, P0, const1, const2, const3, const4, bASE, h, reverse, Pb, T1, T2, eX, V, jac):
+    """
+    Propagate a group of co-propagating components for a given inversion.
+
+    The inversion is constant within each mesh interval, so the power of
+    each component follows P[j+1] = exp(x) P[j] + B, where x is the net gain
+    of the interval and B its ASE source term.
+
+    Parameters
+    ----------
+    n2bar : np.array
+        Average metastable population of each interval, in the direction of
+        propagation.
+    P0 : np.array
+        Launched powers of the components [W].
+    const1, const2, const3, const4 : np.array
+        Constants of the rate and propagation equations (see updtCnst).
+    bASE : np.array
+        ASE source constants of the components (ASE * const5).
+    h : scalar
+        Mesh step [m].
+    reverse : bool
+        Components propagate from z = L to z = 0.
+    Pb : np.array
+        Output: powers at z = 0 and z = L, shape (len(P0), 2).
+    T1, T2 : np.array
+        Accumulators of the population terms at the mesh points.
+    eX : np.array
+        Output (if jac): accumulated gain at the mesh points, shape
+        (len(P0), len(n2bar) + 1), in the direction of propagation.
+    V : np.array
+        Output (if jac): derivative of each interval with respect to n2bar
+        divided by the accumulated gain, shape (len(P0), len(n2bar)).
+    jac : bool
+        Compute eX and V.
+
+    """
+    M = n2bar.size + 1
+    for k in range(P0.size):
+        P = P0[k]
+        e = 1.0
+        i = M - 1 if reverse else 0
+        T1[i] += const1[k] * P
+        T2[i] += const2[k] * P
+        Pb[k, 1 if reverse else 0] = P
+        if jac:
+            eX[k, 0] = 1.0
+        for j in range(M - 1):
+            x = h * (const3[k] * n2bar[j] - const4[k])
+            E = np.exp(x)
+            # phi(x) = (exp(x) - 1) / x and its derivative
+            if np.abs(x) < 1e-4:
+                phi = 1 + x / 2
+                dphi = 0.5 + x / 3
+            else:
+                phi = (E - 1) / x
+                dphi = (E * (x - 1) + 1) / x**2
+            b = bASE[k] * h
+            if jac:
+                c3h = h * const3[k]
+                D = c3h * E * P + b * (phi + n2bar[j] * c3h * dphi)
+                e *= E
+                eX[k, j + 1] = e
+                V[k, j] = D / e
+            P = E * P + b * n2bar[j] * phi
+            i = M - 2 - j if reverse else j + 1
+            T1[i] += const1[k] * P
+            T2[i] += const2[k] * P
+        Pb[k, 0 if reverse else 1] = P
+
+
+def edfaCollocation(Psgl, pumpPmpFor, pumpPmpBck, prop, n2Guess=None):
+    """
+    Solve the EDFA boundary-value problem by relaxation of the inversion profile.
+
+    Forward and backward components are propagated at once over a mesh of
+    param_edfa.longSteps points, given the metastable population n2(z) at
+    the mesh points. The self-consistent profile is found by a damped
+    Newton iteration with the exact Jacobian, which is assembled from
+    matrix products of size longSteps x longSteps. Only the Giles_spectrum
+    algorithm is supported.
+
+    Parameters
+    ----------
+    Psgl : np.array
+        Input signal power per state [W].
+    pumpPmpFor : np.array
+        Forward pump powers [W].
+    pumpPmpBck : np.array
+        Backward pump powers [W].
+    prop : parameter object (struct)
+        Rate-equation constants and indexes (see edfaGrid).
+    n2Guess : np.array, optional
+        Initial guess of the metastable population at the mesh points.
+
+    Returns
+    -------
+    P0 : np.array
+        Optical powers at z = 0.
+    PL : np.array
+        Optical powers at z = L.
+    n2 : np.array
+        Metastable population at the mesh points.
+
+    """
+    M = max(int(prop.longSteps), 2)
+    h = prop.lngth / (M - 1)
+    K = prop.freq.size
+
+    # Launched powers: forward components at z = 0, backward ones at z = L
+    Pb = np.zeros(K)
+    Pb[prop.idxPS] = Psgl
+    Pb[prop.idxPPF] = pumpPmpFor
+    Pb[prop.idxPPB] = pumpPmpBck
+    bASE = prop.ASE * prop.const5
+
+    # Components grouped by direction of propagation, in chunks of bounded size
+    chunks = []
+    for reverse, group in enumerate([np.flatnonzero(prop.uk > 0), np.flatnonzero(prop.uk < 0)]):
+        for start in range(0, len(group), 2048):
+            sub = group[start : start + 2048]
+            chunks.append(
+                (
+                    sub,
+                    bool(reverse),
+                    Pb[sub],
+                    prop.const1[sub],
+                    prop.const2[sub],
+                    prop.const3[sub],
+                    prop.const4[sub],
+                    bASE[sub],
+                )
+            )
+    eX = np.empty((min(K, 2048), M))
+    V = np.empty((min(K, 2048), M - 1))
+
+    def residual(n2, jac=False):
+        n2bar = (n2[1:] + n2[:-1]) / 2
+        n2barRev = n2bar[::-1].copy()
+        P = np.empty((K, 2))
+        T1 = np.zeros(M)
+        T2 = np.ones(M)
+        dT1 = np.zeros((M, M - 1))
+        dT2 = np.zeros((M, M - 1))
+        for sub, reverse, P0, c1, c2, c3, c4, b in chunks:
+            # backward components propagate along the reversed mesh
+            Pg = np.empty((sub.size, 2))
+            relaxSweep(
+                n2barRev if reverse else n2bar,
+                P0, c1, c2, c3, c4, b, h, reverse, Pg, T1, T2, eX, V, jac,
+            )
+            P[sub] = Pg
+            if jac:
+                nSub = sub.size
+                A1 = np.tril((c1[:, np.newaxis] * eX[:nSub]).T @ V[:nSub], -1)
+                A2 = np.tril((c2[:, np.newaxis] * eX[:nSub]).T @ V[:nSub], -1)
+                if reverse:
+                    A1, A2 = A1[::-1, ::-1], A2[::-1, ::-1]
+                dT1 += A1
+                dT2 += A2
+
+        F = n2 - T1 / T2
+        if not jac:
+            return F, P
+
+        # dF/dn2bar, then chain rule for n2bar = (n2[1:] + n2[:-1]) / 2
+        G = -(dT1 - (T1 / T2)[:, np.newaxis] * dT2) / T2[:, np.newaxis]
+        J = np.eye(M)
+        J[:, :-1] += G / 2
+        J[:, 1:] += G / 2
+        return F, P, J
+
+    if n2Guess is None or len(n2Guess) != M:
+        n2 = np.full(M, (Pb @ prop.const1) / (Pb @ prop.const2 + 1))
+    else:
+        n2 = np.array(n2Guess, dtype=np.float64)
+
+    MaxTry = 50
+    F, P, J = residual(n2, jac=True)
+    for tryLoop in range(MaxTry):
+        normF = np.max(np.abs(F))
+        logg.info("EDFA SM: relaxation %2d - residual %.3e" % (tryLoop + 1, normF))
+        if normF < 1e-9:
+            break
+        dn2 = np.linalg.solve(J, -F)
+        # Newton step with backtracking, n2 is kept within [0, 1]
+        n2New = np.clip(n2 + dn2, 0, 1)
+        FNew, PNew, JNew = residual(n2New, jac=True)
+        t = 1.0
+        while np.max(np.abs(FNew)) > (1 - 1e-4 * t) * normF and t > 1e-3:
+            t /= 2
+            n2New = np.clip(n2 + t * dn2, 0, 1)
+            FNew, PNew = residual(n2New)
+        if t < 1:
+            FNew, PNew, JNew = residual(n2New, jac=True)
+        n2, F, P, J = n2New, FNew, PNew, JNew
+    else:
+        logg.info("Relaxation fail: number of loops greater than max (%d)" % (MaxTry))
+
+    return P[:, 0], P[:, -1], n2
+
+
+def reservoirPhi(x):
+    """
+    Path integrals of a component with uniform gain along the fiber.
+
+    For a log-gain x, phi1 = (exp(x) - 1)/x and phi2 = (exp(x) - 1 - x)/x**2,
+    with their derivatives. Series expansions are used for small |x|.
+    """
+    small = np.abs(x) < 1e-2
+    xs = np.where(small, 1.0, x)
+    e = np.expm1(xs)
+    phi1 = np.where(small, 1 + x / 2 + x**2 / 6 + x**3 / 24, e / xs)
+    phi2 = np.where(small, 1 / 2 + x / 6 + x**2 / 24 + x**3 / 120, (e - xs) / xs**2)
+    dphi1 = np.where(small, 1 / 2 + x / 3 + x**2 / 8 + x**3 / 30, (xs * (e + 1) - e) / xs**2)
+    dphi2 = np.where(
+        small, 1 / 6 + x / 12 + x**2 / 40 + x**3 / 180, (xs * e - 2 * e + 2 * xs) / xs**3
+    )
+    return phi1, phi2, dphi1, dphi2
+
+
+def edfaReservoir(Psgl, pumpPmpFor, pumpPmpBck, prop, Nguess=None):
+    """
+    Steady state of the reduced (reservoir) EDFA models.
+
+    The metastable population is replaced by its integral along the fiber
+    (reservoir), so that the gain of each component is
+    exp(const3*N - const4*L), whatever its direction of propagation.
+
+    Saleh: the reservoir is the root of the Saleh equation (see
+    salehSteady), which neglects ASE. The ASE is then computed for the
+    resulting gain.
+
+    Jopson: the ASE is included in the reservoir equation. The powers along
+    the fiber are approximated by those of a uniform gain, which gives
+    closed-form path integrals (see reservoirPhi).
+
+    Inhomogeneous: Jopson equations for the ion subpopulations of
+    inhomogeneousSites, coupled through the gain that each component sees.
+    Subpopulations are saturated by the signals within their lines, which
+    models spectral hole burning.
+
+    Parameters
+    ----------
+    Psgl : np.array
+        Input signal power per state [W].
+    pumpPmpFor : np.array
+        Forward pump powers [W].
+    pumpPmpBck : np.array
+        Backward pump powers [W].
+    prop : parameter object (struct)
+        Rate-equation constants and indexes (see edfaGrid).
+    Nguess : np.array, optional
+        Initial guess of the reservoir of each subpopulation [m].
+
+    Returns
+    -------
+    P0 : np.array
+        Optical powers at z = 0.
+    PL : np.array
+        Optical powers at z = L.
+    N : np.array
+        Reservoir of each subpopulation [m].
+
+    """
+    L = prop.lngth
+    K = prop.freq.size
+    zeta = np.pi * prop.b**2 * prop.rho
+    invTal = 1 / prop.tal
+    hnu = Planck * prop.freq
+    const4L = prop.const4 * L
+
+    # Launched powers: forward components at z = 0, backward ones at z = L
+    Pb = np.zeros(K)
+    Pb[prop.idxPS] = Psgl
+    Pb[prop.idxPPF] = pumpPmpFor
+    Pb[prop.idxPPB] = pumpPmpBck
+
+    part = prop.sitePart if prop.algo == "Inhomogeneous" else np.ones((1, K))
+    M = part.shape[0]
+    const3 = part * prop.const3
+    absCoef = part * prop.absCoef
+    source = part * (prop.ASE * prop.const5)
+
+    # Saleh solution, also the initial guess of the other models
+    drive = prop.ASE == 0
+    N = np.full(
+        M,
+        salehSteady(
+            Pb[drive] / (hnu[drive] * zeta),
+            prop.const3[drive],
+            const4L[drive],
+            invTal,
+            L,
+        ),
+    )
+    if prop.algo != "Saleh":
+        if Nguess is not None and len(Nguess) == M:
+            N = np.array(Nguess, dtype=np.float64)
+        # the subpopulations hold equal fractions of the ions
+        scale = np.full(M, M / zeta)
+
+        def residual(N):
+            x = N @ const3 - const4L
+            S = N @ source
+            phi1, phi2, dphi1, dphi2 = reservoirPhi(x)
+            # Path integral of the power of each component and its derivatives
+            intP = L * (Pb * phi1 + S * phi2)
+            dIdx = L * (Pb * dphi1 + S * dphi2)
+            dIdS = L * phi2
+            A = (absCoef - const3 * N[:, np.newaxis] / L) / hnu
+            F = -N * invTal + scale * (A @ intP)
+            J = (
+                -np.diag(invTal + scale * ((const3 / hnu) @ intP) / L)
+                + scale[:, np.newaxis] * (A @ (dIdx[:, np.newaxis] * const3.T + dIdS[:, np.newaxis] * source.T))
+            )
+            return F, J
+
+        MaxTry = 50
+        F, J = residual(N)
+        for tryLoop in range(MaxTry):
+            dN = np.linalg.solve(J, -F)
+            if np.max(np.abs(dN)) < 1e-10 * L:
+                break
+            # Newton step with backtracking, N is kept within [0, L]
+            normF = np.max(np.abs(F))
+            t = 1.0
+            while True:
+                NNew = np.clip(N + t * dN, 0, L)
+                FNew, JNew = residual(NNew)
+                if np.max(np.abs(FNew)) < normF or t < 1e-3:
+                    break
+                t /= 2
+            N, F, J = NNew, FNew, JNew
+        else:
+            logg.info("Reservoir fail: number of loops greater than max (%d)" % (MaxTry))
+
+    # Output powers, with the ASE generated along the fiber
+    x = N @ const3 - const4L
+    Pout = Pb * np.exp(x) + (N @ source) * reservoirPhi(x)[0]
+    fwd = prop.uk > 0
+    return np.where(fwd, Pb, Pout), np.where(fwd, Pout, Pb), N
+
+
+def edfaControl(Psgl, pumpPmpFor, pumpPmpBck, prop, param_edf, guess=None):
+    """
+    Automatic gain (AGC) or power (APC) control of the forward pump.
+
+    The boundary-value problem is solved by edfaShooting or edfaCollocation
+    (param_edfa.bvpSolver), or by edfaReservoir for the Saleh, Jopson and
+    Inhomogeneous algorithms. The forward pump is updated either by the PID
+    controller or by a secant iteration on the logarithm of the pump
+    power (param_edfa.control).
+
+    Parameters
+    ----------
+    Psgl : np.array
+        Input signal power per state [W].
+    pumpPmpFor : np.array
+        Initial forward pump powers [W].
+    pumpPmpBck : np.array
+        Backward pump powers [W].
+    prop : parameter object (struct)
+        Rate-equation constants and indexes (see edfaGrid).
+    param_edf : parameter object (struct)
+        EDF parameters (see edfParams).
+    guess : np.array, optional
+        Warm-start data of the boundary-value solver: the optical powers at
+        z = L (shooting), the inversion profile (collocation) or the
+        reservoirs (reduced models).
+
+    Returns
+    -------
+    P0 : np.array
+        Optical powers at z = 0.
+    PL : np.array
+        Optical powers at z = L.
+    guess : np.array
+        Warm-start data of the final solution.
+
+    """
+    power_in = np.sum(Psgl)
+    idxOut = np.concatenate([prop.idxPS, prop.idxPAF])
+
+    # secant state: log of the pump scaling and control error
+    pumpRef = np.asarray(pumpPmpFor, dtype=np.float64)
+    u, uPrev, errorPrev = 0.0, None, None
+    slope0 = 10 / np.log(10)  # dB of output power per neper of pump power
+
+    # Variables used in loop
+    MaxTry = 15
+    tryCtrlLoop = 0
+    errorAutoCrtl = 1
+
+    while (np.abs(errorAutoCrtl) > prop.tolCtrl) and (tryCtrlLoop < MaxTry):
+        if prop.algo in ("Saleh", "Jopson", "Inhomogeneous"):
+            P0, PL, guess = edfaReservoir(Psgl, pumpPmpFor, pumpPmpBck, prop, guess)
+        elif prop.bvpSolver == "collocation":
+            P0, PL, guess = edfaCollocation(Psgl, pumpPmpFor, pumpPmpBck, prop, guess)
+        else:
+            P0, PL = edfaShooting(Psgl, pumpPmpFor, pumpPmpBck, prop, param_edf, guess)
+            guess = PL
+        # Automatic gain or power control
+        if (prop.type == "AGC") or (prop.type == "APC"):
+            power_out = np.sum(PL[idxOut])  # Output power - Signal + For. ASE
+            if prop.type == "AGC":
+                errorAutoCrtl = 10 * np.log10(power_out / power_in)
+            else:  # APC
+                errorAutoCrtl = 10 * np.log10(1e3 * power_out)
+            if prop.control == "PID":
+                # PID control - only in forward pumping
+                # TODO - and backward pumping? both?
+                pid = PID(
+                    prop.kp, prop.ki, prop.kd, setpoint=prop.value, output_limits=(-pumpPmpFor/2, pumpPmpFor/2)
+                )
+                pumpPmpFor = pumpPmpFor + pid(errorAutoCrtl)
+                errorAutoCrtl = errorAutoCrtl - prop.value
+            else:
+                errorAutoCrtl = errorAutoCrtl - prop.value
+                slope = slope0
+                if errorPrev is not None and u != uPrev:
+                    slope = (errorAutoCrtl - errorPrev) / (u - uPrev)
+                    if slope <= 0:
+                        slope = slope0
+                uPrev, errorPrev = u, errorAutoCrtl
+                # at most a factor of 4 in pump power per step
+                u = u + np.clip(-errorAutoCrtl / slope, -np.log(4), np.log(4))
+                if np.abs(errorAutoCrtl) > prop.tolCtrl:
+                    pumpPmpFor = pumpRef * np.exp(u)
+
+            if np.abs(errorAutoCrtl) > prop.tolCtrl:
+                logg.info("EDFA SM: control loop %2d" % (tryCtrlLoop + 1))
+                logg.info("Convergence: %5.3f dB" % (errorAutoCrtl))
+                logg.info("Pump for.: %5.2f mW\n" % (1e3 * np.sum(pumpPmpFor)))
+            tryCtrlLoop = tryCtrlLoop + 1
+            if tryCtrlLoop == MaxTry:
+                logg.info(
+                    "Control fail: number of loops greater than max (%d)" % (MaxTry)
+                )
+        else:
+            errorAutoCrtl = 0
+
+    return P0, PL, guess
+
+
+def edfaSM(Ei, Fs, Fc, param_edfa):
+    """
+    Steady-state EDFA model based on the Giles rate and propagation equations.
+
+    The algorithm is selected by param_edfa.algo: Giles_spectrum and
+    Giles_spatial solve the full equations along the fiber, while Saleh,
+    Jopson and Inhomogeneous are reduced reservoir models (see
+    edfaReservoir).
+
+    Parameters
+    ----------
+    Ei : np.array
+        Input optical field, shape (N, Npol).
+    Fs : scalar
+        Sampling frequency [Hz].
+    Fc : scalar
+        Central optical frequency [Hz].
+    param_edfa : parameter object (struct)
+        Amplifier, fiber and solver parameters (see edfaArgs).
+
+        param_edfa.binWidth: width of the spectral slices used to solve the
+        rate equations [Hz]. By default every FFT bin is a state variable.
+
+        param_edfa.binCenters: center frequencies of the spectral slices
+        [Hz], e.g. one slice per WDM channel.
+
+        param_edfa.cache: keep the fiber data and the converged solutions in
+        param_edfa.model (see edfaModel). A new call warm-starts from the
+        cached solution with the nearest input spectrum, or reuses it when
+        the relative distance between the spectra is at most
+        param_edfa.cacheTol.
+
+        param_edfa.seed: seed of the ASE noise generator.
+
+    Returns
+    -------
+    Eout : np.array
+        Amplified optical field.
+    PpumpF : np.array
+        Forward pump power at z = 0 and z = L [W].
+    PpumpB : np.array
+        Backward pump power at z = 0 and z = L [W].
+    noisef : np.array
+        Forward ASE field amplitude spectrum.
+
+    """
+    ## Format input signal
+    # Create second pol, if not exists
+    if np.shape(Ei)[1] == 1:
+        Ei = np.concatenate((Ei, np.zeros_like(Ei)), axis=1)
+
+    EoutFt, PpumpF, PpumpB, noisef = edfaSpectrum(fft(Ei, axis=0), Fs, Fc, param_edfa)
+    Eout = ifft(EoutFt, axis=0)
+
+    return Eout, PpumpF, PpumpB, noisef
+
+
+def edfaSpectrum(EiFt, Fs, Fc, param_edfa, rng=None):
+    """
+    EDFA model of edfaSM applied to the spectrum of the optical field.
+
+    Chained models (see amplifiedLink) keep the field in the frequency
+    domain across stages, and call this function directly.
+
+    Parameters
+    ----------
+    EiFt : np.array
+        Spectrum of the input optical field, fft(Ei, axis=0), shape (N, 2).
+        It is overwritten with the output spectrum.
+    Fs : scalar
+        Sampling frequency [Hz].
+    Fc : scalar
+        Central optical frequency [Hz].
+    param_edfa : parameter object (struct)
+        Amplifier, fiber and solver parameters (see edfaSM and edfaArgs).
+    rng : np.random.Generator, optional
+        ASE noise generator. By default it is seeded by param_edfa.seed.
+
+    Returns
+    -------
+    EoutFt : np.array
+        Spectrum of the amplified optical field.
+    PpumpF : np.array
+        Forward pump power at z = 0 and z = L [W].
+    PpumpB : np.array
+        Backward pump power at z = 0 and z = L [W].
+    noisef : np.array
+        Forward ASE field amplitude spectrum.
+
+    """
+    ## Verify arguments
+    param_edfa = edfaArgs(param_edfa)
+
+    ## Get pump signal frequency points
+    freqPmpFor = c / param_edfa.forPump["pump_lambda"]
+    freqPmpBck = c / param_edfa.bckPump["pump_lambda"]
+    pumpPmpFor = param_edfa.forPump["pump_signal"]
+    pumpPmpBck = param_edfa.bckPump["pump_signal"]
+    if len(freqPmpFor) != len(pumpPmpFor):
+        raise TypeError(
+            "edfaSM.forPump invalid argument - number of signals (freq and pump) must be igual."
+        )
+    if len(freqPmpBck) != len(pumpPmpBck):
+        raise TypeError(
+            "edfaSM.bckPump invalid argument - number of signals (freq and pump) must be igual."
+        )
+    lenPmpFor = np.size(freqPmpFor)
+    lenPmpBck = np.size(freqPmpBck)
+
+    ## Load Giles file
+    # Get EDF cross-sections and coeficients parameters from giles parameters file.
+    # absCross, emiCross, absCoef, gainCoef = edfParams(param_edfa, lbFl, fileT)
+    param_edf = edfParams(param_edfa)
+
+    ## Format input signal
+    lenFqSg, isy = np.shape(EiFt)
+    freqSgn = Fs * fftfreq(lenFqSg) + Fc
+    PsglFt = np.abs(EiFt) ** 2 / lenFqSg**2
+
+    # Aggregate the signal spectrum into slices (reduced state vector)
+    binned = (param_edfa.binWidth is not None) or (param_edfa.binCenters is not None)
+    if binned:
+        _, freqBin, PsglBin = spectralBins(
+            freqSgn, PsglFt, Fc, param_edfa.binWidth, param_edfa.binCenters
+        )
+    else:
+        freqBin, PsglBin = freqSgn, PsglFt
+    lenBin = len(freqBin)
+
+    ## Create ASE signal components
+    # Get optical band and specify frequency points for ASE calculation
+    opticalBand = freqSgn.max() - freqSgn.min()
+    freqASE = np.arange(-opticalBand / 2, opticalBand / 2, param_edfa.noiseBand) + Fc
+    lenASE = np.size(freqASE)
+
+    ## Rate and propagation constants on the simulation frequency grid
+    model = edfaModel(param_edfa) if param_edfa.cache else None
+    prop = edfaGrid(freqBin, freqASE, freqPmpFor, freqPmpBck, param_edfa, param_edf, model)
+    idxPS, idxPAF, idxPPF = prop.idxPS, prop.idxPAF, prop.idxPPF
+    idxPPB, idxPAB = prop.idxPPB, prop.idxPAB
+
+    # Signal power vector
+    Psgl = np.reshape(PsglBin, (isy * lenBin), order="F")
+
+    ## Steady-state solution
+    # Reuse or warm-start from the nearest cached solution
+    key = prop.key + edfaCtrlKey(param_edfa, pumpPmpFor, pumpPmpBck)
+    dist, sol = edfaLookup(model, key, Psgl)
+    if sol is not None and dist <= param_edfa.cacheTol:
+        P0, PL, Psgl = sol.P0, sol.PL, sol.Psgl
+    else:
+        guess = None
+        if sol is not None:
+            guess, pumpPmpFor = sol.guess, sol.P0[idxPPF]
+        P0, PL, guess = edfaControl(Psgl, pumpPmpFor, pumpPmpBck, prop, param_edf, guess)
+        if model is not None:
+            sol = parameters()
+            sol.key, sol.Psgl, sol.P0, sol.PL, sol.guess = key, Psgl, P0, PL, guess
+            model.solutions.append(sol)
+
+    ## Update pump signal
+    PpumpB = np.squeeze(np.array([P0[idxPPB], PL[idxPPB]]))
+    PpumpF = np.squeeze(np.array([P0[idxPPF], PL[idxPPF]]))
+
+    ## Update signal noise
+    # Forward ASE power per FFT bin, linearly interpolated from the ASE
+    # slices (constant beyond the first and last slice)
+    resolutionOffSet = param_edfa.noiseBand / (Fs / lenFqSg)
+    noiseF = np.reshape(PL[idxPAF], (lenASE, isy), order="F") / resolutionOffSet
+    pos = np.interp(freqSgn, freqASE, np.arange(lenASE))
+    ind = np.minimum(pos.astype(np.int64), max(lenASE - 2, 0))
+    w = (pos - ind)[:, np.newaxis]
+    noisef = np.sqrt(noiseF[ind] * (1 - w) + noiseF[np.minimum(ind + 1, lenASE - 1)] * w)
+
+    ## Update amplified optical signal
+    PsglIn = np.reshape(Psgl, (lenBin, isy), order="F")
+    PsglOut = np.reshape(PL[idxPS], (lenBin, isy), order="F")
+    if binned:
+        # Interpolate the gain of each slice onto the FFT grid
+        G = binGain(freqSgn, freqBin, PsglIn, PsglOut)
+    else:
+        G = np.divide(
+            np.maximum(PsglOut, 0),
+            PsglIn,
+            out=np.ones_like(PsglIn),
+            where=PsglIn > 0,
+        )
+    # Apply gain and noise in place, with complex Gaussian noise of unit
+    # power drawn in the precision of the input field
+    if rng is None:
+        rng = np.random.default_rng(param_edfa.seed)
+    realType = np.finfo(EiFt.dtype).dtype
+    noise = rng.standard_normal((lenFqSg, 2 * isy), dtype=realType).view(EiFt.dtype)
+    noise *= noisef * (lenFqSg / np.sqrt(2))
+    EiFt *= np.sqrt(G)
+    EiFt += noise
+
+    return EiFt, PpumpF, PpumpB, noisef
+
+
+@njit(cache=True)
+def salehRate(N, Q, const3, const4L, invTal):
+    """
+    Time derivative of the Saleh reservoir and its derivative with respect to it.
+
+    Parameters
+    ----------
+    N : scalar
+        Reservoir, i.e. metastable population integrated along the fiber [m].
+    Q : np.array
+        Input photon flux per dopant linear density, P/(h*freq*zeta) [m/s].
+    const3 : np.array
+        Absorption plus gain coefficients [1/m].
+    const4L : np.array
+        Absorption plus background loss coefficients times the fiber length.
+    invTal : scalar
+        Inverse of the metastable lifetime [1/s].
+
+    Returns
+    -------
+    f : scalar
+        dN/dt [m/s].
+    df : scalar
+        Derivative of dN/dt with respect to N [1/s].
+
+    """
+    f = -N * invTal
+    df = -invTal
+    for k in range(Q.size):
+        G = np.exp(const3[k] * N - const4L[k])
+        f -= Q[k] * (G - 1)
+        df -= Q[k] * const3[k] * G
+    return f, df
+
+
+@njit(cache=True)
+def salehSteady(Q, const3, const4L, invTal, L):
+    """
+    Steady-state Saleh reservoir: root of dN/dt = 0 in [0, L].
+
+    dN/dt is decreasing in N, so the root is unique. It is found by Newton
+    iterations safeguarded by bisection.
+    """
+    Nlow, Nhigh = 0.0, L
+    N = L / 2
+    for _ in range(100):
+        f, df = salehRate(N, Q, const3, const4L, invTal)
+        if f > 0:
+            Nlow = N
+        else:
+            Nhigh = N
+        Nnew = N - f / df
+        if Nnew <= Nlow or Nnew >= Nhigh:
+            Nnew = (Nlow + Nhigh) / 2
+        if abs(Nnew - N) < 1e-12 * L:
+            return Nnew
+        N = Nnew
+    return N
+
+
+@njit(cache=True)
+def salehReservoir(N, Qsgl, const3Sgl, const4LSgl, Qpmp, const3Pmp, const4LPmp, invTal, L, dt, Nt):
+    """
+    Integrate the Saleh reservoir over consecutive time blocks.
+
+    The input power is held constant within a block of duration dt, and the
+    reservoir is advanced with an exponential Euler step, which is stable
+    for any block duration. Nt[j] is the reservoir at the start of block j,
+    Nt[-1] at the end of the last block.
+    """
+    Nt[0] = N
+    for j in range(Qsgl.shape[0]):
+        fSgl, dfSgl = salehRate(N, Qsgl[j], const3Sgl, const4LSgl, invTal)
+        fPmp, dfPmp = salehRate(N, Qpmp, const3Pmp, const4LPmp, 0.0)
+        f = fSgl + fPmp
+        df = dfSgl + dfPmp
+        N += f / df * np.expm1(df * dt)
+        N = min(max(N, 0.0), L)
+        Nt[j + 1] = N
+    return N
+
+
+def edfaDynamic(Ei, Fs, Fc, param_edfa, n2=None):
+    """
+    Time-domain EDFA model based on the Saleh reservoir equation.
+
+    The rate and propagation equations are integrated along the fiber,
+    neglecting ASE in the rate equation, so that the amplifier state is
+    the single reservoir N(t) (metastable population integrated along the
+    fiber), driven by the input powers only:
+
+        dN/dt = -N/tal - sum_k Pin_k/(h*freq_k*zeta) * (exp(const3_k*N - const4_k*L) - 1)
+
+    with zeta = pi*b**2*rho. The field is processed in blocks of
+    param_edfa.blockSize samples: the power spectrum of each block drives
+    the reservoir, and the gain exp(const3*N - const4*L) and the ASE of
+    the block are applied in the frequency domain. The blocks are much
+    shorter than the gain dynamics (microseconds to milliseconds), and the
+    gain varies smoothly with frequency, so the block edges have no
+    significant effect. The pump powers are held constant.
+
+    Parameters
+    ----------
+    Ei : np.array
+        Input optical field, shape (N,) or (N, Npol).
+    Fs : scalar
+        Sampling frequency [Hz].
+    Fc : scalar
+        Central optical frequency [Hz].
+    param_edfa : parameter object (struct)
+        Amplifier and fiber parameters (see edfaArgs).
+
+        param_edfa.blockSize: number of samples per time block.
+
+        param_edfa.binWidth, param_edfa.binCenters: spectral slices used to
+        compute the reservoir drive (see edfaSM). By default every FFT bin
+        of a block is used.
+
+        param_edfa.seed: seed of the ASE noise generator.
+    n2 : scalar, optional
+        Initial average metastable population, e.g. the last value returned
+        by a previous call to continue a stream. By default the amplifier
+        is in steady state with the first block.
+
+    Returns
+    -------
+    Eout : np.array
+        Amplified optical field.
+    n2t : np.array
+        Average metastable population at the block boundaries, shape
+        (number of blocks + 1,). n2t[-1] is the final state.
+
+    """
+    ## Verify arguments
+    param_edfa = edfaArgs(param_edfa)
+    param_edf = edfParams(param_edfa)
+
+    freqPmp = c / np.concatenate(
+        [param_edfa.forPump["pump_lambda"], param_edfa.bckPump["pump_lambda"]]
+    )
+    Ppmp = np.concatenate(
+        [param_edfa.forPump["pump_signal"], param_edfa.bckPump["pump_signal"]]
+    )
+    if len(freqPmp) != len(Ppmp):
+        raise TypeError(
+            "edfaDynamic pump invalid argument - number of signals (freq and pump) must be igual."
+        )
+
+    ## Format input signal in blocks
+    shape = Ei.shape
+    Ei = np.reshape(Ei, (shape[0], -1))
+    lenSig, nPol = Ei.shape
+    B = int(param_edfa.blockSize)
+    nBlocks = -(-lenSig // B)
+    if nBlocks * B != lenSig:
+        Ei = np.concatenate([Ei, np.zeros((nBlocks * B - lenSig, nPol), dtype=Ei.dtype)])
+    Ei = np.reshape(Ei, (nBlocks, B, nPol))
+
+    ## Spectral slices of a block
+    freqSgn = Fs * fftfreq(B) + Fc
+    order = np.argsort(freqSgn)
+    binned = (param_edfa.binWidth is not None) or (param_edfa.binCenters is not None)
+    if binned:
+        ind, freqBin, _ = spectralBins(
+            freqSgn[order], np.zeros((B, 1)), Fc, param_edfa.binWidth, param_edfa.binCenters
+        )
+        used, starts = np.unique(ind, return_index=True)
+        freqBin = freqBin[used]
+    else:
+        freqBin = freqSgn[order]
+
+    ## Rate and propagation constants
+    model = edfaModel(param_edfa) if param_edfa.cache else None
+    prop = edfaGrid(freqBin, np.array([]), freqPmp, np.array([]), param_edfa, param_edf, model)
+    L = prop.lngth
+    zeta = np.pi * param_edfa.b**2 * param_edfa.rho
+    invTal = 1 / param_edfa.tal
+    nBin = len(freqBin)
+    const3Sgl = prop.const3[:nBin]
+    const4LSgl = prop.const4[:nBin] * L
+    scaleSgl = 1 / (Planck * freqBin * zeta)
+    Qpmp = Ppmp / (Planck * prop.freq[prop.idxPPF] * zeta)
+    const3Pmp = prop.const3[prop.idxPPF]
+    const4LPmp = prop.const4[prop.idxPPF] * L
+    # Gain and spontaneous emission constants of each FFT bin
+    absCoef = np.interp(c / freqSgn, param_edf.lbFl, param_edf.absCoef)
+    gainCoef = np.interp(c / freqSgn, param_edf.lbFl, param_edf.gainCoef)
+    const3Bin = absCoef + gainCoef
+    const4LBin = (absCoef + param_edfa.lossS) * L
+    aseBin = Planck * freqSgn * gainCoef * Fs * B
+
+    ## Process the blocks in chunks of bounded size
+    rng = np.random.default_rng(param_edfa.seed)
+    Eout = np.empty(Ei.shape, dtype=np.result_type(Ei.dtype, np.complex64))
+    Nt = np.empty(nBlocks + 1)
+    N = None if n2 is None else float(n2) * L
+    chunk = max(1, 2**20 // B)
+    for j0 in range(0, nBlocks, chunk):
+        j1 = min(j0 + chunk, nBlocks)
+        EiFt = fft(Ei[j0:j1], axis=1)
+        # Input photon flux of each slice
+        Pin = np.sum(np.abs(EiFt) ** 2, axis=2) / B**2
+        Qsgl = Pin[:, order]
+        if binned:
+            Qsgl = np.add.reduceat(Qsgl, starts, axis=1)
+        Qsgl *= scaleSgl
+        if N is None:
+            N = salehSteady(
+                np.concatenate([Qsgl[0], Qpmp]),
+                np.concatenate([const3Sgl, const3Pmp]),
+                np.concatenate([const4LSgl, const4LPmp]),
+                invTal,
+                L,
+            )
+        N = salehReservoir(
+            N, Qsgl, const3Sgl, const4LSgl, Qpmp, const3Pmp, const4LPmp,
+            invTal, L, B / Fs, Nt[j0 : j1 + 1],
+        )
+        # Gain at the mean reservoir of each block
+        Nmean = (Nt[j0:j1] + Nt[j0 + 1 : j1 + 1]) / 2
+        lnG = Nmean[:, np.newaxis] * const3Bin - const4LBin
+        EiFt *= np.exp(lnG / 2)[:, :, np.newaxis]
+        # ASE per polarization: h*freq*gainCoef*N*(G - 1)/ln(G)
+        lnG[lnG == 0] = 1e-12
+        sigma = np.sqrt(aseBin * Nmean[:, np.newaxis] * np.expm1(lnG) / lnG / 2)
+        EiFt += sigma[:, :, np.newaxis] * (
+            rng.standard_normal(EiFt.shape) + 1j * rng.standard_normal(EiFt.shape)
+        )
+        Eout[j0:j1] = ifft(EiFt, axis=1)
+
+    Eout = np.reshape(Eout, (nBlocks * B, nPol))[:lenSig]
+    return np.reshape(Eout, shape), Nt / L
+
+
+def edfaSweep(param_edfa, paramSweep):
+    """
+    Gain and noise figure spectra of the EDFA over a grid of operating points.
+
+    The steady state is solved directly on the channel frequencies, with
+    the ASE over the emission band of the fiber, without synthesizing
+    time-domain fields. The operating points are the combinations of
+    forward pump wavelength, forward pump power and input load. The
+    points of each pump wavelength and load are solved in sequence of
+    pump power, each one warm-started from the previous solution, and
+    these sequences are distributed over a pool of worker processes.
+    Workers are spawned and keep the fiber data and the frequency grids
+    in their EDFA model (see edfaModel). As with any spawn-based pool,
+    scripts must call this function from within an
+    ``if __name__ == "__main__":`` block.
+
+    Parameters
+    ----------
+    param_edfa : parameter object (struct)
+        Amplifier, fiber and solver parameters (see edfaArgs). The first
+        forward pump is replaced by the swept one, the backward pumps and
+        the gain or power control are kept.
+    paramSweep : parameter object (struct)
+        Sweep parameters:
+
+        paramSweep.freq: channel frequencies [Hz] [default: 40 channels
+        on the 100 GHz grid around 193.1 THz]
+
+        paramSweep.Pin: input power per channel [dBm], shape (nLoads,)
+        for flat loads or (nLoads, nCh) [default: -20]
+
+        paramSweep.pumpPower: forward pump powers [W] [default: first
+        forward pump of param_edfa]
+
+        paramSweep.pumpLambda: forward pump wavelengths [m] [default: first
+        forward pump of param_edfa]
+
+        paramSweep.aseBand: frequency range of the ASE [Hz] [default:
+        where the fiber gain coefficient exceeds 10% of its peak,
+        extended to the channels]
+
+        paramSweep.nWorkers: number of worker processes [default: cpu count]
+
+    Returns
+    -------
+    gain : np.array
+        Channel gain [dB], shape (nLambda, nPower, nLoads, nCh).
+    NF : np.array
+        Channel noise figure [dB], shape (nLambda, nPower, nLoads, nCh).
+    pumpFor : np.array
+        Forward pump power after gain or power control [W], shape
+        (nLambda, nPower, nLoads).
+
+    """
+    param_edfa = edfaArgs(param_edfa)
+    freq = getattr(paramSweep, "freq", 193.1e12 + (np.arange(40) - 19.5) * 100e9)
+    Pin = getattr(paramSweep, "Pin", -20)
+    pumpPower = getattr(paramSweep, "pumpPower", param_edfa.forPump["pump_signal"][:1])
+    pumpLambda = getattr(paramSweep, "pumpLambda", param_edfa.forPump["pump_lambda"][:1])
+    aseBand = getattr(paramSweep, "aseBand", None)
+    nWorkers = getattr(paramSweep, "nWorkers", os.cpu_count())
+
+    freq = np.sort(np.atleast_1d(freq)).astype(np.float64)
+    Pin = np.atleast_1d(Pin).astype(np.float64)
+    Pin = 10 ** (np.broadcast_to(Pin.reshape(len(Pin), -1), (len(Pin), len(freq))) / 10 - 3)
+    pumpPower = np.atleast_1d(pumpPower).astype(np.float64)
+    pumpLambda = np.atleast_1d(pumpLambda).astype(np.float64)
+
+    # ASE slices over the emission band of the fiber
+    if aseBand is None:
+        param_edf = edfParams(param_edfa)
+        gainCoef = param_edf.gainCoef
+        band = c / param_edf.lbFl[gainCoef >= 0.1 * gainCoef.max()]
+        aseBand = (min(band.min(), freq[0]), max(band.max(), freq[-1]))
+    freqASE = np.arange(aseBand[0], aseBand[1] + param_edfa.noiseBand, param_edfa.noiseBand)
+
+    tasks = [(indLambda, indLoad) for indLambda in range(len(pumpLambda)) for indLoad in range(len(Pin))]
+
+    if nWorkers > 1 and len(tasks) > 1:
+        # workers get a copy without the cached model of the caller
+        param = copy.copy(param_edfa)
+        param.model = None
+        args = (param, freq, freqASE, pumpPower)
+        with ProcessPoolExecutor(
+            min(nWorkers, len(tasks)),
+            mp_context=get_context("spawn"),
+            initializer=_edfaSweepInit,
+            initargs=args,
+        ) as pool:
+            futures = [
+                pool.submit(_edfaSweepTask, pumpLambda[indLambda], Pin[indLoad])
+                for indLambda, indLoad in tasks
+            ]
+            results = [future.result() for future in futures]
+    else:
+        _edfaSweepInit(param_edfa, freq, freqASE, pumpPower)
+        results = [
+            _edfaSweepTask(pumpLambda[indLambda], Pin[indLoad]) for indLambda, indLoad in tasks
+        ]
+
+    gain = np.empty((len(pumpLambda), len(pumpPower), len(Pin), len(freq)))
+    NF = np.empty_like(gain)
+    pumpFor = np.empty(gain.shape[:3])
+    for (indLambda, indLoad), (G, F, P) in zip(tasks, results):
+        gain[indLambda, :, indLoad] = G
+        NF[indLambda, :, indLoad] = F
+        pumpFor[indLambda, :, indLoad] = P
+
+    return gain, NF, pumpFor
+
+
+_edfaSweepWorker = {}
+
+
+def _edfaSweepInit(param_edfa, freq, freqASE, pumpPower):
+    _edfaSweepWorker["param"] = param_edfa
+    _edfaSweepWorker["args"] = (freq, freqASE, pumpPower)
+
+
+def _edfaSweepTask(pumpLambda, Pin):
+    """Gain, noise figure and forward pump of one pump wavelength and load."""
+    param_edfa = _edfaSweepWorker["param"]
+    freq, freqASE, pumpPower = _edfaSweepWorker["args"]
+    lenSgn, lenASE = len(freq), len(freqASE)
+
+    # the swept pump replaces the first forward pump
+    freqPmpFor = c / param_edfa.forPump["pump_lambda"]
+    freqPmpFor[0] = c / pumpLambda
+    pumpPmpFor = np.array(param_edfa.forPump["pump_signal"], dtype=np.float64)
+    freqPmpBck = c / param_edfa.bckPump["pump_lambda"]
+    pumpPmpBck = param_edfa.bckPump["pump_signal"]
+
+    param_edf = edfParams(param_edfa)
+    model = edfaModel(param_edfa)
+    prop = edfaGrid(freq, freqASE, freqPmpFor, freqPmpBck, param_edfa, param_edf, model)
+
+    # signal in a single polarization
+    Psgl = np.concatenate([Pin, np.zeros(lenSgn)])
+    gain = np.empty((len(pumpPower), lenSgn))
+    NF = np.empty_like(gain)
+    pumpFor = np.empty(len(pumpPower))
+    guess = None
+    for indPower, power in enumerate(pumpPower):
+        pumpPmpFor[0] = power
+        P0, PL, guess = edfaControl(Psgl, pumpPmpFor, pumpPmpBck, prop, param_edf, guess)
+        G = PL[prop.idxPS[:lenSgn]] / Pin
+        # ASE power spectral density per polarization at the channels
+        aseOut = PL[prop.idxPAF]
+        psd = np.interp(freq, freqASE, (aseOut[:lenASE] + aseOut[lenASE:]) / 2) / param_edfa.noiseBand
+        gain[indPower] = 10 * np.log10(G)
+        NF[indPower] = 10 * np.log10((2 * psd / (Planck * freq) + 1) / G)
+        pumpFor[indPower] = np.sum(P0[prop.idxPPF])
+    return gain, NF, pumpFor
+
+
+@lru_cache(maxsize=16)
+def _fiberOperator(N, Fs, Fc, alpha, D, h):
+    """Linear operator (attenuation and dispersion) of h km of fiber."""
+    c_kms = c / 1e3  # speed of light (vacuum) in km/s
+    λ = c_kms / Fc
+    α = alpha / (10 * np.log10(np.exp(1)))
+    β2 = -(D * λ**2) / (2 * np.pi * c_kms)
+    ω = 2 * np.pi * Fs * fftfreq(N)
+    return np.exp((-(α / 2) + 1j * (β2 / 2) * ω**2) * h)[:, np.newaxis]
+
+
+def fiberSpectrum(EiFt, Fs, Fc, paramFiber):
+    """
+    Manakov split-step propagation of the spectrum of the optical field.
+
+    Symmetric split-step with fixed step size, in which the half linear
+    steps of consecutive steps are merged, so that each step costs one
+    FFT/IFFT pair. The field enters and leaves in the frequency domain.
+
+    Parameters
+    ----------
+    EiFt : np.array
+        Spectrum of the input optical field, shape (N, 2).
+    Fs : scalar
+        Sampling frequency [Hz].
+    Fc : scalar
+        Central optical frequency [Hz].
+    paramFiber : parameter object (struct)
+        Fiber parameters (the names of manakovSSF):
+
+        paramFiber.Lspan: fiber length [km][default: 80 km]
+
+        paramFiber.hz: step-size [km][default: 0.5 km]
+
+        paramFiber.alpha: fiber attenuation parameter [dB/km][default: 0.2 dB/km]
+
+        paramFiber.D: chromatic dispersion parameter [ps/nm/km][default: 16 ps/nm/km]
+
+        paramFiber.gamma: fiber nonlinear parameter [1/W/km][default: 1.3 1/W/km]
+
+    Returns
+    -------
+    EoutFt : np.array
+        Spectrum of the optical field at the fiber output.
+
+    """
+    Lspan = getattr(paramFiber, "Lspan", 80)
+    hz = getattr(paramFiber, "hz", 0.5)
+    alpha = getattr(paramFiber, "alpha", 0.2)
+    D = getattr(paramFiber, "D", 16)
+    gamma = getattr(paramFiber, "gamma", 1.3)
+
+    N = len(EiFt)
+
+    def linOperator(h):
+        return _fiberOperator(N, Fs, Fc, alpha, D, round(h, 12))
+
+    if gamma == 0:
+        return EiFt * linOperator(Lspan)
+
+    nSteps = max(int(np.ceil(Lspan / hz - 1e-9)), 1)
+    steps = [Lspan / nSteps] * nSteps
+
+    EoutFt = EiFt * linOperator(steps[0] / 2)
+    for indStep, h in enumerate(steps):
+        # Nonlinear step (time domain)
+        Ech = ifft(EoutFt, axis=0)
+        Pch = np.sum(Ech.real**2 + Ech.imag**2, axis=1)
+        Ech *= np.exp(1j * ((8 / 9) * gamma * h) * Pch)[:, np.newaxis]
+        EoutFt = fft(Ech, axis=0)
+        # Linear step: second half of this step and first half of the next
+        hNext = steps[indStep + 1] if indStep + 1 < nSteps else 0
+        EoutFt *= linOperator((h + hNext) / 2)
+
+    return EoutFt
+
+
+def amplifiedLink(Ei, Fs, Fc, paramLink):
+    """
+    Multi-span amplified optical link.
+
+    Each span is a sequence of stages: fiber (fiberSpectrum), physical
+    EDFA (edfaSpectrum, with its own parameters and gain or power
+    control), gain-flattening filter and monitoring tap. The field is kept
+    in the frequency domain on one FFT grid from the input to the output
+    of the link, so the stages add no transforms besides those of the
+    split-step fiber propagation. The EDFA parameter objects keep their
+    models (see edfaModel), so that an amplifier reused in several spans,
+    or in several calls of a Monte Carlo loop, reuses or warm-starts from
+    its previous solutions.
+
+    Parameters
+    ----------
+    Ei : np.array
+        Input optical field, shape (N, 1) or (N, 2).
+    Fs : scalar
+        Sampling frequency [Hz].
+    Fc : scalar
+        Central optical frequency [Hz].
+    paramLink : parameter object (struct)
+        Link parameters:
+
+        paramLink.span: stages of each span, list of (kind, param) tuples.
+        kind is one of:
+
+            'fiber': param with the fiber parameters (see fiberSpectrum)
+
+            'edfa': param with the EDFA parameters (see edfaSM)
+
+            'gff': param.freq [Hz] and param.attdB [dB], attenuation
+            profile of the filter, linearly interpolated on the FFT grid,
+            and param.IL, insertion loss [dB] [default: 0 dB]
+
+            'tap': param.name, monitor name [default: tap<stage index>],
+            param.ratio, tapped power fraction [default: 0], and
+            param.spectrum, record the power spectrum [default: False]
+
+        [default: one 80 km fiber]
+
+        paramLink.Nspans: number of spans [default: 1]
+
+        paramLink.spans: stages of each span, list of Nspans sequences.
+        Has precedence over paramLink.span and paramLink.Nspans.
+
+        paramLink.seed: seed of the ASE noise generator [default: None]
+
+        paramLink.prec: precision of the field [default: np.complex128]
+
+    Returns
+    -------
+    Eout : np.array
+        Optical field at the output of the link, shape (N, 2).
+    monitor : dict
+        Records of each tap name, and of the amplifiers under 'edfa', in
+        order: parameter objects with the span index (span), the power per
+        polarization [W] (power), the power spectrum per FFT bin and
+        polarization [W] (psd, if param.spectrum), or the pump powers of
+        the amplifier (PpumpF, PpumpB, see edfaSM).
+
+    """
+    Nspans = getattr(paramLink, "Nspans", 1)
+    span = getattr(paramLink, "span", [("fiber", parameters())])
+    spans = getattr(paramLink, "spans", [span] * Nspans)
+    seed = getattr(paramLink, "seed", None)
+    prec = getattr(paramLink, "prec", np.complex128)
+
+    for stages in spans:
+        for kind, _ in stages:
+            if kind not in ("fiber", "edfa", "gff", "tap"):
+                raise TypeError("amplifiedLink stage invalid argument - [fiber, edfa, gff, tap].")
+
+    rng = np.random.default_rng(seed)
+
+    ## Format input signal
+    Ei = np.asarray(Ei, dtype=prec).reshape(len(Ei), -1)
+    if Ei.shape[1] == 1:
+        Ei = np.concatenate((Ei, np.zeros_like(Ei)), axis=1)
+    N = len(Ei)
+    freqSgn = Fs * fftfreq(N) + Fc
+    EchFt = fft(Ei, axis=0)
+
+    monitor = {}
+    for indSpan, stages in enumerate(spans):
+        for indStage, (kind, param) in enumerate(stages):
+            if kind == "fiber":
+                EchFt = fiberSpectrum(EchFt, Fs, Fc, param)
+            elif kind == "edfa":
+                EchFt, PpumpF, PpumpB, _ = edfaSpectrum(EchFt, Fs, Fc, param, rng)
+                record = parameters()
+                record.span, record.PpumpF, record.PpumpB = indSpan, PpumpF, PpumpB
+                monitor.setdefault("edfa", []).append(record)
+            elif kind == "gff":
+                attdB = np.interp(freqSgn, param.freq, param.attdB) + getattr(param, "IL", 0)
+                EchFt *= (10 ** (-attdB / 20))[:, np.newaxis]
+            else:
+                psd = (EchFt.real**2 + EchFt.imag**2) / N**2
+                record = parameters()
+                record.span, record.power = indSpan, np.sum(psd, axis=0)
+                if getattr(param, "spectrum", False):
+                    record.psd = psd
+                name = getattr(param, "name", f"tap{indStage}")
+                monitor.setdefault(name, []).append(record)
+                ratio = getattr(param, "ratio", 0)
+                if ratio > 0:
+                    EchFt *= np.sqrt(1 - ratio)
+
+    return ifft(EchFt, axis=0), monitor
@@ -1,53 +1,68 @@
 # -*- coding: utf-8 -*-
 
+import logging as logg
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from functools import lru_cache
+from os import path
 
 import numpy as np
+from numba import njit, prange, set_num_threads
 from commpy.channelcoding.ldpc import ldpc_bp_decode as dec
 from commpy.channelcoding.ldpc import triang_ldpc_systematic_encode as enc
 
+from optic.core import parameters
+from optic.metrics import calcLLR
+from optic.modulation import getConstellation, modulateGray
 
-def ldpcEncode(b, LDPCparams):
+_llrMax = 500
+
+
+def ldpcEncode(b, LDPCparams, seed=0, encoder="native"):
     """
     Encode data bits with binary LDPC code
     b = np.random.randint(2, size=(K, Nwords))
 
-    """
-    fecFamily = LDPCparams['filename'][6:11]
-    fecID = LDPCparams['filename'][12:]
-
-    num = [float(s) for s in re.findall(r'-?\d+\.?\d*', fecID)]
-    n = int(num[0])
+    seed: seed of the (cached) random interleaver
+    encoder: 'native' (bit-sliced encoder, see ldpcEncodeNative) or 'commpy'
 
-    N = n if fecFamily == 'AR4JA' else LDPCparams["n_vnodes"]
-    # generate random interleaver
-    interlv = np.random.permutation(N)
+    """
+    interlv, _ = ldpcInterleaver(LDPCparams, seed)
 
     # encode bits
-    codedBits = enc(b, LDPCparams, pad=False)
+    if encoder == "native":
+        codedBits = ldpcEncodeNative(b, LDPCparams)
+    else:
+        codedBits = enc(b, LDPCparams, pad=False)
+
     interCodedBits = (codedBits[interlv, :].T).reshape(1, -1).T
 
     return interCodedBits, codedBits, interlv
 
 
-def ldpcDecode(llr, interlv, LDPCparams, nIter, alg="SPA"):
+def ldpcDecode(llr, interlv, LDPCparams, nIter, alg="SPA", decoder="native"):
     """
     Decode binary LDPC encoded data bits
     b = np.random.randint(2, size=(K, Nwords))
 
-    """
-
-    fecID = LDPCparams['filename'][12:]
+    decoder: 'native' (layered decoder, see ldpcDecodeNative) or 'commpy'
 
-    num = [float(s) for s in re.findall(r'-?\d+\.?\d*', fecID)]    
+    """
 
     N = LDPCparams["n_vnodes"]
-    n = int(num[0])
+    n = _codeLength(LDPCparams)
 
     dep = int(N-n)
 
-    # generate deinterleaver
-    deinterlv = interlv.argsort()
+    # deinterleaver (cached if interlv comes from ldpcInterleaver)
+    for cachedInterlv, deinterlv in LDPCparams.get("interleaver", {}).values():
+        if cachedInterlv is interlv:
+            break
+    else:
+        deinterlv = interlv.argsort()
 
     # deinterleave received LLRs
     llr = llr.reshape(-1, n)
@@ -60,7 +75,959 @@ def ldpcDecode(llr, interlv, LDPCparams, nIter, alg="SPA"):
     llr = llr.ravel()
 
     # decode received code words
-    decodedBits, llr_out = dec(llr, LDPCparams, alg, nIter)
+    if decoder == "native":
+        decodedBits, llr_out, _ = ldpcDecodeNative(llr, LDPCparams, nIter, alg)
+        decodedBits = decodedBits.squeeze()
+        llr_out = llr_out.squeeze()
+    else:
+        decodedBits, llr_out = dec(llr, LDPCparams, alg, nIter)
 
     return decodedBits, llr_out
 
+
+
+def parityCheckCSR(LDPCparams):
+    """
+    Sparse (CSR) adjacency of the parity-check matrix of an LDPC code.
+
+    The result is cached in LDPCparams['csr'].
+
+    Parameters
+    ----------
+    LDPCparams : dict
+        LDPC code parameters (see commpy's get_ldpc_code_params).
+
+    Returns
+    -------
+    rowPtr : np.array of ints
+        Index of the first edge of each check node (length n_cnodes + 1).
+    colInd : np.array of ints
+        Variable node connected by each edge.
+
+    """
+    if LDPCparams.get("csr") is None:
+        m = LDPCparams["n_cnodes"]
+        deg = np.asarray(LDPCparams["cnode_deg_list"], dtype=np.int64)
+        adj = np.asarray(LDPCparams["cnode_adj_list"], dtype=np.int64)
+        adj = adj.reshape(m, LDPCparams["max_cnode_deg"])
+
+        rowPtr = np.zeros(m + 1, dtype=np.int64)
+        rowPtr[1:] = np.cumsum(deg)
+        colInd = adj[np.arange(adj.shape[1]) < deg.reshape(-1, 1)]
+
+        LDPCparams["csr"] = (rowPtr, colInd)
+
+    return LDPCparams["csr"]
+
+
+def ldpcDecodeNative(
+    llr,
+    LDPCparams,
+    nIter,
+    alg="NMSA",
+    prec=np.float32,
+    α=0.75,
+    β=0.5,
+    qStep=0.25,
+):
+    """
+    Decode a batch of LDPC codewords (layered belief propagation).
+
+    All codewords are decoded at once (in parallel), each one with its own
+    early termination (zero syndrome).
+
+    Parameters
+    ----------
+    llr : np.array
+        Received LLRs (positive values favor bit 0), with length multiple
+        of the block length.
+    LDPCparams : dict
+        LDPC code parameters (see commpy's get_ldpc_code_params).
+    nIter : int
+        Maximum number of decoding iterations.
+    alg : string, optional
+        Check node update: 'SPA' (sum-product), 'MSA' (min-sum), 'NMSA'
+        (normalized min-sum) or 'OMSA' (offset min-sum). The default is
+        'NMSA'.
+    prec : np.dtype, optional
+        Message representation: np.float32, np.float64 or np.int8
+        (quantized min-sum). The default is np.float32.
+    α : scalar, optional
+        Normalization factor of 'NMSA'. The default is 0.75.
+    β : scalar, optional
+        Offset of 'OMSA'. The default is 0.5.
+    qStep : scalar, optional
+        Quantization step of the LLRs in the int8 mode. The default is 0.25.
+
+    Returns
+    -------
+    decodedBits : np.array of int8
+        Decoded codewords, one per column.
+    llr_out : np.array
+        Output LLRs, one codeword per column.
+    nIterUsed : np.array of ints
+        Number of iterations used to decode each codeword.
+
+    """
+    algs = {"SPA": 0, "MSA": 1, "NMSA": 2, "OMSA": 3}
+    if alg not in algs:
+        raise ValueError("alg should be 'SPA', 'MSA', 'NMSA' or 'OMSA'.")
+
+    rowPtr, colInd = parityCheckCSR(LDPCparams)
+    N = LDPCparams["n_vnodes"]
+    llr = np.asarray(llr).reshape(-1, N)
+
+    if prec == np.int8:
+        assert alg != "SPA", "int8 messages are only supported by min-sum"
+        llrQ = np.clip(np.rint(llr / qStep), -127, 127).astype(np.int8)
+        Lq, nIterUsed = ldpcLayeredDecodeQ(
+            llrQ,
+            rowPtr,
+            colInd,
+            nIter,
+            algs[alg],
+            int(np.rint(α * 16)),
+            int(np.rint(β / qStep)),
+        )
+        llr_out = (Lq * qStep).astype(np.float32)
+    else:
+        llr_out, nIterUsed = ldpcLayeredDecode(
+            np.clip(llr, -_llrMax, _llrMax).astype(prec),
+            rowPtr,
+            colInd,
+            nIter,
+            algs[alg],
+            prec(α),
+            prec(β),
+        )
+
+    decodedBits = np.signbit(llr_out).astype(np.int8)
+
+    return decodedBits.T, llr_out.T, nIterUsed
+
+
+@njit(cache=True)
+def checkSyndrome(L, rowPtr, colInd):
+    """
+    Check whether the hard decisions on L satisfy all parity checks.
+
+    Parameters
+    ----------
+    L : np.array
+        A posteriori LLRs.
+    rowPtr : np.array of ints
+        CSR row pointers of the parity-check matrix.
+    colInd : np.array of ints
+        CSR column indexes of the parity-check matrix.
+
+    Returns
+    -------
+    bool
+        True if the syndrome is zero.
+
+    """
+    for c in range(len(rowPtr) - 1):
+        parity = 0
+        for e in range(rowPtr[c], rowPtr[c + 1]):
+            parity ^= L[colInd[e]] < 0
+        if parity:
+            return False
+    return True
+
+
+@njit(cache=True)
+def phi(x):
+    """Compute phi(x) = -log(tanh(x/2)) (SPA check node function)."""
+    x = min(max(x, 1e-7), 40.0)
+    return -np.log(np.tanh(x / 2))
+
+
+@njit(parallel=True, cache=True)
+def ldpcLayeredDecode(llr, rowPtr, colInd, nIter, alg, α, β):
+    """
+    Layered belief propagation decoder core (floating point messages).
+
+    Parameters
+    ----------
+    llr : (Nwords, N) np.array
+        Received LLRs.
+    rowPtr : np.array of ints
+        CSR row pointers of the parity-check matrix.
+    colInd : np.array of ints
+        CSR column indexes of the parity-check matrix.
+    nIter : int
+        Maximum number of iterations.
+    alg : int
+        0: SPA, 1: MSA, 2: NMSA, 3: OMSA.
+    α : scalar
+        Normalization factor (NMSA).
+    β : scalar
+        Offset (OMSA).
+
+    Returns
+    -------
+    L : (Nwords, N) np.array
+        A posteriori LLRs.
+    nIterUsed : np.array of ints
+        Number of iterations used for each codeword.
+
+    """
+    nWords = llr.shape[0]
+    nChecks = len(rowPtr) - 1
+    maxDeg = np.max(rowPtr[1:] - rowPtr[:-1])
+
+    L = llr.copy()
+    nIterUsed = np.zeros(nWords, dtype=np.int64)
+
+    for w in prange(nWords):
+        Lw = L[w]
+        R = np.zeros(len(colInd), dtype=llr.dtype)
+        t = np.zeros(maxDeg, dtype=llr.dtype)
+
+        for it in range(nIter):
+            if checkSyndrome(Lw, rowPtr, colInd):
+                break
+            nIterUsed[w] = it + 1
+
+            for c in range(nChecks):
+                e0 = rowPtr[c]
+                deg = rowPtr[c + 1] - e0
+
+                # variable-to-check messages
+                sgn = 1
+                for i in range(deg):
+                    t[i] = Lw[colInd[e0 + i]] - R[e0 + i]
+                    if t[i] < 0:
+                        sgn = -sgn
+
+                if alg == 0:  # sum-product
+                    S = 0.0
+                    for i in range(deg):
+                        S += phi(abs(t[i]))
+                    for i in range(deg):
+                        mag = phi(S - phi(abs(t[i])))
+                        s = sgn if t[i] >= 0 else -sgn
+                        R[e0 + i] = s * min(mag, _llrMax)
+                else:  # min-sum variants
+                    min1 = np.inf
+                    min2 = np.inf
+                    pos = 0
+                    for i in range(deg):
+                        a = abs(t[i])
+                        if a < min1:
+                            min2 = min1
+                            min1 = a
+                            pos = i
+                        elif a < min2:
+                            min2 = a
+                    for i in range(deg):
+                        mag = min2 if i == pos else min1
+                        if alg == 2:
+                            mag = α * mag
+                        elif alg == 3:
+                            mag = max(mag - β, 0)
+                        s = sgn if t[i] >= 0 else -sgn
+                        R[e0 + i] = s * mag
+
+                # a posteriori LLRs
+                for i in range(deg):
+                    Lw[colInd[e0 + i]] = t[i] + R[e0 + i]
+
+    return L, nIterUsed
+
+
+@njit(parallel=True, cache=True)
+def ldpcLayeredDecodeQ(llr, rowPtr, colInd, nIter, alg, αq, βq):
+    """
+    Layered min-sum decoder core (int8 quantized messages).
+
+    Check-to-variable messages are stored as int8 and a posteriori LLRs as
+    saturated int16.
+
+    Parameters
+    ----------
+    llr : (Nwords, N) np.array of int8
+        Quantized received LLRs.
+    rowPtr : np.array of ints
+        CSR row pointers of the parity-check matrix.
+    colInd : np.array of ints
+        CSR column indexes of the parity-check matrix.
+    nIter : int
+        Maximum number of iterations.
+    alg : int
+        1: MSA, 2: NMSA, 3: OMSA.
+    αq : int
+        Normalization factor (NMSA) in units of 1/16.
+    βq : int
+        Offset (OMSA) in quantization steps.
+
+    Returns
+    -------
+    L : (Nwords, N) np.array of int16
+        Quantized a posteriori LLRs.
+    nIterUsed : np.array of ints
+        Number of iterations used for each codeword.
+
+    """
+    nWords, N = llr.shape
+    nChecks = len(rowPtr) - 1
+    maxDeg = np.max(rowPtr[1:] - rowPtr[:-1])
+
+    L = llr.astype(np.int16)
+    nIterUsed = np.zeros(nWords, dtype=np.int64)
+
+    for w in prange(nWords):
+        Lw = L[w]
+        R = np.zeros(len(colInd), dtype=np.int8)
+        t = np.zeros(maxDeg, dtype=np.int32)
+
+        for it in range(nIter):
+            if checkSyndrome(Lw, rowPtr, colInd):
+                break
+            nIterUsed[w] = it + 1
+
+            for c in range(nChecks):
+                e0 = rowPtr[c]
+                deg = rowPtr[c + 1] - e0
+
+                sgn = 1
+                min1 = 127
+                min2 = 127
+                pos = 0
+                for i in range(deg):
+                    v = np.int32(Lw[colInd[e0 + i]]) - np.int32(R[e0 + i])
+                    v = min(max(v, -127), 127)
+                    t[i] = v
+                    if v < 0:
+                        sgn = -sgn
+                    a = abs(v)
+                    if a < min1:
+                        min2 = min1
+                        min1 = a
+                        pos = i
+                    elif a < min2:
+                        min2 = a
+
+                for i in range(deg):
+                    mag = min2 if i == pos else min1
+                    if alg == 2:
+                        mag = (mag * αq + 8) >> 4
+                    elif alg == 3:
+                        mag = max(mag - βq, 0)
+                    s = sgn if t[i] >= 0 else -sgn
+                    R[e0 + i] = s * mag
+                    Lw[colInd[e0 + i]] = min(max(t[i] + s * mag, -32767), 32767)
+
+    return L, nIterUsed
+
+
+def getLDPCparams(filePath):
+    """
+    Load an LDPC code from its parity-check design file.
+
+    The file is parsed only once per process (the result is cached), so
+    that the systematic encoder structure, CSR adjacency and interleavers
+    computed on the returned dict are also reused by later calls.
+
+    Parameters
+    ----------
+    filePath : string
+        Path to the LDPC design file (e.g. optic/fecParams/LDPC_*.txt).
+
+    Returns
+    -------
+    LDPCparams : dict
+        LDPC code parameters (same keys as commpy's get_ldpc_code_params),
+        plus 'filename', 'n' (number of transmitted bits per codeword) and
+        'K' (number of information bits per codeword).
+
+    """
+    return _loadLDPCparams(path.abspath(filePath))
+
+
+@lru_cache(maxsize=None)
+def _loadLDPCparams(filePath):
+    with open(filePath) as f:
+        lines = f.read().splitlines()
+
+    N, m = [int(x) for x in lines[0].split()]
+    maxVdeg, maxCdeg = [int(x) for x in lines[1].split()]
+    vDeg = np.array(lines[2].split(), dtype=np.int32)
+    cDeg = np.array(lines[3].split(), dtype=np.int32)
+
+    # 1-based adjacency lists, one node per line
+    vAdj = np.array(" ".join(lines[4 : 4 + N]).split(), dtype=np.int64) - 1
+    cAdj = np.array(" ".join(lines[4 + N : 4 + N + m]).split(), dtype=np.int64) - 1
+
+    # edge lists: (node, position in the node list, neighbor)
+    vNode = np.repeat(np.arange(N), vDeg)
+    vPos = np.arange(len(vAdj)) - np.repeat(np.cumsum(vDeg) - vDeg, vDeg)
+    cNode = np.repeat(np.arange(m), cDeg)
+    cPos = np.arange(len(cAdj)) - np.repeat(np.cumsum(cDeg) - cDeg, cDeg)
+
+    # position of each edge in the adjacency list of the opposite node
+    vKey = vNode * m + vAdj
+    cKey = cAdj * m + cNode
+    vSort = np.argsort(vKey)
+    cSort = np.argsort(cKey)
+    cnodeVnodeMap = np.empty(len(cAdj), dtype=np.int64)
+    vnodeCnodeMap = np.empty(len(vAdj), dtype=np.int64)
+    cnodeVnodeMap[cSort] = vPos[vSort]
+    vnodeCnodeMap[vSort] = cPos[cSort]
+
+    vnodeAdjList = -np.ones((N, maxVdeg), dtype=np.int32)
+    cnodeAdjList = -np.ones((m, maxCdeg), dtype=np.int32)
+    vnodeMap = -np.ones((N, maxVdeg), dtype=np.int32)
+    cnodeMap = -np.ones((m, maxCdeg), dtype=np.int32)
+    vnodeAdjList[vNode, vPos] = vAdj
+    cnodeAdjList[cNode, cPos] = cAdj
+    vnodeMap[vNode, vPos] = vnodeCnodeMap
+    cnodeMap[cNode, cPos] = cnodeVnodeMap
+
+    # number of transmitted bits (AR4JA codes have punctured variable nodes)
+    fileName = path.basename(filePath)
+    n = int(re.findall(r"_(\d+)b_", fileName)[0]) if "_AR4JA_" in fileName else N
+
+    LDPCparams = {
+        "n_vnodes": N,
+        "n_cnodes": m,
+        "max_vnode_deg": maxVdeg,
+        "max_cnode_deg": maxCdeg,
+        "vnode_adj_list": vnodeAdjList.ravel(),
+        "cnode_adj_list": cnodeAdjList.ravel(),
+        "vnode_cnode_map": vnodeMap.ravel(),
+        "cnode_vnode_map": cnodeMap.ravel(),
+        "vnode_deg_list": vDeg,
+        "cnode_deg_list": cDeg,
+        "filename": path.sep + fileName,
+        "n": n,
+        "K": N - m,
+    }
+
+    return LDPCparams
+
+
+def ldpcEncoderSetup(LDPCparams):
+    """
+    Precompute the systematic encoding schedule of an LDPC code.
+
+    The parity bits (last n_cnodes variable nodes) are solved by peeling:
+    each scheduled check node determines one parity bit from bits already
+    known. If peeling gets stuck, a few parity bits are declared free
+    (core bits) and solved at the end from the remaining check nodes with
+    a small GF(2) system. Codes with triangular/staircase parity parts
+    (11n, DVB-S2) have no core bits. The result is cached in
+    LDPCparams['encoder'].
+
+    Parameters
+    ----------
+    LDPCparams : dict
+        LDPC code parameters.
+
+    Returns
+    -------
+    enc : parameters
+        Encoder structure: schedRowPtr, schedColInd and pivots (scheduled
+        check nodes in order), core (free parity bits), checkRowPtr and
+        checkColInd (remaining check nodes) and solver (GF(2) map from
+        the remaining syndromes to the core bits).
+
+    """
+    if LDPCparams.get("encoder") is not None:
+        return LDPCparams["encoder"]
+
+    rowPtr, colInd = parityCheckCSR(LDPCparams)
+    N = LDPCparams["n_vnodes"]
+    m = LDPCparams["n_cnodes"]
+    K = N - m
+
+    rowOf = np.repeat(np.arange(m), np.diff(rowPtr))
+    isPar = colInd >= K
+
+    # parity columns -> check nodes (CSC of the parity part)
+    parRows = rowOf[isPar]
+    parCols = colInd[isPar] - K
+    order = np.argsort(parCols, kind="stable")
+    colPtr = np.zeros(m + 1, dtype=np.int64)
+    colPtr[1:] = np.cumsum(np.bincount(parCols, minlength=m))
+    colRows = parRows[order]
+
+    nUnknown = np.bincount(parRows, minlength=m)
+    known = np.zeros(m, dtype=bool)
+    used = np.zeros(m, dtype=bool)
+    sched, pivots, core = [], [], []
+
+    def resolve(c):
+        known[c] = True
+        for r in colRows[colPtr[c] : colPtr[c + 1]]:
+            nUnknown[r] -= 1
+            if nUnknown[r] == 1 and not used[r]:
+                queue.append(r)
+
+    queue = list(np.flatnonzero(nUnknown == 1))
+    while True:
+        while queue:
+            r = queue.pop()
+            if used[r] or nUnknown[r] != 1:
+                continue
+            cols = colInd[rowPtr[r] : rowPtr[r + 1]]
+            cols = cols[cols >= K] - K
+            c = cols[~known[cols]][0]
+            used[r] = True
+            sched.append(r)
+            pivots.append(c + K)
+            resolve(c)
+
+        if known.all():
+            break
+
+        # peeling is stuck: free the unknown bit shared by most of the
+        # pending checks with two unknown bits
+        pending = ~used[colRows] & (nUnknown[colRows] == 2)
+        score = np.add.reduceat(pending, colPtr[:-1]) * (np.diff(colPtr) > 0)
+        score[known] = -1
+        c = np.argmax(score)
+        core.append(c + K)
+        resolve(c)
+
+    sched = np.array(sched, dtype=np.int64)
+    check = np.flatnonzero(~used)
+
+    enc = parameters()
+    enc.schedRowPtr, enc.schedColInd = _subCSR(rowPtr, colInd, sched)
+    enc.pivots = np.array(pivots, dtype=np.int64)
+    enc.core = np.array(core, dtype=np.int64)
+    enc.checkRowPtr, enc.checkColInd = _subCSR(rowPtr, colInd, check)
+    enc.solver = np.zeros((0, len(check)), dtype=np.uint8)
+
+    g = len(core)
+    if g > 0:
+        # syndrome of the remaining checks for each unit core bit
+        nLanes = (g + 63) // 64
+        X = np.zeros((nLanes, N), dtype=np.uint64)
+        j = np.arange(g)
+        X[j // 64, enc.core] = np.uint64(1) << (j % 64).astype(np.uint64)
+        ldpcEncodeLanes(X, enc.schedRowPtr, enc.schedColInd, enc.pivots)
+        S = syndromeLanes(X, enc.checkRowPtr, enc.checkColInd)
+        Φ = ((S[j // 64, :] >> (j % 64).astype(np.uint64).reshape(-1, 1)) & 1).T
+        enc.solver = _leftInverseGF2(Φ.astype(np.uint8))
+
+    LDPCparams["encoder"] = enc
+
+    return enc
+
+
+def _subCSR(rowPtr, colInd, rows):
+    deg = rowPtr[rows + 1] - rowPtr[rows]
+    subPtr = np.zeros(len(rows) + 1, dtype=np.int64)
+    subPtr[1:] = np.cumsum(deg)
+    ind = np.repeat(rowPtr[rows] - subPtr[:-1], deg) + np.arange(subPtr[-1])
+    return subPtr, colInd[ind]
+
+
+def _leftInverseGF2(A):
+    nRows, nCols = A.shape
+    B = np.concatenate((A, np.eye(nRows, dtype=np.uint8)), axis=1)
+
+    # Gauss-Jordan elimination on bit-packed rows
+    nBits = B.shape[1]
+    B = np.packbits(B, axis=1, bitorder="little")
+    B = np.pad(B, ((0, 0), (0, -B.shape[1] % 8))).view(np.uint64)
+
+    for k in range(nCols):
+        col = (B[:, k // 64] >> np.uint64(k % 64)) & np.uint64(1)
+        p = k + np.flatnonzero(col[k:])
+        if len(p) == 0:
+            raise ValueError("The parity part of the parity-check matrix is singular")
+        B[[k, p[0]]] = B[[p[0], k]]
+        col[[k, p[0]]] = col[[p[0], k]]
+        col[k] = 0
+        B[col == 1] ^= B[k]
+
+    B = np.unpackbits(B.view(np.uint8), axis=1, count=nBits, bitorder="little")
+
+    return B[:nCols, nCols:]
+
+
+@njit(parallel=True, cache=True)
+def solveCoreLanes(X, core, solver, S):
+    """
+    Set the core parity bits of bit-sliced codewords.
+
+    Parameters
+    ----------
+    X : np.array of uint64
+        Bit-sliced codewords (nLanes, n_vnodes), updated in place.
+    core : np.array of ints
+        Core (free) parity bits.
+    solver : np.array of uint8
+        GF(2) map from the remaining syndromes to the core bits.
+    S : np.array of uint64
+        Bit-sliced syndromes of the remaining check nodes.
+
+    Returns
+    -------
+    None.
+
+    """
+    for l in prange(X.shape[0]):
+        for j in range(len(core)):
+            acc = np.uint64(0)
+            for i in range(S.shape[1]):
+                if solver[j, i]:
+                    acc ^= S[l, i]
+            X[l, core[j]] = acc
+
+
+@njit(parallel=True, cache=True)
+def ldpcEncodeLanes(X, schedRowPtr, schedColInd, pivots):
+    """
+    Run the encoding schedule on bit-sliced codewords.
+
+    Bit i of X[l, :] holds codeword 64*l + i, so each XOR operation
+    encodes 64 codewords at once.
+
+    Parameters
+    ----------
+    X : np.array of uint64
+        Bit-sliced codewords (nLanes, n_vnodes), updated in place.
+    schedRowPtr : np.array of ints
+        CSR row pointers of the scheduled check nodes.
+    schedColInd : np.array of ints
+        CSR column indexes of the scheduled check nodes.
+    pivots : np.array of ints
+        Parity bit determined by each scheduled check node.
+
+    Returns
+    -------
+    None.
+
+    """
+    for l in prange(X.shape[0]):
+        x = X[l]
+        for r in range(len(pivots)):
+            x[pivots[r]] = 0
+            acc = np.uint64(0)
+            for e in range(schedRowPtr[r], schedRowPtr[r + 1]):
+                acc ^= x[schedColInd[e]]
+            x[pivots[r]] = acc
+
+
+@njit(parallel=True, cache=True)
+def syndromeLanes(X, rowPtr, colInd):
+    """
+    Syndrome of bit-sliced codewords.
+
+    Parameters
+    ----------
+    X : np.array of uint64
+        Bit-sliced codewords (nLanes, n_vnodes).
+    rowPtr : np.array of ints
+        CSR row pointers of the check nodes.
+    colInd : np.array of ints
+        CSR column indexes of the check nodes.
+
+    Returns
+    -------
+    S : np.array of uint64
+        Bit-sliced syndromes (nLanes, number of check nodes).
+
+    """
+    nRows = len(rowPtr) - 1
+    S = np.zeros((X.shape[0], nRows), dtype=np.uint64)
+    for l in prange(X.shape[0]):
+        x = X[l]
+        for r in range(nRows):
+            acc = np.uint64(0)
+            for e in range(rowPtr[r], rowPtr[r + 1]):
+                acc ^= x[colInd[e]]
+            S[l, r] = acc
+    return S
+
+
+def ldpcEncodeNative(b, LDPCparams):
+    """
+    Encode a batch of data words with a binary LDPC code.
+
+    Words are bit-sliced in groups of 64 and encoded in parallel with the
+    precomputed schedule (see ldpcEncoderSetup).
+
+    Parameters
+    ----------
+    b : np.array
+        Data bits (K, Nwords).
+    LDPCparams : dict
+        LDPC code parameters.
+
+    Returns
+    -------
+    codedBits : np.array of int8
+        Systematic codewords (n_vnodes, Nwords), data bits first.
+
+    """
+    enc = ldpcEncoderSetup(LDPCparams)
+    N = LDPCparams["n_vnodes"]
+    K = N - LDPCparams["n_cnodes"]
+
+    b = np.asarray(b).reshape(K, -1)
+    nWords = b.shape[1]
+    nLanes = (nWords + 63) // 64
+
+    # bit-slicing: 64 codewords per uint64 lane
+    packed = np.zeros((N, nLanes * 8), dtype=np.uint8)
+    packed[:K, : (nWords + 7) // 8] = np.packbits(
+        b.astype(bool), axis=1, bitorder="little"
+    )
+    X = np.ascontiguousarray(packed.view(np.uint64).T)
+
+    ldpcEncodeLanes(X, enc.schedRowPtr, enc.schedColInd, enc.pivots)
+
+    g = len(enc.core)
+    if g > 0:
+        # solve the core parity bits and re-run the schedule
+        S = syndromeLanes(X, enc.checkRowPtr, enc.checkColInd)
+        solveCoreLanes(X, enc.core, enc.solver, S)
+        ldpcEncodeLanes(X, enc.schedRowPtr, enc.schedColInd, enc.pivots)
+
+    packed = np.ascontiguousarray(X.T).view(np.uint8)
+    codedBits = np.unpackbits(packed, axis=1, count=nWords, bitorder="little")
+
+    return codedBits.astype(np.int8)
+
+
+def ldpcInterleaver(LDPCparams, seed=0):
+    """
+    Seeded bit interleaver of an LDPC code (cached per seed).
+
+    Parameters
+    ----------
+    LDPCparams : dict
+        LDPC code parameters.
+    seed : int, optional
+        Seed of the random permutation. The default is 0.
+
+    Returns
+    -------
+    interlv : np.array of ints
+        Interleaver (permutation of the n transmitted bits).
+    deinterlv : np.array of ints
+        Deinterleaver (inverse permutation).
+
+    """
+    cache = LDPCparams.setdefault("interleaver", {})
+    if seed not in cache:
+        interlv = np.random.default_rng(seed).permutation(_codeLength(LDPCparams))
+        deinterlv = np.argsort(interlv)
+        interlv.flags.writeable = False
+        deinterlv.flags.writeable = False
+        cache[seed] = (interlv, deinterlv)
+
+    return cache[seed]
+
+
+def _codeLength(LDPCparams):
+    if "n" in LDPCparams:
+        return LDPCparams["n"]
+
+    fecFamily = LDPCparams["filename"][6:11]
+    fecID = LDPCparams["filename"][12:]
+    num = [float(s) for s in re.findall(r"-?\d+\.?\d*", fecID)]
+
+    return int(num[0]) if fecFamily == "AR4JA" else LDPCparams["n_vnodes"]
+
+
+def bicmBatch(LDPCparams, paramSim, seed=None):
+    """
+    Simulate one batch of LDPC-coded BICM codewords over the AWGN channel.
+
+    Random data words are LDPC encoded, interleaved, mapped to unit energy
+    symbols, sent through the AWGN channel, soft-demapped (calcLLR) and
+    decoded (ldpcDecode).
+
+    Parameters
+    ----------
+    LDPCparams : dict
+        LDPC code parameters (see getLDPCparams).
+    paramSim : parameter object (struct)
+        Simulation parameters (see simulateBICM).
+    seed : int or np.random.SeedSequence, optional
+        Seed of the data and noise generator. The default is None.
+
+    Returns
+    -------
+    counts : np.array of ints
+        [number of coded bits, pre-FEC bit errors, number of data bits,
+         post-FEC bit errors, number of codewords, codeword errors].
+
+    """
+    M = getattr(paramSim, "M", 16)
+    constType = getattr(paramSim, "constType", "qam")
+    SNR = getattr(paramSim, "SNR", 10)
+    nIter = getattr(paramSim, "nIter", 20)
+    alg = getattr(paramSim, "alg", "NMSA")
+    nWords = getattr(paramSim, "batchSize", 64)
+    interlvSeed = getattr(paramSim, "interlvSeed", 0)
+
+    rng = np.random.default_rng(seed)
+    K = LDPCparams["n_vnodes"] - LDPCparams["n_cnodes"]
+
+    # constellation with unit average energy
+    const = getConstellation(M, constType)
+    constSymb = const.symb / np.sqrt(const.Es)
+
+    # encode random data words
+    bits = rng.integers(0, 2, size=(K, nWords))
+    bitsTx, _, interlv = ldpcEncode(bits, LDPCparams, seed=interlvSeed)
+    assert len(bitsTx) % int(np.log2(M)) == 0, "codeword bits do not fill the symbols"
+
+    # map bits to symbols and add noise
+    symbTx = modulateGray(bitsTx, M, constType) / np.sqrt(const.Es)
+    σ2 = 10 ** (-SNR / 10)
+    noise = rng.normal(0, 1, (len(symbTx), 2)) @ np.array([1, 1j])
+    symbRx = symbTx + np.sqrt(σ2 / 2) * noise
+
+    # soft demapping and decoding
+    llr = calcLLR(symbRx, σ2, constSymb, const.bitMap, np.ones(M) / M)
+    decodedBits, _ = ldpcDecode(llr, interlv, LDPCparams, nIter, alg)
+    decodedBits = decodedBits.reshape(-1, nWords)
+
+    preErr = np.sum((llr < 0) != bitsTx.ravel())
+    postErr = np.sum(decodedBits[:K] != bits, axis=0)
+
+    return np.array(
+        [
+            len(llr),
+            preErr,
+            bits.size,
+            np.sum(postErr),
+            nWords,
+            np.sum(postErr > 0),
+        ],
+        dtype=np.int64,
+    )
+
+
+def simulateBICM(LDPCparams, paramSim):
+    """
+    Monte Carlo simulation of LDPC-coded BICM over the AWGN channel.
+
+    Batches of codewords (see bicmBatch) are streamed through a pool of
+    worker processes, and the error counts are accumulated (in batch
+    order, so that results do not depend on the number of workers) until
+    paramSim.maxFrameErrors codeword errors or paramSim.maxWords codewords
+    are reached. Workers are spawned (numba's threading layers are not
+    fork-safe) and load the compiled kernels from numba's disk cache. As
+    with any spawn-based pool, scripts must call this function from
+    within an ``if __name__ == "__main__":`` block.
+
+    Parameters
+    ----------
+    LDPCparams : dict
+        LDPC code parameters (see getLDPCparams).
+    paramSim : parameter object (struct)
+        Simulation parameters:
+
+        paramSim.M: modulation order [default: 16]
+
+        paramSim.constType: 'qam', 'psk', 'pam' or 'ook' [default: 'qam']
+
+        paramSim.SNR: symbol SNR (Es/N0) in dB [default: 10]
+
+        paramSim.nIter: maximum number of decoding iterations [default: 20]
+
+        paramSim.alg: decoding algorithm (see ldpcDecodeNative) [default: 'NMSA']
+
+        paramSim.batchSize: number of codewords per batch [default: 64]
+
+        paramSim.maxWords: maximum number of codewords [default: 1e5]
+
+        paramSim.maxFrameErrors: codeword errors to stop at [default: 100]
+
+        paramSim.nWorkers: number of worker processes [default: cpu count]
+
+        paramSim.seed: seed of the data and noise generators [default: None]
+
+        paramSim.interlvSeed: seed of the bit interleaver [default: 0]
+
+    Returns
+    -------
+    preBER : float
+        Pre-FEC bit-error-rate (hard decisions on the channel LLRs).
+    postBER : float
+        Post-FEC bit-error-rate (data bits).
+    FER : float
+        Codeword (frame) error rate.
+    nWords : int
+        Number of simulated codewords.
+
+    """
+    batchSize = getattr(paramSim, "batchSize", 64)
+    maxWords = int(getattr(paramSim, "maxWords", 1e5))
+    maxFrameErrors = getattr(paramSim, "maxFrameErrors", 100)
+    nWorkers = getattr(paramSim, "nWorkers", os.cpu_count())
+    seed = getattr(paramSim, "seed", None)
+
+    nBatches = int(np.ceil(maxWords / batchSize))
+    entropy = np.random.SeedSequence(seed).entropy
+
+    def batchSeed(ind):
+        return np.random.SeedSequence(entropy, spawn_key=(ind,))
+
+    def stop(counts):
+        return counts[5] >= maxFrameErrors or counts[4] >= maxWords
+
+    # first batch runs locally: it also builds the encoder and interleaver
+    # that are sent to the workers, and fills numba's cache
+    counts = bicmBatch(LDPCparams, paramSim, batchSeed(0))
+    nextBatch = 1
+
+    if nWorkers > 1 and not stop(counts) and nBatches > 1:
+        with ProcessPoolExecutor(
+            nWorkers,
+            mp_context=get_context("spawn"),
+            initializer=_bicmWorkerInit,
+            initargs=(LDPCparams, paramSim),
+        ) as pool:
+            pending = deque()
+            while nextBatch < min(nBatches, 1 + 2 * nWorkers):
+                pending.append(pool.submit(_bicmWorkerTask, batchSeed(nextBatch)))
+                nextBatch += 1
+
+            while pending:
+                counts += pending.popleft().result()
+                if stop(counts):
+                    for future in pending:
+                        future.cancel()
+                    break
+                if nextBatch < nBatches:
+                    pending.append(
+                        pool.submit(_bicmWorkerTask, batchSeed(nextBatch))
+                    )
+                    nextBatch += 1
+    else:
+        while not stop(counts) and nextBatch < nBatches:
+            counts += bicmBatch(LDPCparams, paramSim, batchSeed(nextBatch))
+            nextBatch += 1
+
+    logg.info(
+        f"BICM: {counts[4]} codewords, {counts[5]} codeword errors."
+    )
+
+    preBER = counts[1] / counts[0]
+    postBER = counts[3] / counts[2]
+    FER = counts[5] / counts[4]
+
+    return preBER, postBER, FER, counts[4]
+
+
+_bicmWorker = {}
+
+
+def _bicmWorkerInit(LDPCparams, paramSim):
+    # one process per core: avoid oversubscription by the numba kernels
+    set_num_threads(1)
+    _bicmWorker["args"] = (LDPCparams, paramSim)
+
+
+def _bicmWorkerTask(seed):
+    return bicmBatch(*_bicmWorker["args"], seed)
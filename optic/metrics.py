@@ -1,13 +1,23 @@
 """Metrics for signal and performance characterization."""
+import copy
 import logging as logg
 
 import numpy as np
+from numpy.fft import fftfreq
 from numba import njit, prange
 from scipy.special import erf
+from scipy.signal import get_window
 import scipy.constants as const
 
+from optic.core import parameters
 from optic.dsp import pnorm
-from optic.modulation import GrayMapping, demodulateGray, minEuclid
+from optic.modulation import (
+    GrayMapping,
+    demodulateGray,
+    getConstellation,
+    hardDecision,
+    minEuclid,
+)
 
 
 
@@ -52,7 +62,7 @@ def sigPow(x):
     return np.mean(np.abs(x) ** 2)
 
 
-def fastBERcalc(rx, tx, M, constType):
+def fastBERcalc(rx, tx, M, constType, weights=None):
     """
     Monte Carlo BER/SER/SNR calculation.
 
@@ -66,6 +76,11 @@ def fastBERcalc(rx, tx, M, constType):
         Modulation order.
     constType : string
         Modulation type: 'qam', 'psk', 'pam' or 'ook'.
+    weights : np.array, optional
+        Importance sampling weights of each received symbol (see
+        models.awgnIS). If provided, rx is assumed to be in the same scale
+        as tx (no phase correction or power normalization is applied) and
+        the error counts are weighted accordingly. The default is None.
 
     Returns
     -------
@@ -100,6 +115,9 @@ def fastBERcalc(rx, tx, M, constType):
     BER = np.zeros(nModes)
     SER = np.zeros(nModes)
 
+    if weights is not None:
+        return weightedBERcalc(rx, tx, M, constType, weights)
+
     # pre-processing
     for k in range(nModes):
         if constType in ["qam", "psk"]:
@@ -114,17 +132,85 @@ def fastBERcalc(rx, tx, M, constType):
         SNR[k] = 10 * np.log10(
             signal_power(tx[:, k]) / signal_power(rx[:, k] - tx[:, k])
         )
+    # hard decisions of all modes at once (closed-form slicers)
+    indrx = hardDecision(np.sqrt(Es) * rx, M, constType)
+    indtx = hardDecision(np.sqrt(Es) * tx, M, constType)
+
+    # symbol indexes are the Gray bit sequences as integer decimals, hence
+    # the number of bit errors is the popcount of indrx XOR indtx
+    nBitErr = getConstellation(M, constType).bitMap.sum(axis=1)
+    nBitErr = nBitErr[indrx ^ indtx]
+
+    BER = np.mean(nBitErr, axis=0) / int(np.log2(M))
+    SER = np.mean(nBitErr > 0, axis=0)
+
+    return BER, SER, SNR
+
+
+def weightedBERcalc(rx, tx, M, constType, weights):
+    """
+    Importance sampling BER/SER/SNR calculation.
+
+    Parameters
+    ----------
+    rx : np.array
+        Received symbol sequence (same scale as tx).
+    tx : np.array
+        Transmitted symbol sequence.
+    M : int
+        Modulation order.
+    constType : string
+        Modulation type: 'qam', 'psk', 'pam' or 'ook'.
+    weights : np.array
+        Importance sampling weights of each received symbol.
+
+    Returns
+    -------
+    BER : np.array
+        Bit-error-rate.
+    SER : np.array
+        Symbol-error-rate.
+    SNR : np.array
+        Estimated SNR of the unbiased channel (IS estimate, much less
+        accurate than the BER/SER estimates).
+
+    """
+    try:
+        if weights.shape[1] > weights.shape[0]:
+            weights = weights.T
+    except IndexError:
+        weights = weights.reshape(len(weights), 1)
+    nModes = int(tx.shape[1])  # number of sinal modes
+    SNR = np.zeros(nModes)
+    BER = np.zeros(nModes)
+    SER = np.zeros(nModes)
+
+    # constellation parameters
+    constSymb = GrayMapping(M, constType)
+    Es = np.mean(np.abs(constSymb) ** 2)
+    b = int(np.log2(M))
+
     for k in range(nModes):
-        brx = demodulateGray(np.sqrt(Es) * rx[:, k], M, constType)
-        btx = demodulateGray(np.sqrt(Es) * tx[:, k], M, constType)
+        # common scaling factor that maps tx to the reference constellation
+        scale = np.sqrt(Es / sigPow(tx[:, k]))
 
-        err = np.logical_xor(brx, btx)
-        BER[k] = np.mean(err)
-        SER[k] = np.mean(np.sum(err.reshape(-1, int(np.log2(M))), axis=1) > 0)
+        brx = demodulateGray(scale * rx[:, k], M, constType)
+        btx = demodulateGray(scale * tx[:, k], M, constType)
+
+        err = np.logical_xor(brx, btx).reshape(-1, b)
+        w = weights[:, k]
+
+        BER[k] = np.mean(w * np.sum(err, axis=1)) / b
+        SER[k] = np.mean(w * (np.sum(err, axis=1) > 0))
+
+        # weighted estimate of the noise power of the unbiased channel
+        SNR[k] = 10 * np.log10(
+            sigPow(tx[:, k]) / np.mean(w * np.abs(rx[:, k] - tx[:, k]) ** 2)
+        )
     return BER, SER, SNR
 
 
-@njit(parallel=True)
+@njit(parallel=True, cache=True)
 def calcLLR(rxSymb, σ2, constSymb, bitMap, px):
     """
     LLR calculation (circular AGWN channel).
@@ -193,9 +279,7 @@ def monteCarloGMI(rx, tx, M, constType, px=[]):
     constSymb = GrayMapping(M, constType)
 
     # get bit mapping
-    b = int(np.log2(M))
-    bitMap = demodulateGray(constSymb, M, constType)
-    bitMap = bitMap.reshape(-1, b)
+    bitMap = getConstellation(M, constType).bitMap
 
     # We want all the signal sequences to be disposed in columns:
     try:
@@ -219,7 +303,7 @@ def monteCarloGMI(rx, tx, M, constType, px=[]):
     constSymb = constSymb / np.sqrt(Es)
 
     # Calculate source entropy
-    H = np.sum(-px * np.log2(px))
+    H = np.sum(-px[px > 0] * np.log2(px[px > 0]))
 
     # symbol normalization
     for k in range(nModes):
@@ -345,7 +429,7 @@ def calcMI(rx, tx, σ2, constSymb, pX):
     """
     N = len(rx)
     H_XgY = np.zeros(1, dtype=np.float64)
-    H_X = np.sum(-pX * np.log2(pX))
+    H_X = np.sum(-pX[pX > 0] * np.log2(pX[pX > 0]))
 
     for k in range(N):
         indSymb = np.argmin(np.abs(tx[k] - constSymb))
@@ -366,7 +450,7 @@ def calcMI(rx, tx, σ2, constSymb, pX):
         H_XgY -= log2_pYgX + np.log2(pX[indSymb]) - np.log2(pY)
     H_XgY = H_XgY / N
 
-    return H_X - H_XgY
+    return H_X - H_XgY[0]
 
 
 def Qfunc(x):
@@ -646,3 +730,249 @@ def calcLinOSNR(Ns, Pin, α, Ls, OSNRin, NF=4.5, Fc=193.1e12, Bref=12.5e9):
         Pn_in_edfa = Pn_out_edfa - α * Ls  # ASE power sent to the next EDFA
 
     return OSNR
+
+
+def spectrumAccumulate(x, Fs, paramOSA=None, acc=None):
+    """
+    Accumulate the Welch (segment-averaged) power spectrum of a signal.
+
+    The signal is split into windowed segments of paramOSA.nfft samples
+    with the given overlap, and the periodograms of all modes are summed.
+    Passing the accumulator returned by a previous call continues the
+    segmentation across calls, so that long fields can be processed in
+    blocks (streaming), with the same result as a single call.
+
+    Parameters
+    ----------
+    x : np.array
+        Signal block, shape (N,) or (N, Nmodes).
+    Fs : scalar
+        Sampling frequency in Hz.
+    paramOSA : parameter object (struct), optional
+        Spectrum analyzer parameters (ignored if acc is given):
+
+        paramOSA.RBW: resolution bandwidth [Hz] (None: FFT bin) [default: 12.5e9]
+
+        paramOSA.nfft: segment length [default: smallest power of 2 with
+        bins of at most RBW/4, or 4096 if RBW is None]
+
+        paramOSA.overlap: fraction of overlap between segments [default: 0.5]
+
+        paramOSA.window: segment window (see scipy.signal.get_window) [default: 'hann']
+
+        paramOSA.filter: RBW filter shape, 'rect' or 'gaussian' [default: 'rect']
+
+        paramOSA.units: 'dBm' or 'W' [default: 'dBm']
+    acc : parameter object (struct), optional
+        Accumulator of the previous blocks.
+
+    Returns
+    -------
+    acc : parameter object (struct)
+        Accumulator (see spectrumReadout).
+
+    """
+    x = np.asarray(x)
+    if x.ndim == 1:
+        x = x.reshape(-1, 1)
+
+    if acc is None:
+        RBW = getattr(paramOSA, "RBW", 12.5e9)
+        nfft = getattr(paramOSA, "nfft", None)
+        if nfft is None:
+            nfft = 4096 if RBW is None else int(2 ** np.ceil(np.log2(4 * Fs / RBW)))
+        overlap = getattr(paramOSA, "overlap", 0.5)
+        if not 0 <= overlap < 1:
+            raise ValueError("overlap must be in [0, 1).")
+
+        acc = parameters()
+        acc.Fs = Fs
+        acc.RBW = RBW
+        acc.nfft = int(nfft)
+        acc.hop = max(int(round(nfft * (1 - overlap))), 1)
+        acc.window = get_window(getattr(paramOSA, "window", "hann"), acc.nfft)
+        acc.filter = getattr(paramOSA, "filter", "rect")
+        acc.units = getattr(paramOSA, "units", "dBm")
+        acc.sumPSD = np.zeros((acc.nfft, x.shape[1]))
+        acc.nSeg = 0
+        acc.tail = x[:0]
+
+    x = np.concatenate([acc.tail, x]) if len(acc.tail) else x
+    nSeg = (len(x) - acc.nfft) // acc.hop + 1 if len(x) >= acc.nfft else 0
+
+    # periodograms of blocks of segments, vectorized over the modes
+    window = acc.window[:, np.newaxis].astype(np.finfo(x.dtype).dtype, copy=False)
+    for start in range(0, nSeg, 256):
+        segIdx = np.arange(start, min(start + 256, nSeg)) * acc.hop
+        frames = x[segIdx[:, np.newaxis] + np.arange(acc.nfft)] * window
+        X = np.fft.fft(frames, axis=1)
+        acc.sumPSD += np.sum(X.real**2 + X.imag**2, axis=0)
+    acc.nSeg += nSeg
+    acc.tail = x[nSeg * acc.hop :].copy()
+
+    return acc
+
+
+def spectrumReadout(acc, Fc=0):
+    """
+    Read the spectrum of a Welch accumulator, with RBW emulation.
+
+    The averaged power spectral density is convolved with the resolution
+    filter of the analyzer, of unit peak and noise bandwidth acc.RBW, so
+    that a tone reads its power and noise reads its density times RBW.
+
+    Parameters
+    ----------
+    acc : parameter object (struct)
+        Accumulator (see spectrumAccumulate).
+    Fc : scalar, optional
+        Central frequency of the signal. The default is 0.
+
+    Returns
+    -------
+    freq : np.array
+        Frequency axis [Hz], in ascending order.
+    spectrum : np.array
+        Power within the resolution bandwidth (per FFT bin if acc.RBW is
+        None), in W or dBm, shape (nfft, Nmodes).
+
+    """
+    if acc.nSeg == 0:
+        raise ValueError("not enough samples for one segment.")
+
+    df = acc.Fs / acc.nfft
+    # power spectral density [W/Hz]
+    psd = acc.sumPSD / (acc.nSeg * acc.Fs * np.sum(acc.window**2))
+
+    if acc.RBW is None:
+        spectrum = psd * df
+    else:
+        # resolution filter sampled on the FFT bins (circular convolution)
+        k = fftfreq(acc.nfft, 1 / acc.nfft)
+        if acc.filter == "rect":
+            # overlap of each bin with the passband
+            H = np.clip(acc.RBW / 2 - (np.abs(k) - 0.5) * df, 0, df) / df
+        elif acc.filter == "gaussian":
+            H = np.exp(-np.pi * (k * df / acc.RBW) ** 2)
+        else:
+            raise ValueError("filter must be 'rect' or 'gaussian'.")
+        spectrum = np.fft.ifft(
+            np.fft.fft(psd, axis=0) * np.fft.fft(H)[:, np.newaxis], axis=0
+        ).real * df
+
+    freq = np.fft.fftshift(fftfreq(acc.nfft, 1 / acc.Fs)) + Fc
+    spectrum = np.fft.fftshift(np.maximum(spectrum, 0), axes=0)
+    if acc.units == "dBm":
+        spectrum = 10 * np.log10(1e3 * spectrum + 1e-300)
+
+    return freq, spectrum
+
+
+def spectrumAnalyzer(x, Fs, Fc=0, paramOSA=None):
+    """
+    Optical spectrum analyzer: Welch spectrum with RBW emulation.
+
+    Parameters
+    ----------
+    x : np.array
+        Signal, shape (N,) or (N, Nmodes).
+    Fs : scalar
+        Sampling frequency in Hz.
+    Fc : scalar, optional
+        Central frequency of the signal. The default is 0.
+    paramOSA : parameter object (struct), optional
+        Spectrum analyzer parameters (see spectrumAccumulate). The default
+        segment length is at most the signal length.
+
+    Returns
+    -------
+    freq : np.array
+        Frequency axis [Hz].
+    spectrum : np.array
+        Power within the resolution bandwidth, in W or dBm, shape
+        (nfft, Nmodes).
+
+    """
+    RBW = getattr(paramOSA, "RBW", 12.5e9)
+    nfft = getattr(paramOSA, "nfft", None)
+    if nfft is None:
+        nfft = 4096 if RBW is None else int(2 ** np.ceil(np.log2(4 * Fs / RBW)))
+        nfft = min(nfft, 2 ** int(np.log2(len(x))))
+        paramOSA = copy.copy(paramOSA) if paramOSA is not None else parameters()
+        paramOSA.nfft = nfft
+
+    return spectrumReadout(spectrumAccumulate(x, Fs, paramOSA), Fc)
+
+
+def estimateOSNR(
+    freq,
+    spectrum,
+    chFreq,
+    chBand,
+    RBW=None,
+    guard=0,
+    noiseWidth=None,
+    Bref=12.5e9,
+    units="dBm",
+):
+    """
+    Estimate the OSNR of channels by in-band/out-of-band integration.
+
+    The signal plus noise power is integrated over the channel band, and
+    the noise density is the mean density in windows on both sides of the
+    band, interpolated to the channel center. The spectrum is summed over
+    the modes (e.g. both polarizations).
+
+    Parameters
+    ----------
+    freq : np.array
+        Frequency axis [Hz] (see spectrumAnalyzer).
+    spectrum : np.array
+        Power within the resolution bandwidth, shape (len(freq),) or
+        (len(freq), Nmodes).
+    chFreq : np.array
+        Channel center frequencies [Hz].
+    chBand : scalar
+        Channel integration bandwidth [Hz].
+    RBW : scalar, optional
+        Resolution bandwidth of the spectrum [Hz]. The default is the
+        frequency step (spectrum per FFT bin).
+    guard : scalar, optional
+        Gap between the channel band and the noise windows [Hz]. The
+        default is 0.
+    noiseWidth : scalar, optional
+        Width of each noise window [Hz]. The default is max(RBW, 4 frequency steps).
+    Bref : scalar, optional
+        Reference bandwidth for OSNR measurement. The default is 12.5e9.
+    units : string, optional
+        Units of the spectrum, 'dBm' or 'W'. The default is 'dBm'.
+
+    Returns
+    -------
+    OSNR : np.array
+        OSNR of each channel [dB].
+
+    """
+    spectrum = np.asarray(spectrum)
+    if spectrum.ndim > 1:
+        spectrum = 10 ** (spectrum / 10 - 3) if units == "dBm" else spectrum
+        spectrum = np.sum(spectrum, axis=1)
+    elif units == "dBm":
+        spectrum = 10 ** (spectrum / 10 - 3)
+
+    df = freq[1] - freq[0]
+    RBW = df if RBW is None else RBW
+    noiseWidth = max(RBW, 4 * df) if noiseWidth is None else noiseWidth
+    psd = spectrum / RBW  # W/Hz
+
+    OSNR = np.zeros(len(np.atleast_1d(chFreq)))
+    for indCh, fc in enumerate(np.atleast_1d(chFreq)):
+        inBand = np.abs(freq - fc) <= chBand / 2
+        edge = chBand / 2 + guard
+        left = (freq < fc - edge) & (freq >= fc - edge - noiseWidth)
+        right = (freq > fc + edge) & (freq <= fc + edge + noiseWidth)
+        noisePSD = (np.mean(psd[left]) + np.mean(psd[right])) / 2
+        Psig = np.sum(psd[inBand]) * df - noisePSD * np.sum(inBand) * df
+        OSNR[indCh] = 10 * np.log10(Psig / (noisePSD * Bref))
+
+    return OSNR
@@ -1,24 +1,25 @@
 """Basic physical models for optical devices and optical channels."""
 import logging as logg
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import numpy as np
 import scipy.constants as const
 from scipy.linalg import norm
-from numba import njit
+import numba
+from numba import njit, prange
 from numpy.fft import fft, fftfreq, ifft
 from numpy.random import normal
+from scipy.fft import next_fast_len
 from tqdm.notebook import tqdm
 
 from optic.dsp import lowPassFIR
 from optic.metrics import signal_power
+from optic.modulation import minEuclid
 
-try:
-    from optic.dspGPU import firFilter
-except ImportError:
-    from optic.dsp import firFilter
 
-
-def mzm(Ai, u, Vπ, Vb):
+def mzm(Ai, u, Vπ, Vb, driverLUT=None):
     """
     Optical Mach-Zehnder Modulator (MZM).
 
@@ -27,11 +28,16 @@ def mzm(Ai, u, Vπ, Vb):
     Ai : scalar or np.array
         Amplitude of the optical field at the input of the MZM.
     u : np.array
-        Electrical driving signal.
+        Electrical driving signal. A (N, Nch) array modulates a batch of
+        Nch channels at once.
     Vπ : scalar
         MZM's Vπ voltage.
-    Vb : scalar
-        MZM's bias voltage.
+    Vb : scalar or np.array
+        MZM's bias voltage (a time-varying array models bias drift).
+    driverLUT : tuple of np.arrays, optional
+        Lookup table (uIn, vOut) of the driver transfer function, linearly
+        interpolated to model an arbitrary driver nonlinearity. The
+        default is None (linear driver).
 
     Returns
     -------
@@ -39,26 +45,28 @@ def mzm(Ai, u, Vπ, Vb):
         Modulated optical field at the output of the MZM.
 
     """
-    try:
-        u.shape
-    except AttributeError:
-        u = np.array([u])
+    u = np.asarray(u)
+    if u.ndim == 0:
+        u = u.reshape(1)
 
-    try:
-        if Ai.shape == () and u.shape != ():
-            Ai = Ai * np.ones(u.shape)
-        else:
-            assert (
-                Ai.shape == u.shape
-            ), "Ai and u need to have the same dimensions"
-    except AttributeError:
-        Ai = Ai * np.ones(u.shape)
+    Ai = alignTimeAxis(Ai, u)
+    Vb = alignTimeAxis(Vb, u)
+
+    v = u if driverLUT is None else np.interp(u, driverLUT[0], driverLUT[1])
+
+    # phase of the MZM transfer function (single temporary array)
+    Ao = np.add(v, Vb, dtype=float)
+    Ao *= 0.5 * np.pi / Vπ
+    np.cos(Ao, out=Ao)
+
+    if np.ndim(Ai) == 0 and np.isrealobj(Ai):
+        Ao *= Ai
+        return Ao
 
-    π = np.pi
-    return Ai * np.cos(0.5 / Vπ * (u + Vb) * π)
+    return Ai * Ao
 
 
-def iqm(Ai, u, Vπ, VbI, VbQ):
+def iqm(Ai, u, Vπ, VbI, VbQ, driverLUT=None):
     """
     Optical In-Phase/Quadrature Modulator (IQM).
 
@@ -67,13 +75,17 @@ def iqm(Ai, u, Vπ, VbI, VbQ):
     Ai : scalar or np.array
         Amplitude of the optical field at the input of the IQM.
     u : complex-valued np.array
-        Modulator's driving signal (complex-valued baseband).
+        Modulator's driving signal (complex-valued baseband). A (N, Nch)
+        array modulates a batch of Nch channels at once.
     Vπ : scalar
         MZM Vπ-voltage.
-    VbI : scalar
-        I-MZM's bias voltage.
-    VbQ : scalar
-        Q-MZM's bias voltage.
+    VbI : scalar or np.array
+        I-MZM's bias voltage (a time-varying array models bias drift).
+    VbQ : scalar or np.array
+        Q-MZM's bias voltage (a time-varying array models bias drift).
+    driverLUT : tuple of np.arrays, optional
+        Lookup table (uIn, vOut) of the driver transfer function (see mzm).
+        The default is None (linear driver).
 
     Returns
     -------
@@ -81,24 +93,58 @@ def iqm(Ai, u, Vπ, VbI, VbQ):
         Modulated optical field at the output of the IQM.
 
     """
-    try:
-        u.shape
-    except AttributeError:
-        u = np.array([u])
+    u = np.asarray(u)
+    if u.ndim == 0:
+        u = u.reshape(1)
+
+    Ai = alignTimeAxis(Ai, u)
+    VbI = alignTimeAxis(VbI, u)
+    VbQ = alignTimeAxis(VbQ, u)
+
+    # both MZMs are evaluated in place on the real/imag parts of the output
+    Ao = np.empty(u.shape, dtype=complex)
+    for Aq, uq, Vbq in [(Ao.real, u.real, VbI), (Ao.imag, np.imag(u), VbQ)]:
+        if driverLUT is None:
+            np.add(uq, Vbq, out=Aq)
+        else:
+            Aq[:] = np.interp(uq, driverLUT[0], driverLUT[1])
+            Aq += Vbq
+        Aq *= 0.5 * np.pi / Vπ
+        np.cos(Aq, out=Aq)
+
+    Ao *= Ai / np.sqrt(2)
+
+    return Ao
+
+
+def alignTimeAxis(x, u):
+    """
+    Align a 1D per-sample array with the time axis of a batch of signals.
+
+    Parameters
+    ----------
+    x : scalar or np.array
+        Parameter (e.g. input field or bias voltage).
+    u : np.array
+        Signal of shape (N,) or (N, Nch).
+
+    Returns
+    -------
+    x : scalar or np.array
+        x reshaped to (N, 1) if it has length N and u is a batch,
+        otherwise x itself.
+
+    """
+    if np.ndim(x) == 1 and u.ndim == 2 and len(x) == u.shape[0]:
+        return np.reshape(x, (-1, 1))
 
     try:
-        if Ai.shape == () and u.shape != ():
-            Ai = Ai * np.ones(u.shape)
-        else:
-            assert (
-                Ai.shape == u.shape
-            ), "Ai and u need to have the same dimensions"
-    except AttributeError:
-        Ai = Ai * np.ones(u.shape)
-
-    return mzm(Ai / np.sqrt(2), u.real, Vπ, VbI) + 1j * mzm(
-        Ai / np.sqrt(2), u.imag, Vπ, VbQ
-    )
+        shape = np.broadcast_shapes(np.shape(x), u.shape)
+    except ValueError:
+        shape = None
+    assert shape == u.shape, "x and u need to have the same dimensions"
+
+    return x
 
 
 def pbs(E, θ=0):
@@ -198,7 +244,7 @@ def photodiode(E, paramPD=None):
     Parameters
     ----------
     E : np.array
-        Input optical field.
+        Input optical field (N,) or stacked fields of Nch channels (N, Nch).
     paramPD : parameter object (struct), optional
         Parameters of the photodiode.
 
@@ -211,6 +257,7 @@ def photodiode(E, paramPD=None):
     paramPD.fType: frequency response type [default: 'rect']
     paramPD.N: number of the frequency resp. filter taps. [default: 8001]
     paramPD.ideal: ideal PD?(i.e. no noise, no frequency resp.) [default: True]
+    paramPD.seed: seed (int) or np.random.Generator of the noise [default: None]
 
     Returns
     -------
@@ -220,49 +267,19 @@ def photodiode(E, paramPD=None):
     """
     if paramPD is None:
         paramPD = []
-    kB = const.value("Boltzmann constant")
-    q = const.value("elementary charge")
 
-    # check input parameters
     R = getattr(paramPD, "R", 1)
-    Tc = getattr(paramPD, "Tc", 25)
-    Id = getattr(paramPD, "Id", 5e-9)
-    RL = getattr(paramPD, "RL", 50)
-    B = getattr(paramPD, "B", 30e9)
-    Fs = getattr(paramPD, "Fs", 60e9)
-    N = getattr(paramPD, "N", 8000)
-    fType = getattr(paramPD, "fType", "rect")
     ideal = getattr(paramPD, "ideal", True)
 
     assert R > 0, "PD responsivity should be a positive scalar"
-    assert (
-        Fs >= 2 * B
-    ), "Sampling frequency Fs needs to be at least twice of B."
 
-    ipd = R * E * np.conj(E)  # ideal fotodetected current
+    ipd = R * np.abs(E) ** 2  # ideal fotodetected current
 
     if not (ideal):
+        σ2 = pdNoiseVar(np.mean(np.abs(E) ** 2, axis=0), paramPD)
+        ipd = pdNoise(ipd, σ2, paramPD)
 
-        Pin = (np.abs(E) ** 2).mean()
-
-        # shot noise
-        σ2_s = 2 * q * (R * Pin + Id) * B  # shot noise variance
-
-        # thermal noise
-        T = Tc + 273.15  # temperature in Kelvin
-        σ2_T = 4 * kB * T * B / RL  # thermal noise variance
-
-        # add noise sources to the p-i-n receiver
-        Is = normal(0, np.sqrt(Fs * (σ2_s / (2 * B))), ipd.size)
-        It = normal(0, np.sqrt(Fs * (σ2_T / (2 * B))), ipd.size)
-
-        ipd += Is + It
-
-        # lowpass filtering
-        h = lowPassFIR(B, Fs, N, typeF=fType)
-        ipd = firFilter(h, ipd)
-
-    return ipd.real
+    return ipd
 
 
 def balancedPD(E1, E2, paramPD=None):
@@ -287,6 +304,7 @@ def balancedPD(E1, E2, paramPD=None):
     paramPD.fType: frequency response type [default: 'rect']
     paramPD.N: number of the frequency resp. filter taps. [default: 8001]
     paramPD.ideal: ideal PD?(i.e. no noise, no frequency resp.) [default: True]
+    paramPD.seed: seed (int) or np.random.Generator of the noise [default: None]
 
     Returns
     -------
@@ -298,9 +316,100 @@ def balancedPD(E1, E2, paramPD=None):
         paramPD = []
     assert E1.shape == E2.shape, "E1 and E2 need to have the same shape"
 
-    i1 = photodiode(E1, paramPD)
-    i2 = photodiode(E2, paramPD)
-    return i1 - i2
+    R = getattr(paramPD, "R", 1)
+    ideal = getattr(paramPD, "ideal", True)
+
+    assert R > 0, "PD responsivity should be a positive scalar"
+
+    ibpd = R * (np.abs(E1) ** 2 - np.abs(E2) ** 2)
+
+    if not (ideal):
+        # independent noise of both PDs, filtered once (linear response)
+        σ2 = pdNoiseVar(np.mean(np.abs(E1) ** 2, axis=0), paramPD)
+        σ2 += pdNoiseVar(np.mean(np.abs(E2) ** 2, axis=0), paramPD)
+        ibpd = pdNoise(ibpd, σ2, paramPD)
+
+    return ibpd
+
+
+def pdNoiseVar(Pin, paramPD):
+    """
+    Variance of the shot and thermal noise samples of a photodiode.
+
+    Parameters
+    ----------
+    Pin : scalar or np.array
+        Average optical power at the photodiode (one value per channel).
+    paramPD : parameter object (struct)
+        Parameters of the photodiode (see photodiode).
+
+    Returns
+    -------
+    σ2 : scalar or np.array
+        Noise variance per sample (at the sampling rate Fs).
+
+    """
+    kB = const.value("Boltzmann constant")
+    q = const.value("elementary charge")
+
+    R = getattr(paramPD, "R", 1)
+    Tc = getattr(paramPD, "Tc", 25)
+    Id = getattr(paramPD, "Id", 5e-9)
+    RL = getattr(paramPD, "RL", 50)
+    B = getattr(paramPD, "B", 30e9)
+    Fs = getattr(paramPD, "Fs", 60e9)
+
+    # shot noise
+    σ2_s = 2 * q * (R * Pin + Id) * B  # shot noise variance
+
+    # thermal noise
+    T = Tc + 273.15  # temperature in Kelvin
+    σ2_T = 4 * kB * T * B / RL  # thermal noise variance
+
+    return Fs * (σ2_s + σ2_T) / (2 * B)
+
+
+def pdNoise(ipd, σ2, paramPD, rng=None):
+    """
+    Add photodiode noise and apply the photodiode frequency response.
+
+    Parameters
+    ----------
+    ipd : np.array
+        Noiseless photocurrent (N,) or (N, Nch).
+    σ2 : scalar or np.array
+        Noise variance per sample (one value per channel).
+    paramPD : parameter object (struct)
+        Parameters of the photodiode (see photodiode).
+    rng : np.random.Generator, optional
+        Noise generator. The default is None, which creates it from
+        paramPD.seed (a Generator passed in paramPD.seed is used as is, so
+        that successive calls draw independent noise).
+
+    Returns
+    -------
+    ipd : np.array
+        Noisy and filtered photocurrent.
+
+    """
+    B = getattr(paramPD, "B", 30e9)
+    Fs = getattr(paramPD, "Fs", 60e9)
+    N = getattr(paramPD, "N", 8000)
+    fType = getattr(paramPD, "fType", "rect")
+
+    assert (
+        Fs >= 2 * B
+    ), "Sampling frequency Fs needs to be at least twice of B."
+
+    if rng is None:
+        rng = np.random.default_rng(getattr(paramPD, "seed", None))
+
+    # shot and thermal noise in a single float32 draw
+    noise = rng.standard_normal(ipd.shape, dtype=np.float32)
+    noise *= np.sqrt(σ2).astype(np.float32)
+
+    # lowpass filtering
+    return pdFilter(ipd + noise, B, Fs, N, fType)
 
 
 def hybrid_2x4_90deg(Es, Elo):
@@ -350,7 +459,8 @@ def coherentReceiver(Es, Elo, paramPD=None):
     Elo : np.array
         Input LO optical field.
     paramPD : parameter object (struct), optional
-        Parameters of the photodiodes.
+        Parameters of the photodiodes (see balancedPD). The noise of the I
+        and Q branches is drawn at once from a single generator.
 
     Returns
     -------
@@ -364,20 +474,37 @@ def coherentReceiver(Es, Elo, paramPD=None):
     assert Elo.shape == (len(Elo),), "Elo need to have a (N,) shape"
     assert Es.shape == Elo.shape, "Es and Elo need to have the same (N,) shape"
 
+    R = getattr(paramPD, "R", 1)
+    ideal = getattr(paramPD, "ideal", True)
+
+    assert R > 0, "PD responsivity should be a positive scalar"
+
     # optical 2 x 4 90° hybrid
     Eo = hybrid_2x4_90deg(Es, Elo)
+    P = np.abs(Eo) ** 2
 
-    # balanced photodetection
-    sI = balancedPD(Eo[1, :], Eo[0, :], paramPD)
-    sQ = balancedPD(Eo[2, :], Eo[3, :], paramPD)
+    # balanced photodetection of the I and Q branches
+    S = R * np.stack((P[1, :] - P[0, :], P[2, :] - P[3, :]), axis=1)
+
+    if not (ideal):
+        # independent noise of the four PDs, drawn at once for both branches
+        σ2 = pdNoiseVar(np.mean(P, axis=1), paramPD)  # (4,)
+        σ2 = np.array([σ2[1] + σ2[0], σ2[2] + σ2[3]])
+        S = pdNoise(S, σ2, paramPD)
 
-    return sI + 1j * sQ
+    return S[:, 0] + 1j * S[:, 1]
 
 
 def pdmCoherentReceiver(Es, Elo, θsig=0, paramPD=None):
     """
     Polarization multiplexed coherent optical front-end.
 
+    Fused implementation: the outputs of the two 2 x 4 90° hybrids and the
+    eight photocurrents are evaluated in closed form (each balanced pair
+    detects R*Es*conj(Elo)), the noise of the eight photodiodes is drawn
+    at once from a shared generator, and the photodiode frequency response
+    is applied once to both polarizations in the frequency domain.
+
     Parameters
     ----------
     Es : np.array
@@ -387,7 +514,10 @@ def pdmCoherentReceiver(Es, Elo, θsig=0, paramPD=None):
     θsig : scalar, optional
         Input polarization rotation angle in rad. The default is 0.
     paramPD : parameter object (struct), optional
-        Parameters of the photodiodes.
+        Parameters of the photodiodes (see photodiode).
+
+        paramPD.seed: seed (int) or np.random.Generator of the noise
+        [default: None]
 
     Returns
     -------
@@ -399,13 +529,136 @@ def pdmCoherentReceiver(Es, Elo, θsig=0, paramPD=None):
         paramPD = []
     assert len(Es) == len(Elo), "Es and Elo need to have the same length"
 
-    Elox, Eloy = pbs(Elo, θ=np.pi / 4)  # split LO into two orth. polarizations
-    Esx, Esy = pbs(Es, θ=θsig)  # split signal into two orth. polarizations
+    R = getattr(paramPD, "R", 1)
+    ideal = getattr(paramPD, "ideal", True)
+
+    assert R > 0, "PD responsivity should be a positive scalar"
 
-    Sx = coherentReceiver(Esx, Elox, paramPD)  # coherent detection of pol.X
-    Sy = coherentReceiver(Esy, Eloy, paramPD)  # coherent detection of pol.Y
+    # polarization beam splitters (closed-form rotations)
+    Esig = pbsRotation(Es, θsig)  # (N, 2): signal pol. X and pol. Y
+    Eref = pbsRotation(Elo, np.pi / 4)  # (N, 2): LO pol. X and pol. Y
+
+    # balanced photocurrents of the hybrids: sI + 1j*sQ = R*Es*conj(Elo)
+    S = R * Esig * np.conj(Eref)
+
+    if not (ideal):
+        # mean optical power at each of the eight photodiodes:
+        # (|Es|^2 + |Elo|^2 ± 2Re{Es*conj(Elo)} or ± 2Im{Es*conj(Elo)})/4
+        Ps = np.mean(np.abs(Esig) ** 2, axis=0)
+        Plo = np.mean(np.abs(Eref) ** 2, axis=0)
+        X = np.mean(S, axis=0) / R
+        Ppd = np.array(
+            [
+                [Ps + Plo + 2 * X.real, Ps + Plo - 2 * X.real],
+                [Ps + Plo + 2 * X.imag, Ps + Plo - 2 * X.imag],
+            ]
+        ) / 4  # (I/Q, PD pair, pol.)
 
-    return np.array([Sx, Sy]).T
+        # shot and thermal noise variances (summed over each balanced pair)
+        σ2 = np.sum(pdNoiseVar(Ppd, paramPD), axis=1)  # (I/Q, pol.)
+
+        # noise of all photodiodes and shared frequency response
+        S = pdNoise(np.stack((S.real, S.imag), axis=1), σ2, paramPD)
+        S = S[:, 0, :] + 1j * S[:, 1, :]
+
+    return S
+
+
+def pbsRotation(E, θ):
+    """
+    Closed-form polarization rotation (as in pbs).
+
+    Parameters
+    ----------
+    E : (N,2) or (N,) np.array
+        Input optical field (a (N,) field is on pol. X).
+    θ : scalar
+        Rotation angle in radians.
+
+    Returns
+    -------
+    Eo : (N,2) np.array
+        Rotated field (pol. X and pol. Y on the columns).
+
+    """
+    c, s = np.cos(θ), np.sin(θ)
+    Eo = np.empty((len(E), 2), dtype=complex)
+
+    if E.ndim == 1:
+        np.multiply(E, c, out=Eo[:, 0])
+        np.multiply(E, -s, out=Eo[:, 1])
+    else:
+        Eo[:, 0] = c * E[:, 0] + s * E[:, 1]
+        Eo[:, 1] = c * E[:, 1] - s * E[:, 0]
+
+    return Eo
+
+
+@lru_cache(maxsize=32)
+def pdResponse(B, Fs, N, fType, Nfft):
+    """
+    Frequency response of the photodiode lowpass filter (cached).
+
+    Parameters
+    ----------
+    B : scalar
+        Bandwidth [Hz].
+    Fs : scalar
+        Sampling frequency [Hz].
+    N : int
+        Number of taps of the FIR filter (see dsp.lowPassFIR).
+    fType : string
+        Frequency response type ('rect' or 'gauss').
+    Nfft : int
+        FFT size.
+
+    Returns
+    -------
+    H : np.array
+        Read-only FFT of the filter taps (Nfft points).
+
+    """
+    H = fft(lowPassFIR(B, Fs, N, typeF=fType), Nfft)
+    H.flags.writeable = False
+
+    return H
+
+
+def pdFilter(x, B, Fs, N, fType="rect"):
+    """
+    Photodiode lowpass filtering in the frequency domain.
+
+    Equivalent to FIR filtering with lowPassFIR(B, Fs, N, fType) taps and
+    delay compensation (see dsp.firFilter), with a cached filter response.
+
+    Parameters
+    ----------
+    x : np.array
+        Input signal (N,) or stacked signals (N, ...), filtered on axis 0.
+    B : scalar
+        Bandwidth [Hz].
+    Fs : scalar
+        Sampling frequency [Hz].
+    N : int
+        Number of taps of the FIR filter.
+    fType : string, optional
+        Frequency response type ('rect' or 'gauss'). The default is 'rect'.
+
+    Returns
+    -------
+    y : np.array
+        Filtered signal.
+
+    """
+    Nfft = next_fast_len(len(x) + N - 1)
+    H = pdResponse(B, Fs, N, fType, Nfft)
+
+    H = H.reshape((-1,) + (1,) * (x.ndim - 1))
+
+    y = ifft(fft(x, Nfft, axis=0) * H, axis=0)
+    y = y[(N - 1) // 2 : (N - 1) // 2 + len(x)]
+
+    return y.real if np.isrealobj(x) else y
 
 
 def edfa(Ei, Fs, G=20, NF=4.5, Fc=193.1e12):
@@ -795,11 +1048,14 @@ def convergenceCondition(Ex_fd, Ey_fd, Ex_conv, Ey_conv):
     ) / np.sqrt(norm(Ex_conv) ** 2 + norm(Ey_conv) ** 2)
 
 
-@njit
-def phaseNoise(lw, Nsamples, Ts):
+def phaseNoise(lw, Nsamples, Ts, Kf=0, Nch=None, seed=None):
     """
     Generate realization of a random-walk phase-noise process.
 
+    The Lorentzian (Wiener) phase noise is generated with a single bulk
+    Gaussian draw and a (parallel) cumulative sum. If Kf > 0, a 1/f
+    (flicker) component is added to the frequency noise by spectral shaping.
+
     Parameters
     ----------
     lw : scalar
@@ -808,37 +1064,121 @@ def phaseNoise(lw, Nsamples, Ts):
         number of samples to be draw.
     Ts : scalar
         sampling period.
+    Kf : scalar, optional
+        flicker frequency-noise coefficient [Hz^2], i.e. the two-sided
+        frequency-noise PSD is lw/(2π) + Kf/|f|. The default is 0.
+    Nch : int, optional
+        number of independent realizations (e.g. one laser per channel).
+        The default is None (single realization).
+    seed : int or np.random.Generator, optional
+        seed or generator of the random numbers. The default is None.
 
     Returns
     -------
     phi : np.array
-        realization of the phase noise process.
+        realization of the phase noise process ((Nsamples,), or
+        (Nsamples, Nch) if Nch is given).
+
+    """
+    rng = np.random.default_rng(seed)
+    shape = (Nsamples, 1 if Nch is None else Nch)
+
+    if Kf == 0:
+        # phase increments (Wiener process)
+        σ2 = 2 * np.pi * lw * Ts
+        dphi = np.empty(shape)
+        dphi[0] = 0
+        dphi[1:] = rng.standard_normal((Nsamples - 1, shape[1]))
+        dphi[1:] *= np.sqrt(σ2)
+    else:
+        # frequency noise by spectral shaping of white Gaussian noise
+        f = np.fft.rfftfreq(Nsamples, Ts)
+        f[0] = f[1] if Nsamples > 1 else 1 / Ts  # avoid the 1/f pole at DC
+        Sv = lw / (2 * np.pi) + Kf / f  # two-sided PSD [Hz^2/Hz]
+
+        W = np.fft.rfft(rng.standard_normal(shape), axis=0)
+        v = np.fft.irfft(W * np.sqrt(Sv / Ts).reshape(-1, 1), Nsamples, axis=0)
+
+        # phase increments
+        dphi = np.empty(shape)
+        dphi[0] = 0
+        dphi[1:] = 2 * np.pi * Ts * v[:-1]
 
+    phi = np.empty(shape)
+    for ch in range(shape[1]):
+        phi[:, ch] = parallelCumsum(dphi[:, ch])
+
+    return phi[:, 0] if Nch is None else phi
+
+
+@njit(parallel=True)
+def parallelCumsum(x):
     """
-    σ2 = 2 * np.pi * lw * Ts
-    phi = np.zeros(Nsamples)
+    Blocked parallel prefix sum.
+
+    Parameters
+    ----------
+    x : np.array
+        Input sequence.
+
+    Returns
+    -------
+    y : np.array
+        Cumulative sum of x.
+
+    """
+    N = len(x)
+    nBlocks = min(numba.get_num_threads(), max(N // 4096, 1))
+    edges = np.linspace(0, N, nBlocks + 1).astype(np.int64)
+    y = np.empty_like(x)
+
+    # local prefix sums
+    for b in prange(nBlocks):
+        acc = 0.0
+        for n in range(edges[b], edges[b + 1]):
+            acc += x[n]
+            y[n] = acc
+
+    # block offsets
+    offsets = np.zeros(nBlocks)
+    for b in range(1, nBlocks):
+        offsets[b] = offsets[b - 1] + y[edges[b] - 1]
 
-    for ind in range(Nsamples - 1):
-        phi[ind + 1] = phi[ind] + normal(0, np.sqrt(σ2))
+    for b in prange(1, nBlocks):
+        for n in range(edges[b], edges[b + 1]):
+            y[n] += offsets[b]
 
-    return phi
+    return y
 
 
-@njit
-def awgn(sig, snr, Fs=1, B=1):
+def awgn(sig, snr, Fs=1, B=1, seed=None, out=None, blockSize=2**16):
     """
     Implement an AWGN channel.
 
+    The complex noise is drawn in fixed-size blocks, each one with its own
+    random stream (spawned from a single seed), on a pool of threads. The
+    noise of each block is scaled and added to the signal in a single pass.
+    Results depend only on the seed (and blockSize), not on the number of
+    threads.
+
     Parameters
     ----------
     sig : np.array
         Input signal.
-    snr : scalar
-        Signal-to-noise ratio in dB.
+    snr : scalar or np.array
+        Signal-to-noise ratio in dB. A vector of Nsnr values returns a batch
+        with one noisy copy of sig per SNR value.
     Fs : real scalar
         Sampling frequency. The default is 1.
     B : real scalar
         Signal bandwidth. The default is 1.
+    seed : int, np.random.SeedSequence or np.random.Generator, optional
+        Seed of the noise streams. The default is None.
+    out : np.array, optional
+        Complex output array (sig.shape, or (Nsnr,) + sig.shape), which may
+        be sig itself. The default is None.
+    blockSize : int, optional
+        Number of samples per random stream. The default is 2**16.
 
     Returns
     -------
@@ -846,10 +1186,121 @@ def awgn(sig, snr, Fs=1, B=1):
         Input signal plus noise.
 
     """
+    snr_lin = 10 ** (np.asarray(snr, dtype=float) / 10)
+    noiseVar = (Fs / B) * signal_power(sig) / snr_lin
+    σ = np.sqrt(noiseVar / 2).reshape(-1)  # per real dimension
+
+    shape = sig.shape if snr_lin.ndim == 0 else snr_lin.shape + sig.shape
+    if out is None:
+        out = np.empty(shape, dtype=complex)
+    assert out.shape == shape, f"out needs to have a {shape} shape"
+    assert np.iscomplexobj(out), "out needs to be complex-valued"
+    assert out.flags.c_contiguous, "out needs to be C-contiguous"
+
+    x = sig.reshape(-1)
+    y = out.reshape(len(σ), -1)
+    N = x.size
+
+    # one random stream per block of samples
+    if isinstance(seed, np.random.Generator):
+        seed = seed.integers(2**63)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    nBlocks = -(-N // blockSize)
+    seeds = seed.spawn(len(σ) * nBlocks)
+
+    def addNoise(task):
+        k, b = divmod(task, nBlocks)
+        blk = slice(b * blockSize, min((b + 1) * blockSize, N))
+        rng = np.random.default_rng(seeds[task])
+        noise = rng.standard_normal(2 * (blk.stop - blk.start)).view(complex)
+        noise *= σ[k]
+        np.add(x[blk], noise, out=y[k, blk])
+
+    nTasks = len(σ) * nBlocks
+    if nTasks > 1:
+        with ThreadPoolExecutor(min(nTasks, os.cpu_count())) as pool:
+            list(pool.map(addNoise, range(nTasks)))
+    else:
+        addNoise(0)
+
+    return out
+
+
+def awgnIS(sig, snr, constSymb, Fs=1, B=1, bias=1):
+    """
+    Implement an AWGN channel with importance sampling (IS).
+
+    The noise distribution is biased toward the decision boundaries: each
+    noise sample is drawn from a Gaussian whose mean is translated towards
+    the midpoint between the transmitted symbol and one of its nearest
+    neighbours (chosen at random). The returned weights p(n)/q(n) undo the
+    bias, such that weighted error counts are unbiased estimates of the
+    error probabilities of the original AWGN channel.
+
+    Parameters
+    ----------
+    sig : np.array
+        Input signal (noiseless constellation symbols).
+    snr : scalar
+        Signal-to-noise ratio in dB.
+    constSymb : np.array
+        Reference constellation, in the same scale as sig.
+    Fs : real scalar
+        Sampling frequency. The default is 1.
+    B : real scalar
+        Signal bandwidth. The default is 1.
+    bias : real scalar, optional
+        Mean translation normalized to the distance to the decision
+        boundary. The default is 1.
+
+    Returns
+    -------
+    sigRx : np.array
+        Input signal plus biased noise.
+    w : np.array
+        Importance sampling weights of each noise sample.
+
+    """
+    constSymb = constSymb.reshape(-1)
     snr_lin = 10 ** (snr / 10)
-    noiseVar = signal_power(sig) / snr_lin
-    σ = np.sqrt((Fs / B) * noiseVar)
-    noise = normal(0, σ, sig.shape) + 1j * normal(0, σ, sig.shape)
-    noise = 1 / np.sqrt(2) * noise
+    noiseVar = (Fs / B) * signal_power(sig) / snr_lin
+
+    # nearest neighbours of each constellation symbol
+    dist = np.abs(constSymb.reshape(-1, 1) - constSymb.reshape(1, -1))
+    np.fill_diagonal(dist, np.inf)
+    dmin = np.min(dist)
+    isNeighbor = dist <= dmin * (1 + 1e-6)
+    nNeighbors = np.sum(isNeighbor, axis=1)
+
+    # mean translations: towards the boundaries with each neighbour
+    μ = bias * (constSymb.reshape(1, -1) - constSymb.reshape(-1, 1)) / 2
+    μ[~isNeighbor] = 0
+
+    # pick one boundary per transmitted symbol
+    indSymb = minEuclid(sig.reshape(-1), constSymb)
+    choice = np.floor(
+        np.random.rand(indSymb.size) * nNeighbors[indSymb]
+    ).astype(np.int64)
+    indNeighbor = np.argsort(~isNeighbor, axis=1, kind="stable")
+    μSymb = μ[indSymb, indNeighbor[indSymb, choice]]
+
+    noise = normal(0, np.sqrt(noiseVar / 2), indSymb.shape) + 1j * normal(
+        0, np.sqrt(noiseVar / 2), indSymb.shape
+    )
+    noise += μSymb
+
+    # likelihood ratio p(n)/q(n), with q the mixture of translated Gaussians
+    μn = μ[indSymb, :]
+    logLR = (
+        2 * (noise.reshape(-1, 1) * np.conj(μn)).real - np.abs(μn) ** 2
+    ) / noiseVar
+    logLR[~isNeighbor[indSymb, :]] = -np.inf
+    logLRmax = np.max(logLR, axis=1)
+    w = (
+        nNeighbors[indSymb]
+        * np.exp(-logLRmax)
+        / np.sum(np.exp(logLR - logLRmax.reshape(-1, 1)), axis=1)
+    )
 
-    return sig + noise
+    return sig + noise.reshape(sig.shape), w.reshape(sig.shape)
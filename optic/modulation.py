@@ -1,10 +1,12 @@
 """Digital modulation utilities."""
 import logging as logg
+from functools import lru_cache
 
 import numpy as np
-from commpy.utilities import bitarray2dec, dec2bitarray
 from numba import njit, prange
 
+from optic.core import parameters
+
 
 def GrayCode(n):
     """
@@ -57,14 +59,75 @@ def GrayMapping(M, constType):
         logg.warn("OOK has only 2 symbols, but M != 2. Changing M to 2.")
         M = 2
 
+    return getConstellation(M, constType).symb.copy()
+
+
+def getConstellation(M, constType):
+    """
+    Get the cached Gray-mapped constellation and its bit mapping.
+
+    Constellations are built once per (M, constType) and stored in a
+    registry. All arrays of the returned object are read-only and shared
+    by every caller.
+
+    Parameters
+    ----------
+    M : int
+        modulation order
+    constType : 'qam', 'psk', 'pam' or 'ook'.
+        type of constellation.
+
+    Returns
+    -------
+    const : parameters object (struct)
+        const.symb: constellation symbols (sorted according their
+        corresponding Gray bit sequence as integer decimal).
+        const.bitMap: (M, log2(M)) bit-to-symbol mapping.
+        const.Es: average symbol energy.
+        const.bitInd: (log2(M), 2, M/2) indexes of the symbols with bit n
+        equal to 0 (bitInd[n, 0]) and to 1 (bitInd[n, 1]).
+        const.thresholds: decision thresholds (per-axis amplitude levels
+        for 'pam', 'ook' and 'qam', phases for 'psk').
+        const.levels: per-axis amplitude levels ('pam', 'ook' and 'qam')
+        or symbol phases ('psk').
+        const.indLUT: look-up table that maps the indexes of the sliced
+        levels (I and Q for 'qam') to the symbol indexes.
+
+    """
+    if M != 2 and constType == "ook":
+        M = 2
+    return _buildConstellation(int(M), constType)
+
+
+def precomputeConstellations(constList):
+    """
+    Warm-up the constellation registry.
+
+    Parameters
+    ----------
+    constList : list of tuples
+        list of (M, constType) pairs to be built in advance.
+
+    Returns
+    -------
+    None.
+
+    """
+    for M, constType in constList:
+        getConstellation(M, constType)
+
+
+@lru_cache(maxsize=None)
+def _buildConstellation(M, constType):
     L = int(M - 1) if constType in ["pam", "ook"] else int(np.sqrt(M) - 1)
     bitsSymb = int(np.log2(M))
 
-    code = GrayCode(bitsSymb)
     if constType == "ook":
         const = np.arange(0, 2)
+        thresholds = np.array([0.5])
     elif constType == "pam":
         const = np.arange(-L, L + 1, 2)
+        thresholds = np.arange(-L + 1, L, 2)
     elif constType == "qam":
         PAM = np.arange(-L, L + 1, 2)
         PAM = np.array([PAM])
@@ -75,26 +138,74 @@ def GrayMapping(M, constType):
 
         for ind in np.arange(1, L + 1, 2):
             const[ind] = np.flip(const[ind], 0)
+        thresholds = np.arange(-L + 1, L, 2)
     elif constType == "psk":
         pskPhases = np.arange(0, 2 * np.pi, 2 * np.pi / M)
 
         # generate complex M-PSK constellation
         const = np.exp(1j * pskPhases)
-    const = const.reshape(M, 1)
-    const_ = np.zeros((M, 2), dtype=complex)
-
-    for ind in range(M):
-        const_[ind, 0] = const[ind, 0]  # complex constellation symbol
-        const_[ind, 1] = int(
-            code[ind], 2
-        )  # mapped bit sequence (as integer decimal)
-    # sort complex symbols column according to their mapped bit sequence (as integer decimal)
-    const = const_[const_[:, 1].real.argsort()]
-    const = const[:, 0]
+        thresholds = pskPhases + np.pi / M
+    else:
+        raise ValueError("constType should be 'qam', 'psk', 'pam' or 'ook'.")
+    const = const.reshape(-1)
+
+    # sort symbols according to their mapped bit sequence (as integer decimal)
+    ind = np.arange(M)
+    symb = np.zeros(M, dtype=complex)
+    symb[ind ^ (ind >> 1)] = const
 
     if constType in ["pam", "ook"]:
-        const = const.real
-    return const
+        symb = symb.real
+
+    # bit-to-symbol mapping
+    bitMap = (ind.reshape(-1, 1) >> np.arange(bitsSymb - 1, -1, -1)) & 1
+    bitInd = np.array(
+        [[ind[bitMap[:, n] == 0], ind[bitMap[:, n] == 1]] for n in range(bitsSymb)]
+    )
+
+    # per-axis amplitude levels (phases for 'psk') and the look-up table
+    # that maps the sliced level indexes to the symbol indexes
+    if constType == "psk":
+        levels = pskPhases
+        indLUT = np.zeros(M, dtype=np.int64)
+        indLUT[ind] = ind ^ (ind >> 1)
+    else:
+        if constType == "ook":
+            levels = np.arange(0, 2)
+        else:
+            levels = np.arange(-L, L + 1, 2)
+        step = levels[1] - levels[0]
+        iI = np.rint((symb.real - levels[0]) / step).astype(np.int64)
+        if constType == "qam":
+            iQ = np.rint((symb.imag - levels[0]) / step).astype(np.int64)
+            indLUT = np.zeros((L + 1, L + 1), dtype=np.int64)
+            indLUT[iI, iQ] = ind
+        else:
+            indLUT = np.zeros(L + 1, dtype=np.int64)
+            indLUT[iI] = ind
+
+    constData = parameters()
+    constData.M = M
+    constData.constType = constType
+    constData.symb = symb
+    constData.bitMap = bitMap
+    constData.Es = np.mean(np.abs(symb) ** 2)
+    constData.bitInd = bitInd
+    constData.thresholds = thresholds.astype(np.float64)
+    constData.levels = levels.astype(np.float64)
+    constData.indLUT = indLUT
+
+    for arr in (
+        symb,
+        bitMap,
+        bitInd,
+        indLUT,
+        constData.thresholds,
+        constData.levels,
+    ):
+        arr.flags.writeable = False
+
+    return constData
 
 
 @njit(parallel=True)
@@ -124,6 +235,146 @@ def minEuclid(symb, const):
     return ind
 
 
+@njit(parallel=True)
+def slicePAM(symb, level0, step, indLUT):
+    """
+    Threshold-based hard decision for uniformly spaced PAM levels.
+
+    Parameters
+    ----------
+    symb : np.array of floats
+        Received symbols (real part).
+    level0 : scalar
+        Lowest amplitude level.
+    step : scalar
+        Spacing between amplitude levels.
+    indLUT : np.array of ints
+        Level index to symbol index look-up table.
+
+    Returns
+    -------
+    array of int
+        indexes of the decided constellation symbols.
+
+    """
+    L = len(indLUT) - 1
+    ind = np.zeros(symb.shape, dtype=np.int64)
+    for ii in prange(len(symb)):
+        k = int(np.floor((symb[ii] - level0) / step + 0.5))
+        k = min(max(k, 0), L)
+        ind[ii] = indLUT[k]
+    return ind
+
+
+@njit(parallel=True)
+def sliceQAM(symb, level0, step, indLUT):
+    """
+    Threshold-based hard decision for square QAM (I and Q sliced independently).
+
+    Parameters
+    ----------
+    symb : np.array
+        Received symbols.
+    level0 : scalar
+        Lowest amplitude level of each axis.
+    step : scalar
+        Spacing between amplitude levels.
+    indLUT : 2D np.array of ints
+        (I level, Q level) to symbol index look-up table.
+
+    Returns
+    -------
+    array of int
+        indexes of the decided constellation symbols.
+
+    """
+    L = indLUT.shape[0] - 1
+    ind = np.zeros(symb.shape, dtype=np.int64)
+    for ii in prange(len(symb)):
+        kI = int(np.floor((symb[ii].real - level0) / step + 0.5))
+        kQ = int(np.floor((symb[ii].imag - level0) / step + 0.5))
+        kI = min(max(kI, 0), L)
+        kQ = min(max(kQ, 0), L)
+        ind[ii] = indLUT[kI, kQ]
+    return ind
+
+
+@njit(parallel=True)
+def slicePSK(symb, indLUT):
+    """
+    Phase quantization hard decision for M-PSK.
+
+    Parameters
+    ----------
+    symb : np.array
+        Received symbols.
+    indLUT : np.array of ints
+        Phase index to symbol index look-up table.
+
+    Returns
+    -------
+    array of int
+        indexes of the decided constellation symbols.
+
+    """
+    M = len(indLUT)
+    step = 2 * np.pi / M
+    ind = np.zeros(symb.shape, dtype=np.int64)
+    for ii in prange(len(symb)):
+        θ = np.arctan2(symb[ii].imag, symb[ii].real)
+        k = int(np.floor(θ / step + 0.5)) % M
+        ind[ii] = indLUT[k]
+    return ind
+
+
+def hardDecision(symb, M, constType):
+    """
+    Closed-form hard decision (w/ Gray mapping).
+
+    Symbols are decided by slicing the I and Q components independently
+    ('qam', 'pam' and 'ook') or by quantizing their phases ('psk'), which
+    is equivalent to the minimum Euclidean distance decision at O(1) cost
+    per symbol. The input must be in the scale of GrayMapping(M, constType).
+
+    Parameters
+    ----------
+    symb : np.array
+        Received constellation symbols (any shape).
+    M : int
+        order of the modulation format.
+    constType : string
+        'qam', 'psk', 'pam' or 'ook'.
+
+    Returns
+    -------
+    array of int
+        indexes of the decided constellation symbols.
+
+    """
+    const = getConstellation(M, constType)
+    symb = np.asarray(symb)
+    shape = symb.shape
+    symb = symb.reshape(-1)
+
+    if constType == "psk":
+        ind = slicePSK(symb.astype(np.complex128), const.indLUT)
+    elif constType == "qam":
+        ind = sliceQAM(
+            symb.astype(np.complex128),
+            const.levels[0],
+            const.levels[1] - const.levels[0],
+            const.indLUT,
+        )
+    else:
+        ind = slicePAM(
+            np.ascontiguousarray(symb.real, dtype=np.float64),
+            const.levels[0],
+            const.levels[1] - const.levels[0],
+            const.indLUT,
+        )
+    return ind.reshape(shape)
+
+
 @njit(parallel=True)
 def demap(indSymb, bitMap):
     """
@@ -152,6 +403,73 @@ def demap(indSymb, bitMap):
     return decBits
 
 
+@njit(parallel=True)
+def packedToIndex(packedBits, bitsSymb, nSymb):
+    """
+    Read symbol indexes directly from a packed bit buffer.
+
+    Parameters
+    ----------
+    packedBits : np.array of uint8
+        Bit sequence packed with np.packbits (big-endian bit order).
+    bitsSymb : int
+        Number of bits per symbol.
+    nSymb : int
+        Number of symbols to be read.
+
+    Returns
+    -------
+    indSymb : np.array of ints
+        Symbol indexes (bits of each symbol read as integer decimal, MSB
+        first).
+
+    """
+    indSymb = np.zeros(nSymb, dtype=np.int64)
+
+    for i in prange(nSymb):
+        pos = i * bitsSymb
+        val = 0
+        for k in range(bitsSymb):
+            p = pos + k
+            val = (val << 1) | ((packedBits[p >> 3] >> (7 - (p & 7))) & 1)
+        indSymb[i] = val
+    return indSymb
+
+
+@njit(parallel=True)
+def indexToPacked(indSymb, bitsSymb):
+    """
+    Write symbol indexes to a packed bit buffer.
+
+    Parameters
+    ----------
+    indSymb : np.array of ints
+        Symbol indexes.
+    bitsSymb : int
+        Number of bits per symbol.
+
+    Returns
+    -------
+    packedBits : np.array of uint8
+        Bit sequence packed as in np.packbits (big-endian bit order).
+
+    """
+    nBits = len(indSymb) * bitsSymb
+    nBytes = (nBits + 7) // 8
+    packedBits = np.zeros(nBytes, dtype=np.uint8)
+
+    for j in prange(nBytes):
+        byte = 0
+        for t in range(8):
+            p = 8 * j + t
+            if p < nBits:
+                i = p // bitsSymb
+                k = p - i * bitsSymb
+                byte |= ((indSymb[i] >> (bitsSymb - 1 - k)) & 1) << (7 - t)
+        packedBits[j] = byte
+    return packedBits
+
+
 def modulateGray(bits, M, constType):
     """
     Modulate bit sequences to constellation symbol sequences (w/ Gray mapping).
@@ -175,19 +493,77 @@ def modulateGray(bits, M, constType):
         logg.warn("OOK has only 2 symbols, but M != 2. Changing M to 2.")
         M = 2
     bitsSymb = int(np.log2(M))
-    const = GrayMapping(M, constType)
+    const = getConstellation(M, constType).symb
 
-    symb = bits.reshape(-1, bitsSymb).T
-    symbInd = bitarray2dec(symb)
+    # bits of each symbol read as integer decimal (MSB first)
+    weights = 1 << np.arange(bitsSymb - 1, -1, -1)
+    symbInd = bits.reshape(-1, bitsSymb) @ weights
 
     return const[symbInd]
 
 
-def demodulateGray(symb, M, constType):
+def modulateGrayPacked(packedBits, M, constType, nBits=None):
+    """
+    Modulate packed bit sequences to constellation symbols (w/ Gray mapping).
+
+    Parameters
+    ----------
+    packedBits : np.array of uint8
+        sequence of data bits packed with np.packbits.
+    M : int
+        order of the modulation format.
+    constType : string
+        'qam', 'psk', 'pam' or 'ook'.
+    nBits : int, optional
+        number of valid bits in packedBits. The default is None (all bits).
+
+    Returns
+    -------
+    array of complex constellation symbols
+        bits modulated to complex constellation symbols.
+
+    """
+    if M != 2 and constType == "ook":
+        logg.warn("OOK has only 2 symbols, but M != 2. Changing M to 2.")
+        M = 2
+    bitsSymb = int(np.log2(M))
+
+    if nBits is None:
+        nBits = 8 * len(packedBits)
+
+    symbInd = packedToIndex(packedBits, bitsSymb, nBits // bitsSymb)
+
+    return getConstellation(M, constType).symb[symbInd]
+
+
+def mapSymbols(symbInd, M, constType):
+    """
+    Map symbol indexes to constellation symbols (w/ Gray mapping).
+
+    Parameters
+    ----------
+    symbInd : np.array of ints
+        symbol indexes (Gray bit sequences as integer decimal).
+    M : int
+        order of the modulation format.
+    constType : string
+        'qam', 'psk', 'pam' or 'ook'.
+
+    Returns
+    -------
+    array of complex constellation symbols
+        constellation symbols.
+
+    """
+    return getConstellation(M, constType).symb[symbInd]
+
+
+def demodulateGray(symb, M, constType, bitFormat="int"):
     """
     Demodulate symbol sequences to bit sequences (w/ Gray mapping).
 
-    Hard demodulation is based on minimum Euclidean distance.
+    Hard demodulation is based on minimum Euclidean distance, computed with
+    the closed-form slicers of hardDecision.
 
     Parameters
     ----------
@@ -197,6 +573,9 @@ def demodulateGray(symb, M, constType):
         order of the modulation format.
     constType : string
         'qam', 'psk', 'pam' or 'ook'.
+    bitFormat : string, optional
+        output format of the bits: 'int' (np.int64 array), 'uint8' (one
+        bit per byte) or 'packed' (np.packbits format). The default is 'int'.
 
     Returns
     -------
@@ -207,15 +586,14 @@ def demodulateGray(symb, M, constType):
     if M != 2 and constType == "ook":
         logg.warn("OOK has only 2 symbols, but M != 2. Changing M to 2.")
         M = 2
-    const = GrayMapping(M, constType)
-
-    # get bit to symbol mapping
-    indMap = minEuclid(const, const)
-    bitMap = dec2bitarray(indMap, int(np.log2(M)))
-    b = int(np.log2(M))
-    bitMap = bitMap.reshape(-1, b)
+    const = getConstellation(M, constType)
 
     # demodulate received symbol sequence
-    indrx = minEuclid(symb, const)
+    indrx = hardDecision(symb, M, constType)
+
+    if bitFormat == "packed":
+        return indexToPacked(indrx, int(np.log2(M)))
+    elif bitFormat == "uint8":
+        return const.bitMap.astype(np.uint8)[indrx].reshape(-1)
 
-    return demap(indrx, bitMap)
+    return demap(indrx, const.bitMap)
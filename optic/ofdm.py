@@ -1,7 +1,8 @@
 import numpy as np
 
-from scipy.fftpack     import fft, ifft
-from scipy.interpolate import interp1d
+from scipy.fft import fft, ifft
+
+from optic.core import parameters
 
 def hermit(V):
     """
@@ -9,20 +10,19 @@ def hermit(V):
     Parameters
     ----------
     V : complex-valued np.array
-        input array
+        input array (or 2-D array with one input vector per row)
         
     Returns
     -------
     Vh : complex-valued np.array
-         vector with hermitian simmetry
+         vector with hermitian simmetry (along the last axis)
     """
     
-    Vh = np.zeros(2*len(V) + 2, complex)
-    
-    Vh[1:len(V)+1] = V 
+    N  = V.shape[-1]
+    Vh = np.zeros(V.shape[:-1] + (2*N + 2,), complex)
     
-    for j in range(len(V)):
-        Vh[len(Vh) - j - 1] = np.conjugate(V[j])
+    Vh[..., 1:N+1] = V 
+    Vh[..., N+2:]  = np.conjugate(V[..., ::-1])
     
     return Vh
 
@@ -54,6 +54,53 @@ def calcSymbolRate(M, Rb, Nfft, Np, G, hermitSym):
     return Rb / (nDataSymbols/(Nfft + G) * np.log2(M))
 
 
+def dataCarriers(N, pilotCarriers):
+    """
+    Indexes of the data subcarriers (in ascending order).
+    Parameters
+    ----------
+    N             : scalar
+                    number of subcarriers
+    pilotCarriers : np.array
+                    indexes of pilot subcarriers
+    Returns
+    -------
+    dataCarriers  : np.array
+                    indexes of data subcarriers
+    """
+    
+    return np.setdiff1d(np.arange(0, N), pilotCarriers)
+
+
+def interpWeights(x, xi):
+    """
+    Linear interpolation (and extrapolation) weights.
+    Parameters
+    ----------
+    x   : np.array
+          sample positions (at least two)
+    xi  : np.array
+          interpolation positions
+    Returns
+    -------
+    ind : np.array
+          indexes (into x) of the left neighbor of each xi
+    w   : np.array
+          weights of the right neighbor of each xi, so that the interpolated
+          values of y are (1-w)*y[ind] + w*y[ind+1]
+    order : np.array
+          ascending sort of x (the indexes refer to x[order])
+    """
+    
+    order = np.argsort(x)
+    xs    = np.asarray(x, float)[order]
+    
+    ind = np.clip(np.searchsorted(xs, xi, side = 'right') - 1, 0, len(xs) - 2)
+    w   = (xi - xs[ind]) / (xs[ind + 1] - xs[ind])
+    
+    return ind, w, order
+
+
 def modulateOFDM(Nfft, G, pilot, pilotCarriers, symbTx, hermitSym):
     """
     OFDM symbols modulator.
@@ -85,28 +132,25 @@ def modulateOFDM(Nfft, G, pilot, pilotCarriers, symbTx, hermitSym):
     numSymb  = len(symbTx)
     numOFDMframes = numSymb//(N - Np)
 
-    Carriers = np.arange(0, N)
-    dataCarriers  = np.array(list(set(Carriers) - set(pilotCarriers)))
-
     symbTx_par = np.reshape(symbTx, (numOFDMframes, N - Np))
-    symbTx_OFDM_par = np.zeros( (numOFDMframes, Nfft + G), complex)
 
-    for indFrame in range(numOFDMframes):
-        # Pilot subcarriers inclusion
-        symbTx_OFDM_par[indFrame, G : G + N][dataCarriers]  = symbTx_par[indFrame, :]
-        symbTx_OFDM_par[indFrame, G : G + N][pilotCarriers] = pilot
+    # Pilot subcarriers inclusion (all frames at once)
+    carriers = np.zeros((numOFDMframes, N), complex)
+    carriers[:, dataCarriers(N, pilotCarriers)] = symbTx_par
+    carriers[:, pilotCarriers] = pilot
 
-        # Hermitian symmetry
-        if hermitSym:
-            symbTx_OFDM_par[indFrame, G : G + Nfft] = hermit(symbTx_OFDM_par[indFrame, G : G + N])
+    # Hermitian symmetry
+    if hermitSym:
+        carriers = hermit(carriers)
 
-        # IFFT operation
-        symbTx_OFDM_par[indFrame, G : G + Nfft] = ifft(symbTx_OFDM_par[indFrame, G : G + Nfft]) * np.sqrt(Nfft)
+    # IFFT operation (2-D array, one frame per row)
+    symbTx_OFDM_par = np.empty((numOFDMframes, Nfft + G), complex)
+    symbTx_OFDM_par[:, G:] = ifft(carriers, n = Nfft, axis = 1) * np.sqrt(Nfft)
 
-        # Cyclic prefix addition
-        symbTx_OFDM_par[indFrame, 0 : G] = symbTx_OFDM_par[indFrame, Nfft : Nfft + G].copy()
+    # Cyclic prefix addition
+    symbTx_OFDM_par[:, :G] = symbTx_OFDM_par[:, Nfft:]
 
-    return symbTx_OFDM_par.reshape(1,-1).reshape(-1,)
+    return symbTx_OFDM_par.reshape(-1)
 
 
 def demodulateOFDM(Nfft, G, pilot, pilotCarriers, symbRx_OFDM, hermitSym):
@@ -138,23 +182,15 @@ def demodulateOFDM(Nfft, G, pilot, pilotCarriers, symbRx_OFDM, hermitSym):
 
     # Number of subcarriers
     N = Nfft//2 - 1 if hermitSym else Nfft
-    Carriers      = np.arange(0, N)
-    dataCarriers  = np.array(list(set(Carriers) - set(pilotCarriers)))
-
-    H_abs = 0
-    H_pha = 0
+    Carriers = np.arange(0, N)
 
     numSymb       = len(symbRx_OFDM)
     numOFDMframes = numSymb//(Nfft + G)
 
-    symbRx_OFDM_par = np.reshape(symbRx_OFDM, (numOFDMframes, Nfft + G))
+    symbRx_OFDM_par = np.reshape(symbRx_OFDM[:numOFDMframes*(Nfft + G)], (numOFDMframes, Nfft + G))
 
-    # Cyclic prefix extraction
-    symbRx_OFDM_par = symbRx_OFDM_par[:, G : G + Nfft]
-
-    # FFT operation
-    for indFrame in range(numOFDMframes):
-        symbRx_OFDM_par[indFrame, :] = fft(symbRx_OFDM_par[indFrame,:]) / np.sqrt(Nfft)
+    # Cyclic prefix extraction (strided view) and FFT operation
+    symbRx_OFDM_par = fft(symbRx_OFDM_par[:, G : G + Nfft], axis = 1) / np.sqrt(Nfft)
 
     if hermitSym:
         # Removal of hermitian symmetry
@@ -162,21 +198,284 @@ def demodulateOFDM(Nfft, G, pilot, pilotCarriers, symbRx_OFDM, hermitSym):
 
     # Equalization
     if Np != 0:
-        # Channel estimation
-        for indFrame in range(numOFDMframes):
-            H_est = symbRx_OFDM_par[indFrame, :][pilotCarriers] / pilot
+        # Channel estimation (average of the per-frame estimates)
+        H_est = symbRx_OFDM_par[:, pilotCarriers] / pilot
 
-            H_abs += interp1d(pilotCarriers, np.abs(H_est), kind = 'linear', fill_value = "extrapolate")(Carriers)
-            H_pha += interp1d(pilotCarriers, np.angle(H_est), kind = 'linear', fill_value = "extrapolate")(Carriers)
+        H_abs = np.mean(np.abs(H_est), axis = 0)
+        H_pha = np.mean(np.angle(H_est), axis = 0)
 
-            if(indFrame == numOFDMframes - 1):
-                H_abs = H_abs/numOFDMframes
-                H_pha = H_pha/numOFDMframes
+        if Np > 1:
+            ind, w, order = interpWeights(pilotCarriers, Carriers)
+            H_abs = (1 - w)*H_abs[order][ind] + w*H_abs[order][ind + 1]
+            H_pha = (1 - w)*H_pha[order][ind] + w*H_pha[order][ind + 1]
 
-        for indFrame in range(numOFDMframes):
-            symbRx_OFDM_par[indFrame, :] = symbRx_OFDM_par[indFrame, :] / (H_abs*np.exp(H_pha))
+        symbRx_OFDM_par = symbRx_OFDM_par / (H_abs*np.exp(1j*H_pha))
 
         # Pilot extraction
-        symbRx_OFDM_par = symbRx_OFDM_par[:, dataCarriers]
+        symbRx_OFDM_par = symbRx_OFDM_par[:, dataCarriers(N, pilotCarriers)]
+
+    return symbRx_OFDM_par.reshape(-1)
+
+
+def schmidlCoxPreamble(Nfft, G, hermitSym, seed = 0):
+    """
+    Schmidl-Cox training symbol (two identical halves plus cyclic prefix).
+    Parameters
+    ----------
+    Nfft          : scalar
+                    size of FFT (even)
+    G             : scalar
+                    cyclic prefix length
+    hermitSym     : boolean
+                    True-> Real OFDM symbols / False: Complex OFDM symbols 
+    seed          : scalar
+                    seed of the pseudo-random QPSK training sequence
+    Returns
+    -------
+    preamble      : complex-valued np.array
+                    training symbol with cyclic prefix (Nfft + G samples)
+    carriersTx    : complex-valued np.array
+                    training symbols on the Nfft FFT bins (zero on odd bins)
+    """
+    
+    rng  = np.random.default_rng(seed)
+    qpsk = np.exp(1j*np.pi/4*(2*rng.integers(0, 4, Nfft) + 1))
+    
+    # only even FFT bins are used (twice the power, to keep the energy)
+    carriersTx = np.zeros(Nfft, complex)
+    carriersTx[::2] = np.sqrt(2)*qpsk[::2]
+    
+    if hermitSym:
+        carriersTx = hermit(carriersTx[1 : Nfft//2])
+    else:
+        carriersTx[0] = 0
+        
+    preamble = ifft(carriersTx) * np.sqrt(Nfft)
+    preamble = np.concatenate((preamble[Nfft - G:], preamble))
+    
+    return preamble, carriersTx
+
+
+def schmidlCox(sig, L):
+    """
+    Schmidl-Cox timing metric (running sums over a window of L samples).
+    Parameters
+    ----------
+    sig : complex-valued np.array
+          received samples
+    L   : scalar
+          half length of the training symbol (Nfft//2)
+    Returns
+    -------
+    M   : np.array
+          timing metric |P(d)|^2/R(d)^2, for d = 0, ..., len(sig) - 2L
+    P   : complex-valued np.array
+          correlation between the two halves (angle(P)/pi is the carrier
+          frequency offset in subcarrier spacings)
+    """
+    
+    q = np.conjugate(sig[:-L]) * sig[L:]
+    r = np.abs(sig[L:])**2
+    
+    # window sums from cumulative sums
+    cq = np.concatenate(([0], np.cumsum(q)))
+    cr = np.concatenate(([0], np.cumsum(r)))
+    
+    P = cq[L:] - cq[:-L]
+    R = cr[L:] - cr[:-L]
+    
+    M = np.abs(P)**2 / np.maximum(R, np.finfo(float).tiny)**2
+    
+    return M, P
 
-    return symbRx_OFDM_par.reshape(1,-1).reshape(-1,)
\ No newline at end of file
+
+def ofdmRxStream(chunks, Nfft, G, pilot, pilotCarriers, hermitSym, paramRx = None):
+    """
+    Streaming OFDM receiver (generator).
+    
+    The received stream is expected to contain a Schmidl-Cox preamble
+    (see schmidlCoxPreamble) followed by OFDM frames built as in
+    modulateOFDM. Samples are consumed chunk by chunk: the frame timing
+    (and the carrier frequency offset of complex OFDM) are found with the
+    Schmidl-Cox metric, and the demodulated data symbols of each frame are
+    yielded as soon as the frame is complete. Without pilot subcarriers
+    the channel is estimated only once, from the training symbol, so any
+    residual frequency offset or channel drift is not tracked.
+    Parameters
+    ----------
+    chunks        : iterable of complex-valued np.arrays
+                    received samples, in consecutive chunks of any length
+    Nfft          : scalar
+                    size of FFT
+    G             : scalar
+                    cyclic prefix length
+    pilot         : complex-valued scalar
+                    pilot symbol
+    pilotCarriers : np.array
+                    indexes of pilot subcarriers
+    hermitSym     : boolean
+                    True-> Real OFDM symbols / False: Complex OFDM symbols 
+    paramRx       : parameter object (struct)
+                    paramRx.chEst: 'frame' (per-frame pilot estimates) or
+                    'sliding' (mean of the last paramRx.window frames)
+                    [default: 'frame']
+                    
+                    paramRx.window: frames of the sliding estimate [default: 8]
+                    
+                    paramRx.phaseTrack: common phase error correction
+                    with the pilots of each frame (sliding estimates only)
+                    [default: True]
+                    
+                    paramRx.threshold: timing metric threshold [default: 0.5]
+                    
+                    paramRx.backoff: FFT window advance into the cyclic
+                    prefix, in samples (its phase ramp over the subcarriers
+                    is removed after the FFT) [default: G//4]
+                    
+                    paramRx.seed: seed of the training sequence [default: 0]
+    Yields
+    ------
+    symbRx        : complex np.array
+                    demodulated data symbols of one OFDM frame
+    """
+    
+    if paramRx is None:
+        paramRx = parameters()
+        
+    chEst      = getattr(paramRx, 'chEst', 'frame')
+    window     = getattr(paramRx, 'window', 8)
+    phaseTrack = getattr(paramRx, 'phaseTrack', True)
+    threshold  = getattr(paramRx, 'threshold', 0.5)
+    backoff    = getattr(paramRx, 'backoff', G//4)
+    seed       = getattr(paramRx, 'seed', 0)
+    
+    assert chEst in ['frame', 'sliding'], "chEst should be 'frame' or 'sliding'."
+    
+    # Number of pilot subcarriers
+    Np = len(pilotCarriers)
+    
+    # Number of subcarriers
+    N = Nfft//2 - 1 if hermitSym else Nfft
+    L = Nfft//2
+    lenFrame = Nfft + G
+    
+    Carriers = np.arange(0, N)
+    dataInd  = dataCarriers(N, pilotCarriers)
+    
+    _, carriersTr = schmidlCoxPreamble(Nfft, G, hermitSym, seed)
+    if hermitSym:
+        carriersTr = carriersTr[1 : 1 + N]
+    trainInd = np.flatnonzero(carriersTr)
+    
+    # precomputed interpolation weights (training and pilot subcarriers)
+    interpTr = interpWeights(trainInd, Carriers)
+    if Np > 1:
+        interpPil = interpWeights(pilotCarriers, Carriers)
+        
+    def interpChannel(H, weights):
+        # interpolation of magnitude and unwrapped phase (last axis)
+        ind, w, order = weights
+        H_abs = np.abs(H)[..., order]
+        H_pha = np.unwrap(np.angle(H)[..., order], axis = -1)
+        H_abs = (1 - w)*H_abs[..., ind] + w*H_abs[..., ind + 1]
+        H_pha = (1 - w)*H_pha[..., ind] + w*H_pha[..., ind + 1]
+        return H_abs*np.exp(1j*H_pha)
+    
+    # phase ramp of the FFT window advance into the cyclic prefix
+    rampBackoff = np.exp(2j*np.pi*np.arange(Nfft)*backoff/Nfft) / np.sqrt(Nfft)
+    
+    def frameFFT(frames):
+        Y = fft(frames, axis = 1) * rampBackoff
+        return Y[:, 1 : 1 + N] if hermitSym else Y
+    
+    def equalize(Y):
+        # channel estimation and equalization, data subcarriers only
+        nonlocal H_pil
+        if Np == 0:
+            Y = Y / H_tr
+        else:
+            Hp = Y[:, pilotCarriers] / pilot
+            if chEst == 'sliding':
+                H_pil = np.concatenate((H_pil, Hp))
+                cs  = np.concatenate((np.zeros((1, Np)), np.cumsum(H_pil, axis = 0)))
+                lo  = np.maximum(np.arange(len(H_pil)) + 1 - window, 0)
+                Hs  = (cs[1:] - cs[lo]) / (np.arange(len(H_pil)) + 1 - lo).reshape(-1, 1)
+                Hs  = Hs[-len(Y):]
+                H_pil = H_pil[-(window - 1):] if window > 1 else H_pil[:0]
+            else:
+                Hs = Hp
+                
+            H = interpChannel(Hs, interpPil) if Np > 1 else Hs * np.ones((1, N))
+            Y = Y / H
+            
+            if chEst == 'sliding' and phaseTrack:
+                # common phase error of each frame
+                cpe = np.angle(np.sum(Y[:, pilotCarriers] * np.conjugate(pilot), axis = 1))
+                Y = Y * np.exp(-1j*cpe).reshape(-1, 1)
+                
+        return Y[:, dataInd]
+    
+    buffer = np.zeros(0, complex)
+    offset = 0         # absolute index of buffer[0]
+    start  = None      # absolute index of the next FFT window
+    ε      = 0         # carrier frequency offset (subcarrier spacings)
+    H_pil  = np.zeros((0, Np), complex)  # last pilot estimates (sliding)
+    
+    for chunk in chunks:
+        chunk = np.asarray(chunk, complex)
+        if start is not None and ε != 0:
+            n = offset + len(buffer) + np.arange(len(chunk))
+            chunk = chunk * np.exp(-2j*np.pi*ε*n/Nfft)
+        buffer = np.concatenate((buffer, chunk))
+        
+        if start is None:
+            # frame synchronization
+            if len(buffer) < 2*L + G + L:
+                continue
+            M, P = schmidlCox(buffer, L)
+            cand = np.flatnonzero(M > threshold)
+            cand = cand[cand + G + L < len(M)]
+            if len(cand) == 0:
+                # keep only the samples that may still hold the preamble
+                drop = max(len(buffer) - (2*L + 2*G + L), 0)
+                buffer = buffer[drop:]
+                offset += drop
+                continue
+            
+            # middle of the metric plateau (cyclic prefix of the preamble)
+            d0   = cand[0]
+            win  = M[d0 : d0 + G + L]
+            peak = np.flatnonzero(win > 0.9*np.max(win))
+            dMid = d0 + (peak[0] + peak[-1])//2
+            
+            bodyStart = dMid + G//2
+            if not hermitSym:
+                ε = np.angle(P[dMid]) / np.pi
+                n = offset + np.arange(len(buffer))
+                buffer = buffer * np.exp(-2j*np.pi*ε*n/Nfft)
+            
+            # training symbol channel estimate
+            ind = bodyStart - backoff
+            Y   = frameFFT(buffer[ind : ind + Nfft].reshape(1, -1))[0]
+            H_tr = interpChannel(Y[trainInd] / carriersTr[trainInd], interpTr)
+            
+            start  = offset + bodyStart + Nfft + G - backoff
+            drop   = start - offset
+            buffer = buffer[drop:]
+            offset = start
+            
+        # all complete frames in the buffer at once
+        nFrames = len(buffer) // lenFrame
+        if nFrames == 0:
+            continue
+        
+        idx    = np.arange(nFrames).reshape(-1, 1)*lenFrame + np.arange(Nfft)
+        Y      = frameFFT(buffer[idx])
+        buffer = buffer[nFrames*lenFrame:]
+        offset += nFrames*lenFrame
+        
+        yield from equalize(Y)
+        
+    # the last frame only needs Nfft samples after its window start
+    if start is not None and len(buffer) >= Nfft:
+        yield from equalize(frameFFT(buffer[:Nfft].reshape(1, -1)))
@@ -0,0 +1,555 @@
+"""Probabilistic constellation shaping utilities."""
+import numpy as np
+from numba import njit, prange
+
+from optic.core import parameters
+from optic.modulation import getConstellation, hardDecision
+
+
+def maxwellBoltzmann(λ, constSymb):
+    """
+    Maxwell-Boltzmann distribution of the constellation symbols.
+
+    Parameters
+    ----------
+    λ : scalar
+        Shaping parameter (λ = 0 gives the uniform distribution).
+    constSymb : np.array
+        Constellation symbols.
+
+    Returns
+    -------
+    px : np.array
+        Probability mass function (p.m.f.) of the constellation symbols.
+
+    """
+    energy = np.abs(constSymb) ** 2
+    px = np.exp(-λ * (energy - np.min(energy)))
+
+    return px / np.sum(px)
+
+
+def entropy(px):
+    """
+    Entropy of a discrete distribution in bits.
+
+    Parameters
+    ----------
+    px : np.array
+        Probability mass function.
+
+    Returns
+    -------
+    scalar
+        Entropy in bits.
+
+    """
+    px = px[px > 0]
+    return -np.sum(px * np.log2(px))
+
+
+def mbDistribution(M, constType, H, tol=1e-9, maxIter=200):
+    """
+    Maxwell-Boltzmann distribution with a target entropy.
+
+    The shaping parameter λ is found by bisection, since the entropy of the
+    Maxwell-Boltzmann distribution is monotonically decreasing in λ, from
+    log2(M) down to log2 of the number of minimum-energy symbols.
+
+    Parameters
+    ----------
+    M : int
+        Modulation order.
+    constType : string
+        Modulation type: 'qam', 'pam' or 'ook'.
+    H : scalar
+        Target entropy in bits/symbol (0 < H <= log2(M)).
+    tol : scalar, optional
+        Tolerance on the entropy. The default is 1e-9.
+    maxIter : int, optional
+        Maximum number of bracketing and bisection iterations. The default
+        is 200.
+
+    Raises
+    ------
+    ValueError
+        If H is not above the entropy of the uniform distribution over the
+        minimum-energy symbols (e.g. any H < log2(M) for 'psk', whose
+        symbols all have the same energy).
+
+    Returns
+    -------
+    px : np.array
+        Probability mass function of the constellation symbols.
+    λ : scalar
+        Shaping parameter, for the constellation normalized to unit energy.
+
+    """
+    assert 0 < H <= np.log2(M), "target entropy should be in (0, log2(M)]"
+
+    const = getConstellation(M, constType)
+    constSymb = const.symb / np.sqrt(const.Es)
+
+    if H >= np.log2(M) - tol:
+        return np.ones(M) / M, 0.0
+
+    # entropy of the limit λ -> inf
+    energy = np.abs(constSymb) ** 2
+    Hmin = np.log2(np.sum(np.isclose(energy, np.min(energy))))
+    if H <= Hmin:
+        raise ValueError(
+            f"target entropy should be above {Hmin:.3f} bits/symbol for "
+            f"{M}-{constType.upper()} (uniform over its minimum-energy symbols)."
+        )
+
+    # find an upper bound for λ
+    λmin, λmax = 0.0, 1.0
+    for _ in range(maxIter):
+        if entropy(maxwellBoltzmann(λmax, constSymb)) <= H:
+            break
+        λmax *= 2
+
+    for _ in range(maxIter):
+        λ = (λmin + λmax) / 2
+        Hλ = entropy(maxwellBoltzmann(λ, constSymb))
+        if np.abs(Hλ - H) < tol:
+            break
+        elif Hλ > H:
+            λmin = λ
+        else:
+            λmax = λ
+
+    return maxwellBoltzmann(λ, constSymb), λ
+
+
+def ccdmInit(px, n):
+    """
+    Initialize a constant composition distribution matcher (CCDM).
+
+    The target distribution is quantized to a composition (number of
+    occurrences of each symbol) of a block of n output symbols. Every
+    block of k input bits is mapped to one sequence of the type class of
+    this composition by exact enumerative coding (unranking of the k-bit
+    value with multi-precision integers), and dematched by ranking.
+
+    Parameters
+    ----------
+    px : np.array
+        Target probability mass function of the output symbols.
+    n : int
+        Number of output symbols per block.
+
+    Returns
+    -------
+    ccdm : parameters object (struct)
+        ccdm.n: output block length.
+        ccdm.k: number of input bits per block.
+        ccdm.counts: composition of the output blocks.
+        ccdm.px: quantized distribution (counts/n).
+        ccdm.rate: matching rate (k/n) in bits/symbol.
+        ccdm.rateLoss: n*H(ccdm.px) - k in bits/block.
+
+    """
+    px = np.asarray(px, dtype=np.float64).reshape(-1)
+    counts = quantizeComposition(px, n)
+
+    # number of 32-bit limbs needed to represent the type class size
+    nBitsMax = n * np.log2(len(px)) + 64
+    W = int(np.ceil(nBitsMax / 32)) + 1
+
+    N = multinomial(counts, W)
+    k = bitLength(N) - 1
+
+    ccdm = parameters()
+    ccdm.n = int(n)
+    ccdm.k = int(k)
+    ccdm.M = len(px)
+    ccdm.counts = counts
+    ccdm.px = counts / n
+    ccdm.rate = k / n
+    ccdm.rateLoss = n * entropy(counts / n) - k
+    ccdm.N = N
+    ccdm.W = W
+
+    return ccdm
+
+
+def quantizeComposition(px, n):
+    """
+    Quantize a distribution to a composition of n symbols.
+
+    Parameters
+    ----------
+    px : np.array
+        Probability mass function.
+    n : int
+        Number of symbols.
+
+    Returns
+    -------
+    counts : np.array of ints
+        Number of occurrences of each symbol (sum(counts) = n).
+
+    """
+    counts = np.floor(n * px).astype(np.int64)
+
+    # distribute the remaining symbols to the largest residuals
+    res = n * px - counts
+    for ind in np.argsort(-res, kind="stable")[: n - np.sum(counts)]:
+        counts[ind] += 1
+
+    return counts
+
+
+def ccdmMatch(bits, ccdm):
+    """
+    Distribution matching: map bits to constant composition sequences.
+
+    Parameters
+    ----------
+    bits : np.array of ints
+        Sequence of data bits (length multiple of ccdm.k).
+    ccdm : parameters object (struct)
+        CCDM parameters (see ccdmInit).
+
+    Returns
+    -------
+    symbInd : np.array of ints
+        Sequence of symbol indexes (ccdm.n per block of ccdm.k bits).
+
+    """
+    bits = np.asarray(bits).reshape(-1, ccdm.k).astype(np.uint8)
+
+    return ccdmUnrank(bits, ccdm.counts, ccdm.N).reshape(-1)
+
+
+def ccdmDematch(symbInd, ccdm):
+    """
+    Distribution dematching: map constant composition sequences to bits.
+
+    Parameters
+    ----------
+    symbInd : np.array of ints
+        Sequence of symbol indexes (length multiple of ccdm.n).
+    ccdm : parameters object (struct)
+        CCDM parameters (see ccdmInit).
+
+    Returns
+    -------
+    bits : np.array of ints
+        Sequence of data bits (ccdm.k per block of ccdm.n symbols).
+
+    """
+    symbInd = np.asarray(symbInd).reshape(-1, ccdm.n).astype(np.int64)
+
+    return ccdmRank(symbInd, ccdm.counts, ccdm.N, ccdm.k).reshape(-1)
+
+
+def modulatePS(bits, M, constType, ccdm):
+    """
+    Modulate bits to probabilistically shaped constellation symbols.
+
+    Parameters
+    ----------
+    bits : np.array of ints
+        Sequence of data bits (length multiple of ccdm.k).
+    M : int
+        Modulation order.
+    constType : string
+        Modulation type: 'qam', 'pam' or 'ook'.
+    ccdm : parameters object (struct)
+        CCDM parameters (see ccdmInit), with ccdm.M = M.
+
+    Returns
+    -------
+    np.array
+        Shaped constellation symbols.
+
+    """
+    assert ccdm.M == M, "ccdm alphabet size should be equal to M"
+
+    return getConstellation(M, constType).symb[ccdmMatch(bits, ccdm)]
+
+
+def demodulatePS(symb, M, constType, ccdm):
+    """
+    Demodulate shaped constellation symbols to bits (hard decision).
+
+    Parameters
+    ----------
+    symb : np.array
+        Received constellation symbols (in the scale of GrayMapping).
+    M : int
+        Modulation order.
+    constType : string
+        Modulation type: 'qam', 'pam' or 'ook'.
+    ccdm : parameters object (struct)
+        CCDM parameters (see ccdmInit), with ccdm.M = M.
+
+    Returns
+    -------
+    np.array of ints
+        Sequence of dematched data bits.
+
+    """
+    return ccdmDematch(hardDecision(symb, M, constType), ccdm)
+
+
+def multinomial(counts, W):
+    """
+    Multinomial coefficient n!/(c_1!...c_M!) as a multi-precision integer.
+
+    Parameters
+    ----------
+    counts : np.array of ints
+        Composition.
+    W : int
+        Number of 32-bit limbs of the result.
+
+    Returns
+    -------
+    N : np.array of uint64
+        Multinomial coefficient (little-endian base-2^32 limbs).
+
+    """
+    N = np.zeros(W, dtype=np.uint64)
+    N[0] = 1
+    m = 0
+    for c in counts:
+        for t in range(1, c + 1):
+            m += 1
+            bigMulSmall(N, m, W)
+            bigDivSmall(N, t, W)
+    return N
+
+
+def bitLength(x):
+    """
+    Number of bits of a multi-precision integer.
+
+    Parameters
+    ----------
+    x : np.array of uint64
+        Multi-precision integer (little-endian base-2^32 limbs).
+
+    Returns
+    -------
+    int
+        Bit length of x.
+
+    """
+    nz = np.nonzero(x)[0]
+    if len(nz) == 0:
+        return 0
+    top = nz[-1]
+    return int(32 * top + int(x[top]).bit_length())
+
+
+@njit
+def bigMulSmall(x, a, w):
+    """Multiply the multi-precision integer x by a (in place)."""
+    carry = np.uint64(0)
+    a_ = np.uint64(a)
+    for i in range(w):
+        t = x[i] * a_ + carry
+        x[i] = t & np.uint64(0xFFFFFFFF)
+        carry = t >> np.uint64(32)
+
+
+@njit
+def bigDivSmall(x, a, w):
+    """Divide the multi-precision integer x by a (in place, floor)."""
+    rem = np.uint64(0)
+    a_ = np.uint64(a)
+    for i in range(w - 1, -1, -1):
+        t = (rem << np.uint64(32)) | x[i]
+        x[i] = t // a_
+        rem = t - x[i] * a_
+
+
+@njit
+def bigLess(x, y, w):
+    """Check whether x < y."""
+    for i in range(w - 1, -1, -1):
+        if x[i] != y[i]:
+            return x[i] < y[i]
+    return False
+
+
+@njit
+def bigSub(x, y, w):
+    """Subtract y from x (in place, x >= y)."""
+    borrow = np.uint64(0)
+    for i in range(w):
+        t = y[i] + borrow
+        if x[i] >= t:
+            x[i] = x[i] - t
+            borrow = np.uint64(0)
+        else:
+            x[i] = x[i] + (np.uint64(1) << np.uint64(32)) - t
+            borrow = np.uint64(1)
+
+
+@njit
+def bigAdd(x, y, w):
+    """Add y to x (in place)."""
+    carry = np.uint64(0)
+    for i in range(w):
+        t = x[i] + y[i] + carry
+        x[i] = t & np.uint64(0xFFFFFFFF)
+        carry = t >> np.uint64(32)
+
+
+@njit
+def activeLimbs(x, w):
+    """Number of limbs of x up to its most significant non-zero limb."""
+    while w > 1 and x[w - 1] == 0:
+        w -= 1
+    return w
+
+
+@njit
+def bigMulSmallTo(y, x, a, w):
+    """Compute y = a*x on w limbs."""
+    y[:w] = x[:w]
+    bigMulSmall(y, a, w)
+
+
+@njit(parallel=True)
+def ccdmUnrank(bits, counts, N):
+    """
+    CCDM matcher core: map k-bit blocks to sequences of a type class.
+
+    At each output position, the symbol a is selected such that
+    N*C[a-1] <= v*n < N*C[a], where v is the residual input value, N the
+    size of the remaining type class, n the number of remaining symbols and
+    C the cumulative composition. The search is a bisection over the
+    alphabet.
+
+    Parameters
+    ----------
+    bits : (Nblocks, k) np.array of uint8
+        Input bit blocks (MSB first).
+    counts : np.array of ints
+        Composition of the output sequences.
+    N : np.array of uint64
+        Size of the type class (multi-precision).
+
+    Returns
+    -------
+    symbInd : (Nblocks, n) np.array of ints
+        Output sequences.
+
+    """
+    nBlocks, k = bits.shape
+    n = np.sum(counts)
+    M = len(counts)
+    W = len(N)
+    symbInd = np.zeros((nBlocks, n), dtype=np.int64)
+
+    for b in prange(nBlocks):
+        v = np.zeros(W, dtype=np.uint64)
+        for t in range(k):
+            p = k - 1 - t
+            if bits[b, t]:
+                v[p // 32] |= np.uint64(1) << np.uint64(p % 32)
+
+        cumCounts = np.cumsum(counts)
+        Nrem = N.copy()
+        V = np.zeros(W, dtype=np.uint64)
+        T = np.zeros(W, dtype=np.uint64)
+        w = activeLimbs(Nrem, W)
+
+        for j in range(n):
+            nrem = n - j
+            ww = min(w + 2, W)
+            Nrem[w:ww] = 0
+            v[w:ww] = 0
+            bigMulSmallTo(V, v, nrem, ww)
+
+            # bisection: smallest a such that v*nrem < Nrem*C[a]
+            lo, hi = 0, M - 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                bigMulSmallTo(T, Nrem, cumCounts[mid], ww)
+                if bigLess(V, T, ww):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            a = lo
+            symbInd[b, j] = a
+
+            # v <- v - Nrem*C[a-1]/nrem, Nrem <- Nrem*c[a]/nrem
+            if a > 0:
+                bigMulSmallTo(T, Nrem, cumCounts[a - 1], ww)
+                bigDivSmall(T, nrem, ww)
+                bigSub(v, T, ww)
+                ca = cumCounts[a] - cumCounts[a - 1]
+            else:
+                ca = cumCounts[0]
+            bigMulSmall(Nrem, ca, ww)
+            bigDivSmall(Nrem, nrem, ww)
+            cumCounts[a:] -= 1
+            w = activeLimbs(Nrem, ww)
+
+    return symbInd
+
+
+@njit(parallel=True)
+def ccdmRank(symbInd, counts, N, k):
+    """
+    CCDM dematcher core: map sequences of a type class to k-bit blocks.
+
+    Parameters
+    ----------
+    symbInd : (Nblocks, n) np.array of ints
+        Input sequences.
+    counts : np.array of ints
+        Composition of the sequences.
+    N : np.array of uint64
+        Size of the type class (multi-precision).
+    k : int
+        Number of bits per block.
+
+    Returns
+    -------
+    bits : (Nblocks, k) np.array of uint8
+        Output bit blocks (MSB first).
+
+    """
+    nBlocks, n = symbInd.shape
+    W = len(N)
+    bits = np.zeros((nBlocks, k), dtype=np.uint8)
+
+    for b in prange(nBlocks):
+        v = np.zeros(W, dtype=np.uint64)
+        cumCounts = np.cumsum(counts)
+        Nrem = N.copy()
+        T = np.zeros(W, dtype=np.uint64)
+        w = activeLimbs(Nrem, W)
+
+        for j in range(n):
+            nrem = n - j
+            ww = min(w + 2, W)
+            Nrem[w:ww] = 0
+            x = symbInd[b, j]
+            cx = cumCounts[x] - cumCounts[x - 1] if x > 0 else cumCounts[0]
+            if cx <= 0:  # sequence out of the type class (errors)
+                continue
+
+            # v <- v + Nrem*C[x-1]/nrem, Nrem <- Nrem*c[x]/nrem
+            if x > 0:
+                bigMulSmallTo(T, Nrem, cumCounts[x - 1], ww)
+                bigDivSmall(T, nrem, ww)
+                T[ww:] = 0
+                bigAdd(v, T, W)
+            bigMulSmall(Nrem, cx, ww)
+            bigDivSmall(Nrem, nrem, ww)
+            cumCounts[x:] -= 1
+            w = activeLimbs(Nrem, ww)
+
+        for t in range(k):
+            p = k - 1 - t
+            bits[b, t] = (v[p // 32] >> np.uint64(p % 32)) & np.uint64(1)
+
+    return bits
@@ -6,6 +6,7 @@ from optic.dsp import pnorm, pulseShape
 from optic.metrics import signal_power
 from optic.models import iqm, phaseNoise
 from optic.modulation import GrayMapping, modulateGray
+from optic.shaping import ccdmInit, mbDistribution, modulatePS
 
 try:
     from optic.dspGPU import firFilter
@@ -36,6 +37,9 @@ def simpleWDMTx(param):
     :param.lw: laser linewidth [Hz][default: 100 kHz]
     :param.freqSpac: frequency spacing of the WDM grid [Hz][default: 40e9 Hz]
     :param.Nmodes: number of polarization modes [default: 1]
+    :param.shapingH: target entropy of the probabilistically shaped (Maxwell-
+    Boltzmann) symbols, 'qam' only [bits/symbol][default: None (uniform symbols)]
+    :param.dmBlockLen: block length of the CCDM distribution matcher [default: 512]
 
     """
     # check input parameters
@@ -54,6 +58,8 @@ def simpleWDMTx(param):
     param.freqSpac = getattr(param, "freqSpac", 50e9)
     param.Nmodes = getattr(param, "Nmodes", 1)
     param.prgsBar = getattr(param, "prgsBar", True)
+    param.shapingH = getattr(param, "shapingH", None)
+    param.dmBlockLen = getattr(param, "dmBlockLen", 512)
 
     # transmitter parameters
     Ts = 1 / param.Rs  # symbol period [s]
@@ -100,6 +106,16 @@ def simpleWDMTx(param):
     const = GrayMapping(param.M, param.constType)
     Es = np.mean(np.abs(const) ** 2)
 
+    # probabilistic shaping
+    if param.shapingH is not None:
+        px, _ = mbDistribution(param.M, param.constType, param.shapingH)
+        ccdm = ccdmInit(px, param.dmBlockLen)
+        nSymb = len(t) // param.SpS
+        nBlocks = int(np.ceil(nSymb / ccdm.n))
+
+        param.px = ccdm.px  # symbol p.m.f. (e.g., for GMI evaluation)
+        Es = np.sum(np.abs(const) ** 2 * ccdm.px)
+
     # pulse shaping filter
     if param.pulse == "nrz":
         pulse = pulseShape("nrz", param.SpS)
@@ -124,11 +140,19 @@ def simpleWDMTx(param):
                 % (indMode, 10 * np.log10((Pch[indCh] / param.Nmodes) / 1e-3))
             )
 
-            # generate random bits
-            bitsTx = np.random.randint(2, size=param.Nbits)
+            if param.shapingH is None:
+                # generate random bits
+                bitsTx = np.random.randint(2, size=param.Nbits)
+
+                # map bits to constellation symbols
+                symbTx = modulateGray(bitsTx, param.M, param.constType)
+            else:
+                # generate random bits
+                bitsTx = np.random.randint(2, size=nBlocks * ccdm.k)
 
-            # map bits to constellation symbols
-            symbTx = modulateGray(bitsTx, param.M, param.constType)
+                # map bits to shaped constellation symbols
+                symbTx = modulatePS(bitsTx, param.M, param.constType, ccdm)
+                symbTx = symbTx[:nSymb]
 
             # normalize symbols energy to 1
             symbTx = symbTx / np.sqrt(Es)